@@ -34,9 +34,10 @@ from typing import List, Dict, Tuple, Set, Any, Optional, Callable, Union, TYPE_
 from enum import Enum
 from types import SimpleNamespace
 
-from multiprocessing import Queue
+import threading
+import itertools
 
-import urllib.request  # For custom album art size
+import urllib.parse
 from functools import lru_cache
 import asyncio
 import json
@@ -45,8 +46,6 @@ import pathlib
 from subprocess import Popen
 from time import sleep
 
-from PIL import Image  # For custom album art size
-
 # web framework
 from fastapi import FastAPI, Request, Response, HTTPException, Depends, Path
 from fastapi.openapi.utils import get_openapi  # docs
@@ -54,12 +53,16 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.routing import APIRoute, APIRouter
 from fastapi.templating import Jinja2Templates
 from starlette.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+import anyio.to_thread
 from sse_starlette.sse import EventSourceResponse
 
 # amplipi
 import amplipi.utils as utils
 import amplipi.models as models
 import amplipi.defaults as defaults
+import amplipi.encodings as encodings
+import amplipi.art as art
 from amplipi.ctrl import Api, ApiResponse, ApiCode  # we don't import ctrl here to avoid naming ambiguity with a ctrl variable
 from amplipi.auth import CookieOrParamAPIKey, router as auth_router, NotAuthenticatedException, not_authenticated_exception_handler
 
@@ -157,17 +160,28 @@ class params(SimpleNamespace):
                    description="Number found on the end of a pandora url while playing the station, ie 4610303469018478727 in https://www.pandora.com/station/play/4610303469018478727")
   ParentID = Path(..., ge=0, description="ID of the browsable item to browse")
   ChildID = Path(..., ge=0, description="ID of the child item to play")
+  AnnouncementID = Path(..., ge=1, description="Announcement ID")
   ImageHeight = Path(..., ge=1, le=500, description="Image Height in pixels")
 
 
 api = SimplifyingRouter(dependencies=[Depends(CookieOrParamAPIKey)])
 
+# responses that can also be encoded in one of the binary encodings, see snapshot_response
+BINARY_RESPONSES: Dict[Union[int, str], Dict[str, Any]] = {
+  200: {'content': {encodings.MSGPACK: {}, encodings.CBOR: {}}}
+}
 
-@api.get('/api', tags=['status'])
-@api.get('/api/', tags=['status'])
-def get_status(ctrl: Api = Depends(get_ctrl)) -> models.Status:
-  """ Get the system status and configuration """
-  return ctrl.get_state()
+
+@api.get('/api', tags=['status'], response_model=models.Status, responses=BINARY_RESPONSES)
+@api.get('/api/', tags=['status'], response_model=models.Status, responses=BINARY_RESPONSES)
+def get_status(request: Request, ctrl: Api = Depends(get_ctrl)) -> Union[models.Status, Response]:
+  """ Get the system status and configuration
+
+  The response has an ETag, pass it back using If-None-Match to get a 304 Not Modified response
+  if the status hasn't changed. Send `Accept: application/msgpack` or `Accept: application/cbor`
+  to get the status in a compact binary encoding instead of JSON.
+  """
+  return snapshot_response(request, ctrl)
 
 
 @api.post('/api/load', tags=['config'])
@@ -258,41 +272,163 @@ def lms_mode(ctrl: Api = Depends(get_ctrl)):
   load_config(new_config, ctrl)
 
 
-subscribers: Dict[int, 'Queue[models.Status]'] = {}
+class Subscriber:
+  """ A client subscribed to status changes
 
+  Messages can be pushed from any thread without blocking, a subscriber that can't keep up is dropped.
+  """
 
-def notify_on_change(status: models.Status) -> None:
-  """ Notify subscribers that something has changed """
-  for msg_que in subscribers.values():
-    msg_que.put(status)
+  def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = 32):
+    self.loop = loop
+    self.queue: 'asyncio.Queue[Optional[Tuple[str, str]]]' = asyncio.Queue(maxsize)
+    self.dropped = False
 
-# @api.get('/api/subscribe') # TODO: uncomment this to add SSE Support and properly document it
+  def push(self, msg: str, event: str = 'delta') -> None:
+    """ Queue a message for the subscriber (thread safe) """
+    self.loop.call_soon_threadsafe(self._put, (event, msg))
 
+  def _put(self, msg: Tuple[str, str]) -> None:
+    if self.dropped:
+      return
+    try:
+      self.queue.put_nowait(msg)
+    except asyncio.QueueFull:
+      # too slow to keep up, end its stream. EventSource clients reconnect and get a fresh snapshot
+      self.dropped = True
+      while not self.queue.empty():
+        self.queue.get_nowait()
+      self.queue.put_nowait(None)
 
-async def subscribe(req: Request):
-  """ Subscribe to SSE events """
-  msg_que: Queue = Queue(3)
-  next_sub = max(subscribers.keys(), default=0) + 1
-  subscribers[next_sub] = msg_que
+
+subscribers: Dict[int, Subscriber] = {}
+_subscriber_ids = itertools.count(1)
+_subscribers_lock = threading.RLock()
+# the last status sent to the subscribers, deltas are computed against it (only tracked while there are subscribers)
+_last_status: Optional[Dict] = None
+
+
+def notify_on_change(status: models.Status) -> None:
+  """ Notify subscribers that something has changed, sending them only the entities that changed """
+  global _last_status
+  with _subscribers_lock:
+    if not subscribers:
+      _last_status = None
+      return
+    new_status = status.dict(exclude_none=True)
+    delta = utils.status_delta(_last_status or {}, new_status)
+    _last_status = new_status
+    if not delta:
+      return
+    msg = json.dumps(delta)
+    for sub in list(subscribers.values()):
+      try:
+        sub.push(msg)
+      except RuntimeError:
+        pass  # the subscriber's event loop is closed
+
+
+def notify_event(event: str, msg: str) -> None:
+  """ Send an event other than a status change to every subscriber """
+  with _subscribers_lock:
+    for sub in list(subscribers.values()):
+      try:
+        sub.push(msg, event)
+      except RuntimeError:
+        pass  # the subscriber's event loop is closed
+
+
+def _add_subscriber(ctrl: Api, sub: Subscriber) -> Tuple[int, str]:
+  """ Register a subscriber, returning its id and the status snapshot the following deltas apply to """
+  global _last_status
+  # get the state before taking the subscribers lock, changes notify the subscribers while holding the state lock
+  # so taking the locks in the opposite order could deadlock. A change made in between is still sent to the new
+  # subscriber since the next delta is computed against this state.
+  state = ctrl.get_state().dict(exclude_none=True)
+  with _subscribers_lock:
+    if _last_status is None:
+      _last_status = state
+    sub_id = next(_subscriber_ids)
+    subscribers[sub_id] = sub
+    return sub_id, json.dumps(_last_status)
+
+
+def _remove_subscriber(sub_id: int) -> None:
+  global _last_status
+  with _subscribers_lock:
+    subscribers.pop(sub_id, None)
+    if not subscribers:
+      _last_status = None
+
+
+@api.get('/api/subscribe', tags=['status'], response_class=EventSourceResponse)
+async def subscribe(req: Request, ctrl: Api = Depends(get_ctrl)):
+  """ Subscribe to status changes using Server-Sent Events
+
+  The first event, `status`, is a full snapshot of the system status.
+  Every following `delta` event only contains what changed since the previous event:
+  for each list of entities (zones, sources, groups, streams, presets) the full entities that changed or were added
+  are listed in `changed` and the ids of deleted entities in `removed`, any other changed field is sent as is
+  and a field that was removed is sent as null.
+  An `announcement` event with the announcement's job is sent when a queued announcement finishes.
+
+  Subscribers that fall behind are disconnected, reconnecting provides a new snapshot.
+  """
+  sub = Subscriber(asyncio.get_event_loop())
+  sub_id, snapshot = await run_in_threadpool(_add_subscriber, ctrl, sub)
 
   async def stream():
     try:
+      yield {'event': 'status', 'data': snapshot}
       while True:
-        if await req.is_disconnected():
-          logging.info('disconnected')
+        msg = await sub.queue.get()
+        if msg is None:
+          logging.info(f'Dropping slow subscriber {req.client}')
           break
-        if not msg_que.empty():
-          msg = msg_que.get()
-          yield msg
-        await asyncio.sleep(0.2)
-      logging.info(f"Disconnected from client {req.client}")
+        event, data = msg
+        yield {'event': event, 'data': data}
     except asyncio.CancelledError as exc:
       logging.info(f"Disconnected from client (via refresh/close) {req.client}")
-      # Do any other cleanup, if any
       raise exc
+    finally:
+      _remove_subscriber(sub_id)
   return EventSourceResponse(stream())
 
 
+@api.get('/api/changes', tags=['status'])
+def get_changes(since: int, ctrl: Api = Depends(get_ctrl)) -> models.StatusChanges:
+  """ Get the zones, sources, groups, streams and presets that changed since version **since** of the status
+
+  Start from the `X-Status-Version` header of the full status (`/api`), then from the version returned by the
+  previous call. When the changes since **since** are no longer available `resync` is set,
+  get the full status again and continue from its version.
+  """
+  return ctrl.get_changes(since)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+  """ Check if an If-None-Match header matches an ETag """
+  if not if_none_match:
+    return False
+  tags = [tag.strip() for tag in if_none_match.split(',')]
+  return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def wants_binary(request: Request) -> bool:
+  """ Check if the client asked for one of the binary encodings instead of JSON """
+  return encodings.negotiate(request.headers.get('accept')) != encodings.JSON
+
+
+def snapshot_response(request: Request, ctrl: Api, section: Optional[str] = None) -> Response:
+  """ Respond with the status snapshot, or just its @section, in the encoding negotiated with the client """
+  media_type = encodings.negotiate(request.headers.get('accept'))
+  snapshot = ctrl.get_state_snapshot()
+  etag = snapshot.etag_of(media_type, section)
+  headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept', 'X-Status-Version': str(snapshot.version)}
+  if etag_matches(request.headers.get('if-none-match'), etag):
+    return Response(status_code=304, headers=headers)
+  return Response(content=snapshot.encoded(media_type, section), media_type=media_type, headers=headers)
+
+
 def code_response(ctrl: Api, resp: Union[ApiResponse, models.BaseModel]):
   """ Convert amplipi.ctrl.Api responses to json/http responses """
   if isinstance(resp, ApiResponse):
@@ -317,9 +453,11 @@ def code_response(ctrl: Api, resp: Union[ApiResponse, models.BaseModel]):
 # sources
 
 
-@api.get('/api/sources', tags=['source'])
-def get_sources(ctrl: Api = Depends(get_ctrl)) -> Dict[str, List[models.Source]]:
+@api.get('/api/sources', tags=['source'], response_model=Dict[str, List[models.Source]], responses=BINARY_RESPONSES)
+def get_sources(request: Request, ctrl: Api = Depends(get_ctrl)) -> Union[Dict[str, List[models.Source]], Response]:
   """ Get all sources """
+  if wants_binary(request):
+    return snapshot_response(request, ctrl, 'sources')
   return {'sources': ctrl.get_state().sources}
 
 
@@ -331,6 +469,25 @@ def get_source(ctrl: Api = Depends(get_ctrl), sid: int = params.SourceID) -> mod
   return sources[sid]
 
 
+@api.get(
+  '/api/sources/{sid}/inputs', tags=['source'],
+  responses={
+    200: {
+      'content': {'application/json': {
+        'example': {'': '', 'stream=996': 'Input 1 - rca', 'stream=1000': 'Groove Salad - internetradio'}
+      }}
+    }
+  }
+)
+def get_source_inputs(ctrl: Api = Depends(get_ctrl), sid: int = params.SourceID) -> Dict[str, str]:
+  """ Get the inputs source **sid** can be connected to, with a user friendly name for each
+
+  The inputs are computed once and reused until a stream is added, changed or removed or the source's input changes.
+  """
+  sources = ctrl.get_state().sources
+  return {str(i): name for i, name in ctrl.get_inputs(sources[sid]).items()}
+
+
 @api.patch('/api/sources/{sid}', tags=['source'])
 def set_source(update: models.SourceUpdate, ctrl: Api = Depends(get_ctrl), sid: int = params.SourceID) -> models.Status:
   """ Update a source's configuration (source=**sid**) """
@@ -353,51 +510,36 @@ def set_source(update: models.SourceUpdate, ctrl: Api = Depends(get_ctrl), sid:
     }
   },
 )
-async def get_image(ctrl: Api = Depends(get_ctrl), sid: int = params.SourceID, height: int = params.ImageHeight):
+async def get_image(request: Request, ctrl: Api = Depends(get_ctrl), sid: int = params.SourceID, height: int = params.ImageHeight):
   """ Get a square jpeg image representing the current media playing on source @sid
 
   This was added to support low power touch panels """
-  width = height  # square image
   source_info = ctrl.status.sources[sid].info
-  if source_info is None or source_info.img_url is None:
-    uri = 'static/imgs/disconnected.png'
-  else:
-    uri = source_info.img_url
-  if uri.startswith('static/'):
-    # for files we need to convert from webserver url to internal file url
-    uri = uri.replace('static/', STATIC_DIR + '/')
-    uri = uri.replace('rca_inputs.svg', 'rca_inputs.jpg')  # pillow can't handle svg files for our use case
-
-  # TODO: writing images to /tmp adds file system pressure
-  # we should write only a couple to RAM disk instead and manage a small amount of garbage collection
-  img_tmp = f'/tmp/{os.path.basename(uri)}'
-  img_tmp_jpg = f'{img_tmp}-{height}x{width}.jpg'
-
-  if not os.path.exists(img_tmp_jpg):
-    is_file = os.path.exists(uri)
-    if is_file:
-      img_tmp = uri
-    else:
-      img_tmp, _ = urllib.request.urlretrieve(uri, img_tmp)
-    size = height, width
-    img = Image.open(img_tmp)
-    img.thumbnail(size)
-    img = img.convert(mode="RGB")
-    img.save(img_tmp_jpg)
-    if not is_file:
-      # remove temporary downloads
-      os.remove(img_tmp)
+  uri = art.source_art(source_info.img_url if source_info else None, STATIC_DIR)
+
+  # the art is downloaded and scaled on the art cache's threads, keeping the event loop free
+  img = await asyncio.wrap_future(art.get_cache().get(uri, height))
 
   # encode the filename of the image for client side caching/verification
-  name = os.path.basename(uri) + '.jpg'
-  return FileResponse(img_tmp_jpg, media_type='image/jpg', filename=name)
+  name = urllib.parse.quote(os.path.basename(uri) + '.jpg')
+  headers = {
+    'ETag': img.etag,
+    # the art changes with the track, clients have to check that their copy is still current
+    'Cache-Control': 'no-cache',
+    'Content-Disposition': f'attachment; filename="{name}"',
+  }
+  if etag_matches(request.headers.get('if-none-match'), img.etag):
+    return Response(status_code=304, headers=headers)
+  return Response(content=img.data, media_type='image/jpg', headers=headers)
 
 # zones
 
 
-@api.get('/api/zones', tags=['zone'])
-def get_zones(ctrl: Api = Depends(get_ctrl)) -> Dict[str, List[models.Zone]]:
+@api.get('/api/zones', tags=['zone'], response_model=Dict[str, List[models.Zone]], responses=BINARY_RESPONSES)
+def get_zones(request: Request, ctrl: Api = Depends(get_ctrl)) -> Union[Dict[str, List[models.Zone]], Response]:
   """ Get all zones """
+  if wants_binary(request):
+    return snapshot_response(request, ctrl, 'zones')
   return {'zones': ctrl.get_state().zones}
 
 
@@ -431,9 +573,11 @@ def create_group(group: models.Group, ctrl: Api = Depends(get_ctrl)) -> models.G
   return code_response(ctrl, ctrl.create_group(group))
 
 
-@api.get('/api/groups', tags=['group'])
-def get_groups(ctrl: Api = Depends(get_ctrl)) -> Dict[str, List[models.Group]]:
+@api.get('/api/groups', tags=['group'], response_model=Dict[str, List[models.Group]], responses=BINARY_RESPONSES)
+def get_groups(request: Request, ctrl: Api = Depends(get_ctrl)) -> Union[Dict[str, List[models.Group]], Response]:
   """ Get all groups """
+  if wants_binary(request):
+    return snapshot_response(request, ctrl, 'groups')
   return {'groups': ctrl.get_state().groups}
 
 
@@ -468,9 +612,11 @@ def create_stream(stream: models.Stream, ctrl: Api = Depends(get_ctrl)) -> model
   return code_response(ctrl, ctrl.create_stream(stream))
 
 
-@api.get('/api/streams', tags=['stream'])
-def get_streams(ctrl: Api = Depends(get_ctrl)) -> Dict[str, List[models.Stream]]:
+@api.get('/api/streams', tags=['stream'], response_model=Dict[str, List[models.Stream]], responses=BINARY_RESPONSES)
+def get_streams(request: Request, ctrl: Api = Depends(get_ctrl)) -> Union[Dict[str, List[models.Stream]], Response]:
   """ Get all streams """
+  if wants_binary(request):
+    return snapshot_response(request, ctrl, 'streams')
   return {'streams': ctrl.get_state().streams}
 
 
@@ -566,9 +712,11 @@ def create_preset(preset: models.Preset, ctrl: Api = Depends(get_ctrl)) -> model
   return code_response(ctrl, ctrl.create_preset(preset))
 
 
-@api.get('/api/presets', tags=['preset'])
-def get_presets(ctrl: Api = Depends(get_ctrl)) -> Dict[str, List[models.Preset]]:
+@api.get('/api/presets', tags=['preset'], response_model=Dict[str, List[models.Preset]], responses=BINARY_RESPONSES)
+def get_presets(request: Request, ctrl: Api = Depends(get_ctrl)) -> Union[Dict[str, List[models.Preset]], Response]:
   """ Get all presets """
+  if wants_binary(request):
+    return snapshot_response(request, ctrl, 'presets')
   return {'presets': ctrl.get_state().presets}
 
 
@@ -601,8 +749,12 @@ def load_preset(ctrl: Api = Depends(get_ctrl), pid: int = params.PresetID) -> mo
 # PA
 
 
+def _queue_announcement(ctrl: Api, announcement: models.Announcement):
+  return ctrl.queue_announcement(announcement, on_done=lambda job: notify_event('announcement', job.json(exclude_none=True)))
+
+
 @api.post('/api/announce', tags=['announce'])
-def announce(announcement: models.Announcement, ctrl: Api = Depends(get_ctrl)) -> models.Status:
+async def announce(announcement: models.Announcement, ctrl: Api = Depends(get_ctrl)) -> models.Status:
   """ Make an announcement.
 
       Make a PA announcement on one or more zones (default: all enabled Zones) with a `media` URL
@@ -623,8 +775,36 @@ def announce(announcement: models.Announcement, ctrl: Api = Depends(get_ctrl)) -
       Behind the scenes this uses VLC and passes the URL from 'media' verbatim and waits
       for VLC to exit when it is done playing.
 
+      Announcements are queued and played one at a time, use `POST /api/announcements` to avoid
+      waiting for the announcement to finish.
+
+  """
+  _, done = _queue_announcement(ctrl, announcement)
+  job: models.AnnouncementJob = await asyncio.wrap_future(done)
+  if job.state == models.AnnouncementState.FAILED:
+    code_response(ctrl, job.response or ApiResponse.error(job.error or 'announcement failed'))  # raises the matching HTTP error
+  return await run_in_threadpool(ctrl.get_state)
+
+
+@api.post('/api/announcements', tags=['announce'])
+def queue_announcement(announcement: models.Announcement, ctrl: Api = Depends(get_ctrl)) -> models.AnnouncementJob:
+  """ Queue an announcement, without waiting for it to play
+
+  The announcement is played like `POST /api/announce`, once every announcement queued before it has played.
+  Its progress can be followed with `GET /api/announcements/{aid}`,
+  an `announcement` event is also sent to `/api/subscribe` subscribers when it finishes.
   """
-  return code_response(ctrl, ctrl.announce(announcement))
+  job, _ = _queue_announcement(ctrl, announcement)
+  return job
+
+
+@api.get('/api/announcements/{aid}', tags=['announce'])
+def get_announcement(ctrl: Api = Depends(get_ctrl), aid: int = params.AnnouncementID) -> models.AnnouncementJob:
+  """ Get the state of a queued announcement """
+  job = ctrl.get_announcement(aid)
+  if job is None:
+    raise HTTPException(404, f'announcement {aid} not found')
+  return job
 
 
 @api.post('/api/play', tags=['play'])
@@ -644,6 +824,21 @@ def get_info(ctrl: Api = Depends(get_ctrl)) -> models.Info:
   return code_response(ctrl, ctrl.get_info())
 
 
+@api.get(
+  '/api/info/bus', tags=['status'],
+  responses={
+    200: {
+      'content': {'application/json': {
+        'example': [ex['value'] for ex in models.PreampBusStats.Config.schema_extra['examples'].values()]
+      }}
+    }
+  }
+)
+def get_bus_stats(ctrl: Api = Depends(get_ctrl)) -> List[models.PreampBusStats]:
+  """ Get the I2C bus statistics of each preamp (empty when the hardware is mocked) """
+  return ctrl.get_bus_stats()
+
+
 @app.get('/debug', tags=['status'])
 def debug() -> models.DebugResponse:
   """ Returns debug status and configuration. """
@@ -983,6 +1178,15 @@ def create_app(mock_ctrl=None, mock_streams=None, config_file=None, delay_saves=
   get_ctrl().reinit(settings, change_notifier=notify_on_change)
   return app
 
+# Startup
+
+
+@app.on_event('startup')
+async def on_startup():
+  # the synchronous endpoints run on anyio's thread pool, the controller's locking allows them to run concurrently
+  anyio.to_thread.current_default_thread_limiter().total_tokens = get_ctrl().worker_threads
+
+
 # Shutdown
 
 
@@ -0,0 +1,192 @@
+# AmpliPi Home Audio
+# Copyright (C) 2022 MicroNova LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Album art cache
+
+Touch panels ask for the current album art, scaled to their size, every time a track changes.
+Downloading and scaling the art takes a while on a Pi, so the scaled jpegs are kept in RAM,
+the least recently used are dropped once the cache is full. Downloads and scaling happen on a small thread pool,
+concurrent requests for the same art share one download.
+"""
+
+import functools
+import hashlib
+import io
+import logging
+import os
+import sys
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+MAX_CACHE_BYTES = 8 * 1024 * 1024  # a few hundred scaled images
+MAX_ART_BYTES = 16 * 1024 * 1024  # larger downloads aren't album art
+FETCH_TIMEOUT = 10  # seconds
+FETCH_THREADS = 2
+
+# the web server's static files, art with a static/ url is one of them
+STATIC_DIR = os.path.abspath('web/static')
+
+
+def source_art(img_url: Optional[str], static_dir: str = STATIC_DIR) -> str:
+  """ Get the uri of a source's art given its info's @img_url, converting the web server's static files to local paths """
+  uri = img_url or 'static/imgs/disconnected.png'
+  if uri.startswith('static/'):
+    uri = uri.replace('static/', static_dir + '/')
+    uri = uri.replace('rca_inputs.svg', 'rca_inputs.jpg')  # pillow can't handle svg files for our use case
+  return uri
+
+
+def fetch(uri: str) -> bytes:
+  """ Get the image at @uri, either a local file or a url """
+  if os.path.exists(uri):
+    with open(uri, 'rb') as file:
+      return file.read()
+  with urllib.request.urlopen(uri, timeout=FETCH_TIMEOUT) as resp:
+    data = resp.read(MAX_ART_BYTES + 1)
+  if len(data) > MAX_ART_BYTES:
+    raise ValueError(f'{uri} is larger than {MAX_ART_BYTES} bytes')
+  return data
+
+
+def render(image: bytes, size: int) -> bytes:
+  """ Scale @image to fit in a @size x @size square, encoded as a jpeg """
+  img = Image.open(io.BytesIO(image))
+  img.thumbnail((size, size))
+  out = io.BytesIO()
+  img.convert(mode="RGB").save(out, format='JPEG')
+  return out.getvalue()
+
+
+class Art(NamedTuple):
+  """ A scaled jpeg """
+  data: bytes
+  etag: str
+
+
+class ArtCache:
+  """ Least recently used cache of scaled album art, keyed by the art's uri and size
+
+  @fetch(uri) gets the original image's bytes, raising an exception on failure.
+  """
+
+  def __init__(self, max_bytes: int = MAX_CACHE_BYTES, fetch: Callable[[str], bytes] = fetch, threads: int = FETCH_THREADS):
+    self.max_bytes = max_bytes
+    self._fetch = fetch
+    self._lock = threading.Lock()
+    self._entries: 'OrderedDict[Tuple[str, int], Art]' = OrderedDict()  # least recently used first
+    self._size = 0
+    self._pending: Dict[Tuple[str, int], Future] = {}
+    self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='art')
+
+  @staticmethod
+  def _key(uri: str, size: int) -> Tuple[str, int]:
+    # uris are hashed so different art with the same file name don't collide
+    return hashlib.sha1(uri.encode()).hexdigest(), size
+
+  @property
+  def size(self) -> int:
+    """ Total bytes of art cached """
+    with self._lock:
+      return self._size
+
+  def __len__(self) -> int:
+    with self._lock:
+      return len(self._entries)
+
+  def get(self, uri: str, size: int) -> 'Future[Art]':
+    """ Get @uri's art scaled to @size, from the cache or loaded in the background """
+    return self._load(uri, [size])[size]
+
+  def prefetch(self, uri: str, sizes: Iterable[int]):
+    """ Load @uri's art in each of @sizes in the background, so later requests for it are served from the cache """
+    self._load(uri, sizes)
+
+  def _load(self, uri: str, sizes: Iterable[int]) -> 'Dict[int, Future[Art]]':
+    """ Get futures for @uri's art in each of @sizes, loading the missing sizes with a single download """
+    futures: 'Dict[int, Future[Art]]' = {}
+    missing: 'Dict[int, Future[Art]]' = {}
+    with self._lock:
+      for size in sizes:
+        key = self._key(uri, size)
+        art = self._entries.get(key)
+        if art is not None:
+          self._entries.move_to_end(key)
+          futures[size] = Future()
+          futures[size].set_result(art)
+        elif key in self._pending:
+          futures[size] = self._pending[key]  # share the load already in progress
+        else:
+          futures[size] = missing[size] = self._pending[key] = Future()
+    if missing:
+      self._executor.submit(self._render, uri, missing)
+    return futures
+
+  def _render(self, uri: str, futures: 'Dict[int, Future[Art]]'):
+    try:
+      image = self._fetch(uri)
+    except Exception as exc:
+      logger.info(f'Unable to get art {uri}: {exc}')
+      self._finish(uri, futures, exc)
+      return
+    for size, future in futures.items():
+      try:
+        data = render(image, size)
+        art = Art(data, f'"{hashlib.sha1(data).hexdigest()}"')
+        with self._lock:
+          key = self._key(uri, size)
+          self._pending.pop(key, None)
+          self._entries[key] = art
+          self._size += len(data)
+          self._evict()
+        future.set_result(art)
+      except Exception as exc:
+        logger.info(f'Unable to scale art {uri} to {size}px: {exc}')
+        self._finish(uri, {size: future}, exc)
+
+  def _finish(self, uri: str, futures: 'Dict[int, Future[Art]]', exc: Exception):
+    """ Fail the loads of @futures, failures aren't cached so the next request tries again """
+    with self._lock:
+      for size in futures:
+        self._pending.pop(self._key(uri, size), None)
+    for future in futures.values():
+      future.set_exception(exc)
+
+  def _evict(self):
+    """ Drop the least recently used art until the cache fits, the lock must be held """
+    while self._entries and self._size > self.max_bytes:
+      _, art = self._entries.popitem(last=False)
+      self._size -= len(art.data)
+
+  def keys(self) -> List[Tuple[str, int]]:
+    """ The cached art's keys, least recently used first """
+    with self._lock:
+      return list(self._entries)
+
+
+@functools.lru_cache(maxsize=1)
+def get_cache() -> ArtCache:
+  """ The shared album art cache """
+  return ArtCache()
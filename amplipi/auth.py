@@ -1,11 +1,14 @@
 import os
+import copy
 import json
+import hashlib
 import time
 import secrets
 import logging
 import sys
+import threading
 
-from typing import Union, Dict, List
+from typing import Union, Dict, List, Optional, Tuple
 from typing_extensions import Literal
 from datetime import datetime, timedelta, timezone
 
@@ -16,7 +19,6 @@ from fastapi.openapi.models import APIKey
 from fastapi.templating import Jinja2Templates
 from starlette.templating import _TemplateResponse as TemplateResponse
 from argon2 import PasswordHasher, Parameters as Argon2Params, Type as Argon2Type
-from hmac import compare_digest
 
 # pylint: disable=no-name-in-module
 from pydantic import BaseModel
@@ -63,8 +65,60 @@ class UserData(BaseModel):
   password_hash: Union[str, None]
 
 
+# the parsed users file, reused until the file changes. (file signature, users, Key: access key digest, Val: username)
+_users_cache: Optional[Tuple[Optional[tuple], dict, Dict[str, str]]] = None
+_users_lock = threading.Lock()
+
+# How long a validated access key is trusted without checking the users file again.
+# Credential changes made here revoke the cached sessions immediately, this only bounds
+# how long an edit made to the users file by something else can go unnoticed.
+SESSION_TTL = 30.0
+
+# recently validated access keys. Key: access key digest, Val: (username, expiry)
+_sessions: Dict[str, Tuple[str, float]] = {}
+_sessions_lock = threading.Lock()
+
+
+def _key_digest(key: str) -> str:
+  """ Hash an access key for lookups. Keys are only compared by their digests, so the time a lookup
+      takes tells an attacker nothing about how much of a guessed key was right.
+  """
+  return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _users_file_signature() -> Optional[tuple]:
+  """ Identify the current version of the users file, None if it doesn't exist """
+  try:
+    stat = os.stat(USERS_FILE)
+  except OSError:
+    return None
+  return (USERS_FILE, stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _load_users() -> Tuple[dict, Dict[str, str]]:
+  """ Returns the cached users file contents and its access key digest index, reloading them if the file changed.
+      The returned data is shared, it must not be modified.
+  """
+  global _users_cache
+  signature = _users_file_signature()
+  cache = _users_cache
+  if cache is not None and signature is not None and cache[0] == signature:
+    return cache[1], cache[2]
+  with _users_lock:
+    users = _read_users()
+    keys = {_key_digest(data['access_key']): name for name, data in users.items() if data.get('access_key')}
+    # a change made while reading gets picked up on the next call since the signature won't match
+    _users_cache = (signature, users, keys)
+  return users, keys
+
+
 def _get_users() -> dict:
-  """ Returns the users file contents """
+  """ Returns a copy of the users file contents """
+  return copy.deepcopy(_load_users()[0])
+
+
+def _read_users() -> dict:
+  """ Reads the users file """
   users: Dict[str, UserData] = {}
   # Load fields from users file (if it exists), falling back to no users.
   # TODO: We should guard around edge cases more. If a user is able to trick any
@@ -98,17 +152,27 @@ def _set_users(users_update: Dict[str, UserData]) -> None:
       user data and .update()'s it; to note, this means it will not delete
       keys, only add or modify existing keys.
   """
+  global _users_cache
   users = _get_users()
   users.update(users_update)
-  with open(USERS_FILE, encoding='utf-8', mode='w') as users_file:
-    json.dump(users, users_file)
+  with _users_lock:
+    with open(USERS_FILE, encoding='utf-8', mode='w') as users_file:
+      json.dump(users, users_file)
+    _users_cache = None  # reload the written file, the write may land within the previous version's mtime
+
+
+def _revoke_sessions(user: str) -> None:
+  """ Forget the validated sessions of @user, their access key has to be checked again """
+  with _sessions_lock:
+    for digest in [d for d, (name, _) in _sessions.items() if name == user]:
+      del _sessions[digest]
 
 
 def _get_password_hash(user: str) -> str:
   """ Get a user password hash. This does not handle KeyError exceptions;
       this should explicitly be handled by the caller.
   """
-  users = _get_users()
+  users, _ = _load_users()
   return users[user]['password_hash']
 
 
@@ -126,7 +190,7 @@ def _get_access_key(user: str) -> str:
   """ Get a username's access key. This does not handle KeyError exceptions;
       this should explicitly be handled by the caller
   """
-  users = _get_users()
+  users, _ = _load_users()
   return users[user]["access_key"]
 
 
@@ -141,6 +205,7 @@ def create_access_key(user: str) -> str:
     "access_key_updated": datetime.now(tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
   })
   _set_users(users)
+  _revoke_sessions(user)
   return access_key
 
 
@@ -165,17 +230,18 @@ def unset_password_hash(user) -> None:
   except KeyError:  # user doesn't exist, or has no "password_hash"
     pass
   _set_users(users)
+  _revoke_sessions(user)
 
 
 def user_exists(username: str) -> bool:
   """ Utility function for determining if a user exists """
-  users = _get_users()
+  users, _ = _load_users()
   return username in users.keys()
 
 
 def _user_password_set(username: str) -> bool:
   """ Utility function for determining if a user has a password set. """
-  users = _get_users()
+  users, _ = _load_users()
 
   # No user exists
   if not user_exists(username):
@@ -194,7 +260,7 @@ def _user_password_set(username: str) -> bool:
 
 def user_access_key_set(username: str) -> bool:
   """ Utility function for determing if a user has a session key set """
-  users = _get_users()
+  users, _ = _load_users()
 
   # No user exists
   if not user_exists(username):
@@ -210,7 +276,7 @@ def user_access_key_set(username: str) -> bool:
 def get_access_key(username: str) -> str:
   """ Given a username, return its access key. """
   assert user_access_key_set(username)
-  users = _get_users()
+  users, _ = _load_users()
   return users[username]["access_key"]
 
 
@@ -226,17 +292,27 @@ def _authenticate_user_with_password(username: str, password: str) -> bool:
 
 
 def _check_access_key(key: APIKey) -> Union[bool, str]:
-  """ Check a user's access key using constant-time comparison. """
-  for username in _get_users().keys():
-    if 'access_key' in _get_users()[username]:
-      if compare_digest(_get_access_key(username), str(key)):
-        return username
-  return False
+  """ Check a user's access key, returning the user it belongs to. """
+  digest = _key_digest(str(key))
+  now = time.monotonic()
+  with _sessions_lock:
+    session = _sessions.get(digest)
+  if session is not None and session[1] > now:
+    return session[0]
+  _, keys = _load_users()
+  username = keys.get(digest)
+  with _sessions_lock:
+    if username is None:
+      _sessions.pop(digest, None)
+      return False
+    _sessions[digest] = (username, now + SESSION_TTL)
+  return username
 
 
 def no_user_passwords_set() -> bool:
   """ Determines if there are no user passwords set. """
-  for user in _get_users():
+  users, _ = _load_users()
+  for user in users:
     if _user_password_set(user):
       return False
   return True
@@ -244,7 +320,8 @@ def no_user_passwords_set() -> bool:
 
 def list_users() -> List[str]:
   """ Returns a flat list of username strings. """
-  return list(_get_users())
+  users, _ = _load_users()
+  return list(users)
 
 
 def _next_url(request: Request) -> str:
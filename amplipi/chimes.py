@@ -0,0 +1,204 @@
+# AmpliPi Home Audio
+# Copyright (C) 2022 MicroNova LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Announcement chime cache
+
+Announcements (doorbells, chimes, ...) tend to play the same short clips over and over.
+Starting VLC to fetch and decode a clip takes seconds, so clips are decoded once to PCM (a wav file kept on tmpfs)
+and later played directly with aplay, which starts in milliseconds.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024  # about 6 minutes of 48kHz stereo audio
+MAX_CHIME_BYTES = 8 * 1024 * 1024  # longer clips aren't chimes, they are played with VLC every time
+MAX_REJECTED = 64  # rejected urls remembered, the oldest are forgotten first
+REJECTED_TTL = 10 * 60.0  # seconds a url that failed to decode, or is too long to be a chime, is remembered for
+DECODE_TIMEOUT = 30  # seconds
+DECODE_POLL_INTERVAL = 0.1  # seconds between checks of a running decode's output
+
+
+def _run_capped(args: List[str], dest: str, max_bytes: int, timeout: float = DECODE_TIMEOUT):
+  """ Run the decoder @args writing to @dest, killing it once more than @max_bytes are written or @timeout expires """
+  with subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as proc:
+    deadline = time.monotonic() + timeout
+    try:
+      while True:
+        try:
+          proc.wait(DECODE_POLL_INTERVAL)
+          break
+        except subprocess.TimeoutExpired:
+          pass
+        try:
+          size = os.path.getsize(dest)
+        except OSError:
+          size = 0  # nothing decoded yet
+        if size > max_bytes:
+          raise ValueError(f'over {max_bytes} bytes decoded, only clips up to {max_bytes} bytes are cached')
+        if time.monotonic() > deadline:
+          raise subprocess.TimeoutExpired(args, timeout)
+    finally:
+      if proc.poll() is None:
+        proc.kill()
+  if proc.returncode != 0:
+    raise subprocess.CalledProcessError(proc.returncode, args)
+
+
+def vlc_decode(url: str, dest: str, max_bytes: int = MAX_CHIME_BYTES):
+  """ Decode the media at @url to a 16 bit 48kHz stereo wav file at @dest using VLC
+
+  Decoding is stopped once more than @max_bytes are decoded, so a long stream doesn't fill up the RAM backed folder.
+  """
+  args = ['cvlc', '--quiet', '--intf', 'dummy', '--play-and-exit', '--no-video', '--sout',
+          f'#transcode{{acodec=s16l,channels=2,samplerate=48000}}:std{{access=file,mux=wav,dst={dest}}}', url]
+  _run_capped(args, dest, max_bytes)
+
+
+def _default_folder() -> str:
+  # /dev/shm is RAM backed, keeping the decoded audio off of the SD card
+  shm = '/dev/shm'
+  return os.path.join(shm if os.path.isdir(shm) else tempfile.gettempdir(), 'amplipi-chimes')
+
+
+class ChimeCache:
+  """ Least recently used cache of announcement media decoded to PCM
+
+  @decode(url, dest, max_bytes) writes the decoded audio for @url to the wav file @dest, raising an exception on
+  failure. It can stop once more than @max_bytes are written, the clip won't be cached anyway.
+  Media that failed to decode or is too long to be a chime is remembered for REJECTED_TTL seconds.
+  """
+
+  def __init__(self, folder: Optional[str] = None, max_bytes: int = MAX_CACHE_BYTES, max_chime_bytes: int = MAX_CHIME_BYTES,
+               decode: Callable[[str, str, int], None] = vlc_decode):
+    self.folder = folder or _default_folder()
+    self.max_bytes = max_bytes
+    self.max_chime_bytes = max_chime_bytes
+    self._decode = decode
+    self._lock = threading.Lock()
+    self._entries: 'OrderedDict[str, int]' = OrderedDict()  # Key: url, Val: decoded size, least recently used first
+    self._decoding: Dict[str, threading.Thread] = {}
+    # urls that failed to decode or are too long to be chimes, Key: url, Val: time to try it again, oldest first
+    self._rejected: 'OrderedDict[str, float]' = OrderedDict()
+    os.makedirs(self.folder, exist_ok=True)
+    # the files left by a previous run aren't tracked
+    for name in os.listdir(self.folder):
+      try:
+        os.remove(os.path.join(self.folder, name))
+      except OSError:
+        pass
+
+  def _path(self, url: str) -> str:
+    return os.path.join(self.folder, hashlib.sha1(url.encode()).hexdigest() + '.wav')
+
+  @property
+  def size(self) -> int:
+    """ Total bytes of decoded audio cached """
+    with self._lock:
+      return sum(self._entries.values())
+
+  def urls(self) -> List[str]:
+    """ The cached urls, least recently used first """
+    with self._lock:
+      return list(self._entries)
+
+  def get(self, url: str) -> Optional[str]:
+    """ Get the path of the decoded audio for @url, if cached """
+    with self._lock:
+      if url not in self._entries:
+        return None
+      self._entries.move_to_end(url)
+      return self._path(url)
+
+  def prefetch(self, url: str):
+    """ Decode @url in the background so it can be played from the cache next time """
+    with self._lock:
+      if url in self._entries or url in self._decoding or self._rejected.get(url, 0) > time.monotonic():
+        return
+      self._rejected.pop(url, None)
+      thread = threading.Thread(target=self._add, args=(url,), name='chime-decoder', daemon=True)
+      self._decoding[url] = thread
+    thread.start()
+
+  def wait(self, url: str, timeout: Optional[float] = None):
+    """ Wait for a prefetch of @url to finish """
+    with self._lock:
+      thread = self._decoding.get(url)
+    if thread:
+      thread.join(timeout)
+
+  def _add(self, url: str):
+    path = self._path(url)
+    tmp_path = f'{path}.tmp'
+    try:
+      self._decode(url, tmp_path, self.max_chime_bytes)
+      size = os.path.getsize(tmp_path)
+      if size > self.max_chime_bytes:
+        raise ValueError(f'{size} bytes decoded, only clips up to {self.max_chime_bytes} bytes are cached')
+      os.replace(tmp_path, path)
+      with self._lock:
+        self._entries[url] = size
+        self._evict()
+      logger.info(f'Cached chime {url} ({size} bytes)')
+    except Exception as exc:
+      logger.info(f'Not caching chime {url}: {exc}')
+      with self._lock:
+        self._rejected[url] = time.monotonic() + REJECTED_TTL
+        while len(self._rejected) > MAX_REJECTED:
+          self._rejected.popitem(last=False)
+      try:
+        os.remove(tmp_path)
+      except OSError:
+        pass
+    finally:
+      with self._lock:
+        self._decoding.pop(url, None)
+
+  def _evict(self):
+    """ Remove the least recently used clips until the cache fits, the lock must be held """
+    while self._entries and sum(self._entries.values()) > self.max_bytes:
+      url, _ = self._entries.popitem(last=False)
+      try:
+        os.remove(self._path(url))
+      except OSError:
+        pass
+
+  def play_args(self, url: str, output: str) -> Optional[List[str]]:
+    """ Get the command that plays @url's cached audio on the ALSA device @output, None if it isn't cached """
+    path = self.get(url)
+    if path is None:
+      return None
+    return ['aplay', '--quiet', '-D', output, path]
+
+
+@functools.lru_cache(maxsize=1)
+def get_cache() -> ChimeCache:
+  """ The shared chime cache """
+  return ChimeCache()
@@ -20,26 +20,38 @@ This module provides complete control of the AmpliPi Audio System's sources,
 zones, groups and streams.
 """
 
-from typing import List, Dict, Set, Union, Optional, Callable
+from typing import List, Dict, Set, Tuple, Union, Optional, Callable, TypeVar, cast
+from typing_extensions import ParamSpec
 
 from enum import Enum
 
 from copy import deepcopy
+import hashlib
+import json
 import os  # files
 from pathlib import Path
 import time
 import logging
 import sys
 import datetime
+import functools
 import psutil
 import threading
 import wrapt
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
+import itertools
 
 from amplipi import models
 from amplipi import rt
 from amplipi import utils
+from amplipi import encodings
+from amplipi import art
 import amplipi.streams
 from amplipi.eeprom import EEPROM, BoardType, find_boards
+from amplipi.metadata import MetadataBus, MetadataWatcher
+from amplipi.persist import ConfigWriter, StateJournal
+from amplipi import status_shm
 from amplipi import auth
 from amplipi import defaults
 import traceback
@@ -64,6 +76,39 @@ def save_on_success(wrapped, instance: 'Api', args, kwargs):
   return result
 
 
+P = ParamSpec('P')
+R = TypeVar('R')
+
+
+def reads_state(func: Callable[P, R]) -> Callable[P, R]:
+  """ Read the state alongside other readers, but never while it is being changed """
+  @functools.wraps(func)
+  def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+    instance = cast('Api', args[0])
+    with instance._state_lock.reading():  # pylint: disable=protected-access
+      return func(*args, **kwargs)
+  return wrapper
+
+
+def changes_state(func: Callable[P, R]) -> Callable[P, R]:
+  """ Get exclusive access to the state while changing it """
+  @functools.wraps(func)
+  def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+    instance = cast('Api', args[0])
+    with instance._state_lock.writing():  # pylint: disable=protected-access
+      return func(*args, **kwargs)
+  return wrapper
+
+
+def sequenced(func: Callable[P, R]) -> Callable[P, R]:
+  """ Queue a ctrl API call so presets and announcements run one at a time, in the order they were requested """
+  @functools.wraps(func)
+  def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+    instance = cast('Api', args[0])
+    return instance._run_sequenced(func, *args, **kwargs)  # pylint: disable=protected-access
+  return wrapper
+
+
 class ApiCode(Enum):
   """ Ctrl Api Response code """
   OK = 1
@@ -105,6 +150,86 @@ class ApiResponse:
   ERROR = ApiCode.ERROR
 
 
+STATUS_SNAPSHOT_TTL = 1.0  # seconds a status snapshot is reused when nothing was explicitly changed
+JOURNAL_COMPACT_INTERVAL = 600.0  # seconds between compactions of the config journal into the config file
+JOURNAL_MAX_SIZE = 64 * 1024  # compact the config journal right away once it grows past this many bytes
+ANNOUNCEMENT_TIMEOUT = 600.0  # seconds an announcement can play before it is stopped
+ANNOUNCEMENT_STOP_TIMEOUT = 5.0  # seconds a stopped announcement gets to finish before its player is killed
+ANNOUNCEMENT_HISTORY = 32  # number of finished announcement jobs kept for status requests
+RECENT_STREAMS = 4  # number of recently played streams kept ready to play again, along with the presets' streams
+CHANGE_HISTORY = 256  # number of change records kept for clients catching up on changes, see Api.get_changes
+CHANGE_TRACKED = ['zones', 'sources', 'groups', 'streams', 'presets']  # the parts of the status change records cover
+
+
+class StatusSnapshot:
+  """ The system status, pre-encoded as JSON
+
+  Other encodings of the status, or of one of its sections, are encoded the first time they are requested
+  and kept for as long as the snapshot is.
+  """
+
+  def __init__(self, version: int, data: bytes):
+    self.version = version  # the controller's change version the snapshot was taken at
+    self.data = data
+    self.digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+    self.etag = f'"{self.digest}"'
+    self.time = time.monotonic()
+    self._decoded: Optional[Dict] = None
+    self._encoded: Dict[Tuple[str, Optional[str]], bytes] = {}  # Key: (media type, section)
+
+  def encoded(self, media_type: str = encodings.JSON, section: Optional[str] = None) -> bytes:
+    """ Get the status, or just its @section (ie. {'zones': [...]}), encoded as @media_type """
+    if media_type == encodings.JSON and section is None:
+      return self.data
+    key = (media_type, section)
+    data = self._encoded.get(key)
+    if data is None:
+      if self._decoded is None:
+        self._decoded = json.loads(self.data)
+      content = self._decoded if section is None else {section: self._decoded.get(section, [])}
+      data = encodings.encode(content, media_type)
+      self._encoded[key] = data
+    return data
+
+  def etag_of(self, media_type: str = encodings.JSON, section: Optional[str] = None) -> str:
+    """ Get the ETag of an encoding of the status or its @section """
+    if media_type == encodings.JSON and section is None:
+      return self.etag
+    return f'"{self.digest}-{section or "status"}-{encodings.EXTENSIONS[media_type]}"'
+
+
+class ChangeLog:
+  """ A bounded ring of change records, each holding what changed in the tracked parts of the status at a version
+
+  Clients that know the state at an older version catch up using the records made since then,
+  once a version's records are pushed out of the ring the client has to resync from the full status.
+  """
+
+  def __init__(self, version: int, state: Dict, size: int = CHANGE_HISTORY):
+    self._lock = threading.Lock()
+    self._records: 'deque[Tuple[int, Dict]]' = deque(maxlen=size)  # (version, delta)
+    self._state = state  # the state as of the latest record
+    self._floor = version  # changes made at or before this version aren't available
+
+  def record(self, version: int, state: Dict):
+    """ Record the changes between the last recorded state and @state, made at @version """
+    with self._lock:
+      delta = utils.status_delta(self._state, state)
+      if not delta:
+        return
+      if len(self._records) == self._records.maxlen:
+        self._floor = self._records[0][0]
+      self._records.append((version, delta))
+      self._state = state
+
+  def since(self, version: int) -> Optional[Dict]:
+    """ Get the changes made after @version merged into a single delta, None if they are no longer available """
+    with self._lock:
+      if version < self._floor:
+        return None
+      return utils.merge_status_deltas([delta for ver, delta in self._records if ver > version])
+
+
 class Api:
   """ Amplipi Controller API"""
   # pylint: disable=too-many-instance-attributes
@@ -114,7 +239,9 @@ class Api:
   _initialized = False  # we need to know when we initialized first
   _mock_hw: bool
   _mock_streams: bool
-  _save_timer: Optional[threading.Timer] = None
+  _config_writer: Optional[ConfigWriter] = None
+  _journal: Optional[StateJournal] = None
+  _journaled: Dict = {}  # the config state as of the last journaled change
   _delay_saves: bool
   _change_notifier: Optional[Callable[[models.Status], None]] = None
   _rt: Union[rt.Rpi, rt.Mock]
@@ -128,12 +255,29 @@ class Api:
   _serial: Optional[int] = None
   _expanders: List[int] = []
   _freeze_delete_temporary: bool = False
+  _version: int = 0  # incremented on every change, see mark_changes
+  _snapshot: Optional[StatusSnapshot] = None
+  _metadata_watcher: Optional[MetadataWatcher] = None
+  _metadata_bus: Optional[MetadataBus] = None
+  _status_publisher: Optional[status_shm.StatusPublisher] = None
+  _changes: Optional[ChangeLog] = None
 
   # TODO: migrate to init setting instance vars to a disconnected state (API requests will throw Api.DisconnectedException() in this state
   # with this reinit will be called connect and will attempt to load the configuration and connect to an AmpliPi (mocked or real)
   # returning a boolean on whether or not it was successful
 
   def __init__(self, settings: models.AppSettings = models.AppSettings(), change_notifier: Optional[Callable[[models.Status], None]] = None):
+    self._snapshot_lock = threading.RLock()  # guards the status snapshot, the change log and versioning the sources' info
+    self._journal_lock = threading.Lock()
+    # GETs share the state, changes get exclusive access to it
+    self._state_lock = utils.RWLock()
+    # presets and announcements are run one at a time from a queue
+    self._sequencer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ctrl-sequencer')
+    self._sequencer_local = threading.local()
+    self._announcement_lock = threading.Lock()
+    self._announcement_ids = itertools.count(1)
+    self._announcement_jobs: 'OrderedDict[int, models.AnnouncementJob]' = OrderedDict()
+    self._recent_streams: 'deque[int]' = deque(maxlen=RECENT_STREAMS)
     self.reinit(settings, change_notifier)
     self._initialized = True
 
@@ -141,13 +285,49 @@ class Api:
     """ Initialize or Reinitialize the controller
 
     Initializes the system to to base configuration """
+    # the background workers need the state lock to finish, so stop them before taking it
+    self._stop_workers()
+    with self._state_lock.writing():
+      self._reinit(settings, change_notifier, config)
+
+  def _stop_workers(self):
+    """ Stop the metadata watcher and the config writer, saving any pending changes """
+    if self._status_publisher:
+      self._status_publisher.stop()
+      self._status_publisher = None
+    if self._metadata_watcher:
+      self._metadata_watcher.stop()
+      self._metadata_watcher = None
+    if self._metadata_bus:
+      self._metadata_bus.stop()
+      self._metadata_bus = None
+    if self._config_writer:
+      self._config_writer.stop()  # save any pending changes to the previous config
+      self._config_writer = None
+    if self._journal:
+      self._journal.close()
+      self._journal = None
+
+  def _reinit(self, settings: models.AppSettings, change_notifier: Optional[Callable[[models.Status], None]], config: Optional[models.Status]):
+    self._src_info_keys: Dict[int, Optional[tuple]] = {}
+    # each source's input options, computed for its current input. Key: source id, Val: (input, options)
+    self._inputs: Dict[Optional[int], Tuple[str, Dict[Optional[str], str]]] = {}
     self._change_notifier = change_notifier
+    self._version += 1
+    self._snapshot = None
     self._mock_hw = settings.mock_ctrl
     self._mock_streams = settings.mock_streams
-    self._save_timer = None
     self._delay_saves = settings.delay_saves
+    self._art_sizes = settings.art_sizes
     self._settings = settings
 
+    # receive the metadata pushed by the streams before any of them are started
+    try:
+      self._metadata_bus = MetadataBus(f"{utils.get_folder('config')}/metadata.sock", self._on_metadata_published)
+    except OSError as exc:
+      logger.warning(f'Metadata bus unavailable, streams will write their metadata to files: {exc}')
+      self._metadata_bus = None
+
     # try to get a list of available boards to determine if we are a streamer
     # the preamp hardware is not available on a streamer
     # we need to know this before trying to initialize the firmware
@@ -210,6 +390,18 @@ class Api:
         except Exception as exc:
           self.config_file_valid = False  # mark the config file as invalid so we don't try to back it up
           errors.append(f'error loading config file: {exc}')
+    if settings.journal_saves:
+      # changes are appended to the journal as they happen, the config file is only rewritten to compact it
+      self._journal = StateJournal(f'{self.config_file}.journal')
+      self._config_writer = ConfigWriter(self.config_file, self._serialize_config, JOURNAL_COMPACT_INTERVAL,
+                                         JOURNAL_COMPACT_INTERVAL, backup_current=self.config_file_valid,
+                                         on_saved=self._journal.discard_rotated)
+      if config:
+        self.save()  # an explicitly loaded config replaces any journaled changes
+      elif loaded_config and self._replay_journal():
+        self.save()
+    else:
+      self._config_writer = ConfigWriter(self.config_file, self._serialize_config, backup_current=self.config_file_valid)
 
     # make a config flag to recognize this unit's subtype
     # this helps the updater make good decisions
@@ -238,6 +430,9 @@ class Api:
       default_config = defaults.default_config(is_streamer=self.is_streamer, lms_mode=self.lms_mode)
       self.status = models.Status.parse_obj(default_config)
       self.save()
+    if self._journal:
+      # the base the next journal entry is computed against, this has to wait for the default config to be loaded
+      self._journaled = self._journal_state()
 
     # populate system info
     self._online_cache = utils.TimeBasedCache(self._check_is_online, 5, 'online')
@@ -413,21 +608,39 @@ class Api:
 
     # configure all of the zones so that they are in a known state
     #   we mute all zones on startup to keep audio from playing immediately at startup
-    for zone in self.status.zones:
-      # TODO: disable zones that are not found
-      # we likely need an additional field for this, maybe auto-disabled?
-      zone_update = models.ZoneUpdate(source_id=zone.source_id, mute=True, vol=zone.vol)
-      self.set_zone(zone.id, zone_update, force_update=True, internal=True)
+    with self._rt.batch():
+      for zone in self.status.zones:
+        # TODO: disable zones that are not found
+        # we likely need an additional field for this, maybe auto-disabled?
+        zone_update = models.ZoneUpdate(source_id=zone.source_id, mute=True, vol=zone.vol)
+        self.set_zone(zone.id, zone_update, force_update=True, internal=True)
     # configure all of the groups (some fields may need to be updated)
     self._update_groups()
 
+    self._prefetch_streams()
+
+    # keep the sources' metadata up to date in the background, instead of reading it on every request
+    self._metadata_watcher = MetadataWatcher(f"{utils.get_folder('config')}/srcs", self._on_metadata_change)
+
+    # changes are recorded from here on, clients that knew an earlier state have to resync
+    self._changes = ChangeLog(self._version, self._change_state())
+
+    # share the state with the local services (ie. the displays) without them going through the web server
+    try:
+      segment = status_shm.StatusSegment(status_shm.SEGMENT_PATH)
+      self._status_publisher = status_shm.StatusPublisher(segment, lambda: self._version, self._publish_status)
+    except OSError as exc:
+      logger.warning(f'Unable to share the status at {status_shm.SEGMENT_PATH}: {exc}')
+      self._status_publisher = None
+
   def __del__(self):
-    # stop save in the future so we can save right away
+    if self._metadata_watcher:
+      self._metadata_watcher.stop()
+      self._metadata_watcher = None
     # we save before shutting everything down to avoid saving disconnected state
-    if self._save_timer:
-      self._save_timer.cancel()
-      self._save_timer = None
     self.save()
+    self._stop_workers()
+    self._sequencer.shutdown(wait=False)
     # stop any streams
     for stream in self.streams.values():
       stream.disconnect()
@@ -442,20 +655,55 @@ class Api:
         vol_changes = True
     if vol_changes:
       # wait for the changes to take effect (we observed a tiny pop without this)
+      self._rt.flush()
       time.sleep(0.080)
     # put the firmware in a reset state
     self._rt.reset()
 
+  @reads_state
+  def _serialize_config(self) -> bytes:
+    if not self._journal:
+      return self.status.json(exclude_none=True, indent=2).encode('utf-8')
+    with self._journal_lock:
+      # the config being saved covers every change journaled so far
+      self._journal.rotate()
+      return self.status.json(exclude_none=True, indent=2).encode('utf-8')
+
+  def _journal_state(self) -> Dict:
+    """ The journaled part of the config, system info is regenerated at startup so it doesn't need to be saved """
+    return json.loads(self.status.json(exclude_none=True, exclude={'info'}))
+
+  def _replay_journal(self) -> bool:
+    """ Apply the changes journaled since the config file was last compacted, returns True if any were applied """
+    assert self._journal
+    try:
+      state, applied = self._journal.replay(self._journal_state())
+      if applied:
+        self.status = models.Status.parse_obj(state)
+        logger.info(f'Replayed {applied} journaled config changes')
+      return applied > 0
+    except Exception as exc:
+      logger.exception(f'Error replaying config journal: {exc}')
+      return False
+
+  def _journal_changes(self):
+    """ Append the changes made since the last journal entry to the journal """
+    assert self._journal
+    with self._journal_lock:
+      state = self._journal_state()
+      delta = utils.status_delta(self._journaled, state)
+      if delta:
+        self._journal.append(delta)
+        self._journaled = state
+
   def save(self) -> None:
-    """ Saves the system state to json"""
+    """ Saves the system state to json, keeping the previous config as a backup (assuming it was valid)
+
+    Nothing is written if the configuration hasn't changed since it was last saved.
+    """
     try:
-      # save a backup copy of the config file (assuming its valid)
-      if os.path.exists(self.config_file) and self.config_file_valid:
-        if os.path.exists(self.backup_config_file):
-          os.remove(self.backup_config_file)
-        os.rename(self.config_file, self.backup_config_file)
-      with open(self.config_file, 'w', encoding='utf-8') as cfg:
-        cfg.write(self.status.json(exclude_none=True, indent=2))
+      if self._config_writer:
+        self._config_writer.save()
       self.config_file_valid = True
     except Exception as exc:
       logger.exception(f'Error saving config: {exc}')
@@ -463,20 +711,68 @@ class Api:
   def mark_changes(self):
     """ Mark api changes to update listeners and save the system state in the future
 
-    This attempts to avoid excessive saving and the resulting delays by only saving a small delay after the last change
+    This attempts to avoid excessive saving and the resulting delays by only saving a small delay after the last change,
+    a continuous stream of changes still gets saved periodically (see ConfigWriter).
+    In journal mode the changes are appended to the config journal right away and the config file is only
+    rewritten every JOURNAL_COMPACT_INTERVAL seconds.
     """
+    self._version += 1
+    self._record_changes()
     if self._change_notifier:
       self._change_notifier(self.get_state())
-    if self._delay_saves:
-      if self._save_timer:
-        self._save_timer.cancel()
-        self._save_timer = None
-      # start can only be called once on a thread
-      self._save_timer = threading.Timer(5.0, self.save)
-      self._save_timer.start()
+    if self._journal and self._config_writer:
+      try:
+        self._journal_changes()
+      except Exception as exc:
+        logger.exception(f'Error journaling config changes: {exc}')
+        self._config_writer.schedule(0)
+        return
+      # compacting serializes the state, which needs the state lock our callers are usually holding,
+      # so leave it to the writer thread instead of saving here
+      if self._journal.size > JOURNAL_MAX_SIZE:
+        self._config_writer.schedule(0)
+      else:
+        self._config_writer.schedule()
+    elif self._delay_saves and self._config_writer:
+      self._config_writer.schedule()
     else:
       self.save()
 
+  def _change_state(self) -> Dict:
+    """ The parts of the status covered by the change records """
+    return self.status.dict(exclude_none=True, include=set(CHANGE_TRACKED))
+
+  def _mark_internal_change(self):
+    """ Give an internal change (ie. part of loading a preset) a new version without marking it
+
+    Internal changes aren't saved or sent to listeners until their caller marks them, but they still invalidate
+    the status snapshot. They are recorded by the next reader of the changes.
+    """
+    self._version += 1
+
+  def _record_changes(self):
+    """ Add a change record for anything that changed since the last one """
+    if self._changes:
+      self._changes.record(self._version, self._change_state())
+
+  def get_changes(self, since: int) -> models.StatusChanges:
+    """ Get the zones, sources, groups, streams and presets that changed after version @since
+
+    A resync is requested when the changes are no longer available, the client needs to get the full status instead.
+    """
+    self._expire_temporary_streams()
+    with self._state_lock.reading(), self._snapshot_lock:
+      # streams changing state aren't marked as changes, check for them here
+      self._refresh_sources()
+      # internal changes aren't recorded as they happen, record them now
+      self._record_changes()
+      version = self._version
+      # a version newer than ours was handed out before the controller restarted
+      changes = self._changes.since(since) if self._changes and since <= version else None
+    if changes is None:
+      return models.StatusChanges(version=version, resync=True)
+    return models.StatusChanges(version=version, changes=changes)
+
   def _is_digital(self, sinput: str) -> bool:
     """Determines whether a source input, @sinput, is analog or digital
     @sinput is expected to be one of the following:
@@ -496,6 +792,7 @@ class Api:
     except:
       return True
 
+  @reads_state
   def get_inputs(self, src: models.Source) -> Dict[Optional[str], str]:
     """Gets a dictionary of the possible inputs for a source
 
@@ -507,6 +804,10 @@ class Api:
         >>> my_amplipi.get_inputs()
         { '': '', 'stream=9449': 'Matt and Kim Radio' }
     """
+    # the options only change with the streams (see sync_stream_info) or the source's input
+    cached = self._inputs.get(src.id)
+    if cached is not None and cached[0] == src.input:
+      return dict(cached[1])
     inputs: Dict[Optional[str], str] = {'': ''}
     for sid, stream in self.streams.items():
       # TODO: remove this filter when sources can dynamically change output
@@ -516,7 +817,8 @@ class Api:
         assert connectable, print(f'Source {src} has invalid input: stream={connected}')
       if (sid == connected or not stream.disabled) and connectable:
         inputs[f'stream={sid}'] = stream.full_name()
-    return inputs
+    self._inputs[src.id] = (src.input, inputs)
+    return dict(inputs)
 
   def _check_is_online(self) -> bool:
     online = False
@@ -557,6 +859,7 @@ class Api:
   def sync_stream_info(self) -> None:
     """Synchronize the stream list to the stream status"""
     # TODO: figure out how to cache stream info, since it only needs to happen when a stream is added/updated
+    self._inputs.clear()  # the streams were added, updated or removed, the sources' input options have to be recomputed
     streams = []
     for sid, stream_inst in self.streams.items():
       # TODO: this functionality should be in the unimplemented streams base class
@@ -595,21 +898,76 @@ class Api:
     if self.status.info is not None:
       self.status.info.serial = str(self._serial)
 
+  def _submit_sequenced(self, func: Callable, *args, **kwargs) -> Future:
+    """ Queue @func to run on the sequencer """
+    def run():
+      self._sequencer_local.active = True
+      try:
+        return func(*args, **kwargs)
+      finally:
+        self._sequencer_local.active = False
+    return self._sequencer.submit(run)
+
+  def _run_sequenced(self, func: Callable[..., R], *args, **kwargs) -> R:
+    """ Run @func on the sequencer's queue and wait for its result, calls made from the queue run right away """
+    if getattr(self._sequencer_local, 'active', False):
+      return func(*args, **kwargs)
+    return self._submit_sequenced(func, *args, **kwargs).result()
+
   def get_state(self) -> models.Status:
     """ get the system state """
+    self._expire_temporary_streams()
+    with self._state_lock.reading():
+      return self._get_state()
+
+  def _get_state(self, refresh: bool = True) -> models.Status:
+    # NOTE: concurrent readers may update the system info at the same time, each update is a plain assignment
+    # of its latest value so this is harmless. The sources' info is versioned, it is only refreshed by _refresh_sources()
     self._update_sys_info()
-    if not self._freeze_delete_temporary:
-      self._delete_unused_temporary_streams()
     # Get serial number
     if self._serial is None and self.status.info is not None:
       self._update_serial()
 
-    # update source's info
-    # TODO: source info should be updated in a background thread
-    for src in self.status.sources:
-      self._update_src_info(src)
+    if refresh:
+      # update the info of any source whose stream changed state since its info was read,
+      # metadata file changes are picked up in the background by the metadata watcher
+      self._refresh_sources()
     return self.status
 
+  @property
+  def version(self) -> int:
+    """ The controller's change version, incremented every time the configuration is changed """
+    return self._version
+
+  @property
+  def worker_threads(self) -> int:
+    """ The number of requests the webserver can handle at once """
+    return self._settings.worker_threads
+
+  def get_state_snapshot(self, max_age: float = STATUS_SNAPSHOT_TTL) -> StatusSnapshot:
+    """ Get the system state pre-encoded as JSON
+
+    The state is only re-encoded after a change, or after @max_age seconds to pick up changes
+    that aren't explicitly marked (like stream metadata). If the encoded state is identical the previous
+    snapshot (and its ETag) is kept.
+    """
+    self._expire_temporary_streams()
+    with self._state_lock.reading(), self._snapshot_lock:
+      # streams changing state (ie. an announcement starting to play) aren't marked as changes, check for them here
+      self._refresh_sources()
+      snapshot = self._snapshot
+      if snapshot is not None and snapshot.version == self._version and time.monotonic() - snapshot.time < max_age:
+        return snapshot
+      version = self._version
+      data = self._get_state(refresh=False).json(exclude_none=True).encode('utf-8')
+      if snapshot is not None and snapshot.data == data:
+        snapshot.version = version
+        snapshot.time = time.monotonic()
+        return snapshot
+      self._snapshot = StatusSnapshot(version, data)
+      return self._snapshot
+
+  @reads_state
   def get_info(self) -> models.Info:
     """ Get the system information """
     self._update_sys_info()
@@ -618,6 +976,22 @@ class Api:
 
     return self.status.info
 
+  @reads_state
+  def get_bus_stats(self) -> List[models.PreampBusStats]:
+    """ Get the I2C bus statistics of each preamp """
+    write_stats = self._rt.write_stats()
+    bus_stats = []
+    for addr, stats in self._rt.bus_stats().items():
+      writes = write_stats.get(addr, rt.WriteStats())
+      bus_stats.append(models.PreampBusStats(
+        unit=addr // 8 - 1, address=addr,
+        writes_issued=writes.issued, writes_skipped=writes.skipped, writes_collapsed=writes.collapsed,
+        retries=stats.retries, failures=stats.failures,
+        verifications=stats.verifications, drift=stats.drift,
+        latency_buckets_ms=rt.LATENCY_BUCKETS_MS, latency_counts=stats.latency,
+      ))
+    return bus_stats
+
   def get_items(self, tag: str) -> Optional[List[models.Base]]:
     """ Gets one of the lists of elements contained in status named by @t (or t's plural
 
@@ -651,13 +1025,77 @@ class Api:
       return self.streams.get(idx, None)
     return None
 
+  def _src_info_key(self, src: models.Source) -> Optional[tuple]:
+    """ Get what a source's info depends on, besides its stream's metadata files """
+    stream_inst = self.get_stream(src)
+    if stream_inst is None:
+      return None
+    return (src.input, stream_inst.state)
+
   def _update_src_info(self, src: models.Source):
     """ Update a source's status and song metadata """
     stream_inst = self.get_stream(src)
+    if src.id is not None:
+      self._src_info_keys[src.id] = self._src_info_key(src)
+    old_img_url = src.info.img_url if src.info else None
     if stream_inst is not None:
       src.info = stream_inst.info()
     else:
       src.info = models.SourceInfo(img_url='static/imgs/disconnected.png', name='None', state='stopped')
+    if src.info.img_url != old_img_url and src.info.img_url and self._art_sizes:
+      # get the new art ready for the panels that will ask for it, sources playing the same art share the download
+      art.get_cache().prefetch(art.source_art(src.info.img_url), self._art_sizes)
+
+  def _refresh_src_infos(self, force: bool = False) -> bool:
+    """ Update the info of the sources that might be out of date, returns True if any info changed
+
+    Without @force a source's info is only read again if its stream or its stream's state changed.
+    """
+    changed = False
+    for src in self.status.sources:
+      if force or src.info is None or src.id is None or self._src_info_keys.get(src.id) != self._src_info_key(src):
+        old_info = src.info
+        self._update_src_info(src)
+        changed = changed or src.info != old_info
+    return changed
+
+  def _refresh_sources(self, force: bool = False) -> bool:
+    """ Refresh the sources' info, giving any change a new version, a change record and a notification
+
+    Streams change state on their own (ie. an announcement starting to play). Every reader refreshes through here,
+    so whichever reader finds a change first counts it. Returns True if any info changed.
+    Readers only share the state lock, so the refresh and its version are guarded by the snapshot lock.
+    """
+    with self._snapshot_lock:
+      if not self._refresh_src_infos(force=force):
+        return False
+      self._version += 1
+      self._record_changes()
+      if self._change_notifier:
+        self._change_notifier(self.status)
+      return True
+
+  def _on_metadata_published(self):
+    """ Refresh the sources' info once a burst of published metadata settles """
+    watcher = self._metadata_watcher
+    if watcher:
+      watcher.trigger()
+
+  def _on_metadata_change(self, changed: bool):
+    """ Refresh the sources' info after their metadata @changed, notifying any listeners
+
+    Without a change only the sources whose stream changed state are refreshed, the rest of the metadata
+    is read again once it changes.
+    """
+    with self._state_lock.reading():
+      self._refresh_sources(force=changed)
+
+  def _publish_status(self, segment: status_shm.StatusSegment):
+    """ Write the current state to the shared status segment """
+    with self._state_lock.reading(), self._snapshot_lock:
+      # streams changing state aren't marked as changes, check for them here
+      self._refresh_sources()
+      segment.write(self._version, self.status)
 
   def _get_source_config(self, sources: Optional[List[models.Source]] = None) -> List[bool]:
     """ Convert the preamp's source configuration """
@@ -668,23 +1106,51 @@ class Api:
       src_cfg[s] = self._is_digital(src.input)
     return src_cfg
 
-  def _delete_unused_temporary_streams(self):
-    """Removes temporary file players if they are disconnected and have no connected sources"""
+  def _prefetch_streams(self):
+    """ Get the streams that are likely to be played next (recently played or in a preset) ready to connect quickly """
+    sids = list(self._recent_streams)
+    for preset in self.status.presets:
+      for src in preset.state.sources or []:
+        if src.input and src.input.startswith('stream='):
+          try:
+            sids.append(int(src.input.replace('stream=', '')))
+          except ValueError:
+            pass
+    for sid in set(sids):
+      stream = self.streams.get(sid)
+      if stream is not None and not stream.is_connected() and not stream.disabled:
+        try:
+          stream.prefetch()
+        except Exception as exc:
+          logger.info(f'Failed to prefetch stream {sid}: {exc}')
+
+  def _unused_temporary_streams(self) -> List[int]:
+    """ Get the temporary file players that are disconnected and have no connected sources """
     temp_streams = []
     for stream_id in self.streams.keys():
       stream = self.streams[stream_id]
-      if stream.stream_type == 'fileplayer' and stream.temporary and stream.timeout_expired():
+      if isinstance(stream, amplipi.streams.FilePlayer) and stream.temporary and stream.timeout_expired():
         temp_streams.append(stream_id)
 
     for source in self.status.sources:
       for stream_id in temp_streams:
         if source.input[7:].isdigit() and int(source.input[7:]) == stream_id:
           temp_streams.remove(stream_id)
-
-    for stream_id in temp_streams:
-      logger.info(f'Deleting unused temporary stream {stream_id}')
-      self.delete_stream(stream_id, internal=False)  # Internal is False so it shows up immediately on UI
-
+    return temp_streams
+
+  def _expire_temporary_streams(self):
+    """ Remove unused temporary file players, only taking the write lock when there is something to remove """
+    if self._freeze_delete_temporary:
+      return
+    with self._state_lock.reading():
+      if not self._unused_temporary_streams():
+        return
+    with self._state_lock.writing():
+      for stream_id in self._unused_temporary_streams():
+        logger.info(f'Deleting unused temporary stream {stream_id}')
+        self.delete_stream(stream_id, internal=False)  # Internal is False so it shows up immediately on UI
+
+  @changes_state
   def set_source(self, sid: int, update: models.SourceUpdate, force_update: bool = False, internal: bool = False) -> ApiResponse:
     """Modifes the configuration of one of the 4 system sources
 
@@ -726,6 +1192,11 @@ class Api:
               if stream.is_connected():
                 stream.disconnect()
               stream.connect(idx)
+              stream_id = src.get_stream()
+              if stream_id is not None:
+                if stream_id in self._recent_streams:
+                  self._recent_streams.remove(stream_id)
+                self._recent_streams.append(stream_id)
               # potentially deactivate the old stream to save resources
               # NOTE: old_stream and new stream could be the same if force_update is True
               if old_stream and old_stream != stream and old_stream.is_activated():
@@ -761,8 +1232,11 @@ class Api:
               if not self._rt.update_sources(src_cfg):
                 raise Exception('failed to set source')
           self._update_src_info(src)  # synchronize the source's info
+          self._prefetch_streams()
         if not internal:
           self.mark_changes()
+        else:
+          self._mark_internal_change()
       else:
         raise Exception(f'failed to set source: index {idx} out of bounds')
     except Exception as exc:
@@ -771,6 +1245,7 @@ class Api:
       return ApiResponse.error(f'failed to set source: {exc}')
     return ApiResponse.ok()
 
+  @changes_state
   def set_zone(self, zid, update: models.ZoneUpdate, force_update: bool = False, internal: bool = False) -> ApiResponse:
     """Reconfigures a zone
 
@@ -821,8 +1296,7 @@ class Api:
           # update with the pending change
           zone_sources[zid] = utils.clamp(source_id, 0, 3)
 
-          # this is setting the state for all zones
-          # TODO: cache the fw state and only do this on change, this quickly gets out of hand when changing many zones
+          # this is setting the state for all zones, the runtime only sends the registers that changed
           if special_status_sid:
             # don't send the source id to the firmware if we are disconnecting the source
             zone.source_id = sid
@@ -889,6 +1363,8 @@ class Api:
           # update the group stats (individual zone volumes, sources, and mute configuration can effect a group)
           self._update_groups()
           self.mark_changes()
+        else:
+          self._mark_internal_change()
     except Exception as exc:
       if internal:
         raise exc
@@ -896,6 +1372,7 @@ class Api:
     else:
       return ApiResponse.ok()
 
+  @changes_state
   def set_zones(self, multi_update: models.MultiZoneUpdate, force_update: bool = False, internal: bool = False) -> ApiResponse:
     """Reconfigures a set of zones
 
@@ -907,17 +1384,20 @@ class Api:
     try:
       # aggregate all of the zones together
       all_zids = utils.zones_from_all(self.status, multi_update.zones, multi_update.groups)
-      # update each of the zones
-      for zid in all_zids:
-        zupdate = multi_update.update.copy()  # we potentially need to make changes to the underlying update
-        if zupdate.name:
-          # ensure all zones don't get named the same
-          zupdate.name = f'{zupdate.name} {zid+1}'
-        self.set_zone(zid, zupdate, force_update=force_update, internal=True)
+      # update each of the zones, committing the hardware changes together
+      with self._rt.batch():
+        for zid in all_zids:
+          zupdate = multi_update.update.copy()  # we potentially need to make changes to the underlying update
+          if zupdate.name:
+            # ensure all zones don't get named the same
+            zupdate.name = f'{zupdate.name} {zid+1}'
+          self.set_zone(zid, zupdate, force_update=force_update, internal=True)
       if not internal:
         # update the group stats (individual zone volumes, sources, and mute configuration can effect a group)
         self._update_groups()
         self.mark_changes()
+      else:
+        self._mark_internal_change()
     except Exception as exc:
       if internal:
         raise exc
@@ -947,6 +1427,7 @@ class Api:
         group.vol_f = models.MIN_VOL_F
       group.vol_delta = utils.vol_float_to_db(group.vol_f)
 
+  @changes_state
   def set_group(self, gid, update: models.GroupUpdate, internal: bool = False) -> ApiResponse:
     """Configures an existing group
         parameters will be used to configure each zone in the group's zones
@@ -982,13 +1463,16 @@ class Api:
         # TODO: make this use volume delta adjustment, for now its a fixed group volume
         # use float value so zone calculates appropriate offsets in dB
         zone_update.vol_f = vol_f
-      for zone in [self.status.zones[zone] for zone in zones]:
-        self.set_zone(zone.id, zone_update, internal=True)
+      with self._rt.batch():
+        for zone in [self.status.zones[zone] for zone in zones]:
+          self.set_zone(zone.id, zone_update, internal=True)
 
       if not internal:
         # update the group stats
         self._update_groups()
         self.mark_changes()
+      else:
+        self._mark_internal_change()
     except Exception as exc:
       if internal:
         raise exc
@@ -999,6 +1483,7 @@ class Api:
     """ get next available group id """
     return utils.next_available_id(self.status.groups, default=100)
 
+  @changes_state
   def create_group(self, group: models.Group) -> models.Group:
     """Creates a new group with a list of zones
 
@@ -1021,6 +1506,7 @@ class Api:
     self.mark_changes()
     return group
 
+  @changes_state
   @save_on_success
   def delete_group(self, gid: int) -> ApiResponse:
     """Deletes an existing group"""
@@ -1043,6 +1529,7 @@ class Api:
       return stream.id + 1
     return 1000
 
+  @changes_state
   def create_stream(self, data: models.Stream, internal=False) -> models.Stream:
     """ Create a new stream """
     try:
@@ -1059,6 +1546,8 @@ class Api:
       if new_stream:
         if not internal:
           self.mark_changes()
+        else:
+          self._mark_internal_change()
         return new_stream
       raise Exception('no stream created')
     except Exception as exc:
@@ -1072,6 +1561,7 @@ class Api:
         return ApiResponse.fieldError(exc.field, exc.msg)
       return ApiResponse.error(f'create stream failed: {exc}')
 
+  @changes_state
   @save_on_success
   def set_stream(self, sid: int, update: models.StreamUpdate) -> ApiResponse:
     """ Configure a stream """
@@ -1090,6 +1580,7 @@ class Api:
       logger.error(traceback.format_exc())
       return ApiResponse.error('Unable to reconfigure stream {}: {}'.format(sid, exc))
 
+  @changes_state
   def delete_stream(self, sid: int, internal=False) -> ApiResponse:
     """Deletes an existing stream"""
     try:
@@ -1109,6 +1600,8 @@ class Api:
       self.sync_stream_info()
       if not internal:
         self.mark_changes()
+      else:
+        self._mark_internal_change()
       return ApiResponse.ok()
     except KeyError:
       msg = f'delete stream failed: {sid} does not exist'
@@ -1118,6 +1611,7 @@ class Api:
       raise Exception(msg)
     return ApiResponse.error(msg)
 
+  @changes_state
   @save_on_success
   def exec_stream_command(self, sid: int, cmd: str) -> ApiResponse:
     """Sets play/pause on a specific pandora source """
@@ -1176,6 +1670,7 @@ class Api:
     """ get next available preset id """
     return utils.next_available_id(self.status.presets, default=10000)
 
+  @changes_state
   def create_preset(self, preset: models.Preset, internal=False) -> Union[ApiResponse, models.Preset]:
     """ Create a new preset """
     try:
@@ -1185,14 +1680,18 @@ class Api:
       preset.id = pid
       preset.last_used = None  # indicates this preset has never been used
       self.status.presets.append(preset)
+      self._prefetch_streams()
       if not internal:
         self.mark_changes()
+      else:
+        self._mark_internal_change()
       return preset
     except Exception as exc:
       if internal:
         raise exc
       return ApiResponse.error('create preset failed: {}'.format(exc))
 
+  @changes_state
   @save_on_success
   def set_preset(self, pid: int, update: models.PresetUpdate) -> ApiResponse:
     """ Reconfigure a preset """
@@ -1205,10 +1704,12 @@ class Api:
       # TODO: validate preset
       for field in changes.keys():
         preset.__dict__[field] = update.__dict__[field]
+      self._prefetch_streams()
       return ApiResponse.ok()
     except Exception as exc:
       return ApiResponse.error('Unable to reconfigure preset {}: {}'.format(pid, exc))
 
+  @changes_state
   @save_on_success
   def delete_preset(self, pid: int) -> ApiResponse:
     """ Deletes an existing preset """
@@ -1247,8 +1748,9 @@ class Api:
     zones_effected = self._effected_zones(preset_state)
     zones_temp_muted = [zid for zid in zones_effected if not self.status.zones[zid].mute]
     zone_update = models.ZoneUpdate(mute=True)
-    for zid in zones_temp_muted:
-      self.set_zone(zid, zone_update, internal=True)
+    with self._rt.batch():
+      for zid in zones_temp_muted:
+        self.set_zone(zid, zone_update, internal=True)
 
     # keep track of the zones muted by the preset configuration
     zones_muted: Set[int] = set()
@@ -1278,24 +1780,28 @@ class Api:
             # handle odd mute thrashing case where zone was muted by one group then unmuted by another
             zones_muted.difference_update()
 
-    # execute change zone by zone in increasing order
-    for zone in preset_state.zones or []:
-      self.set_zone(zone.id, zone.as_update(), internal=True)
-      if zone.mute is not None:
-        if zone.mute:
-          zones_muted.add(zone.id)
-        elif zone.id in zones_muted:
-          zones_muted.remove(zone.id)
+    # execute change zone by zone in increasing order, committing the volumes to each preamp in one go
+    with self._rt.batch():
+      for zone in preset_state.zones or []:
+        self.set_zone(zone.id, zone.as_update(), internal=True)
+        if zone.mute is not None:
+          if zone.mute:
+            zones_muted.add(zone.id)
+          elif zone.id in zones_muted:
+            zones_muted.remove(zone.id)
 
     # unmute effected zones that were not muted by the preset configuration
     zones_to_unmute = set(zones_temp_muted).difference(zones_muted)
     zone_update = models.ZoneUpdate(mute=False)
-    for zid in zones_to_unmute:
-      self.set_zone(zid, zone_update, internal=True)
+    with self._rt.batch():
+      for zid in zones_to_unmute:
+        self.set_zone(zid, zone_update, internal=True)
 
     # update stats
     self._update_groups()
 
+  @sequenced
+  @changes_state
   def load_preset(self, pid: int, internal=False) -> ApiResponse:
     """ To avoid any issues with audio coming out of the wrong speakers, we will need to carefully load a preset configuration.
     Below is an idea of how a preset configuration could be loaded to avoid any weirdness.
@@ -1315,8 +1821,6 @@ class Api:
       if i is None or preset is None:
         raise Exception(f'{pid} does not exist')
 
-      # TODO: acquire lock (all api methods that change configuration will need this)
-
       # update last config preset for restore capabilities (creating if missing)
       # TODO: "last config" does not currently support restoring streaming state, how would that work? (maybe we could just support play/pause state?)
       last_pid, _ = utils.find(self.status.presets, defaults.LAST_PRESET_ID)
@@ -1351,9 +1855,9 @@ class Api:
       if internal:
         raise exc
       return ApiResponse.error(f'load_preset failed: {exc}')
-    # TODO: release lock
     return ApiResponse.ok()
 
+  @sequenced
   def announce(self, announcement: models.Announcement) -> ApiResponse:
     """ Create and play an announcement """
     # create a temporary announcement stream using fileplayer
@@ -1409,12 +1913,13 @@ class Api:
     if resp3.code != ApiCode.OK:
       return resp3
     # wait for the announcement to be done and switch back to the previous state
-    # TODO: what is the longest announcement we should accept?
     stream_inst = self.streams[stream.id]
-    while True:
-      time.sleep(0.1)
-      if stream_inst.state in ['stopped', 'disconnected']:
-        break
+    if isinstance(stream_inst, amplipi.streams.FilePlayer) and not stream_inst.wait_done(timeout=ANNOUNCEMENT_TIMEOUT):
+      logger.warning(f'Announcement {announcement.media} is still playing after {ANNOUNCEMENT_TIMEOUT}s, stopping it')
+      try:
+        self._stop_announcement(stream_inst)
+      except Exception as exc:
+        logger.exception(f'Error stopping announcement {announcement.media}: {exc}')
     resp4 = self.load_preset(defaults.LAST_PRESET_ID, internal=True)
     resp5 = self.delete_stream(stream.id, internal=True)  # remember to delete the temporary stream
     self._freeze_delete_temporary = False
@@ -1423,6 +1928,65 @@ class Api:
     self.mark_changes()
     return resp4
 
+  def _stop_announcement(self, player: amplipi.streams.FilePlayer):
+    """ Stop an announcement's @player, killing it if it doesn't finish within ANNOUNCEMENT_STOP_TIMEOUT """
+    # FilePlayer's stop command waits for the player to finish, however long that takes
+    proc = player.proc
+    if proc is not None:
+      proc.terminate()
+    if not player.wait_done(timeout=ANNOUNCEMENT_STOP_TIMEOUT):
+      logger.error(f'{player.name} is still playing {ANNOUNCEMENT_STOP_TIMEOUT}s after being stopped, killing it')
+      if proc is not None:
+        proc.kill()
+
+  def queue_announcement(self, announcement: models.Announcement,
+                         on_done: Optional[Callable[[models.AnnouncementJob], None]] = None) -> Tuple[models.AnnouncementJob, Future]:
+    """ Queue an announcement to be played in the background
+
+    Returns the announcement's job and a future resolving to the job once the announcement is done,
+    @on_done is also called with the finished job.
+    """
+    job = models.AnnouncementJob(id=next(self._announcement_ids), state=models.AnnouncementState.QUEUED,
+                                 announcement=announcement, created=int(time.time()))
+    with self._announcement_lock:
+      self._announcement_jobs[job.id] = job
+      while len(self._announcement_jobs) > ANNOUNCEMENT_HISTORY:
+        oldest = next(iter(self._announcement_jobs.values()))
+        if oldest.state not in [models.AnnouncementState.DONE, models.AnnouncementState.FAILED]:
+          break  # never forget announcements that haven't finished
+        self._announcement_jobs.popitem(last=False)
+      queued = job.copy()
+    return queued, self._submit_sequenced(self._run_announcement, job, on_done)
+
+  def _run_announcement(self, job: models.AnnouncementJob,
+                        on_done: Optional[Callable[[models.AnnouncementJob], None]]) -> models.AnnouncementJob:
+    with self._announcement_lock:
+      job.state = models.AnnouncementState.PLAYING
+    try:
+      resp = self.announce(job.announcement)
+    except Exception as exc:
+      logger.exception(f'Error playing announcement: {exc}')
+      resp = ApiResponse.error(str(exc))
+    with self._announcement_lock:
+      job.state = models.AnnouncementState.DONE if resp.code == ApiCode.OK else models.AnnouncementState.FAILED
+      job.error = resp.msg or None
+      job._response = resp  # pylint: disable=protected-access
+      job.finished = int(time.time())
+      done = job.copy()
+    if on_done:
+      try:
+        on_done(done)
+      except Exception as exc:
+        logger.exception(f'Error notifying announcement completion: {exc}')
+    return done
+
+  def get_announcement(self, aid: int) -> Optional[models.AnnouncementJob]:
+    """ Get a queued, playing or recently finished announcement """
+    with self._announcement_lock:
+      job = self._announcement_jobs.get(aid)
+      return job.copy() if job else None
+
+  @changes_state
   def play_media(self, media: models.PlayMedia) -> ApiResponse:
     """Play media to a file player on a specified source"""
     stream = None
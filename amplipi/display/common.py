@@ -5,6 +5,7 @@ import subprocess
 import datetime
 import requests
 import socket
+from urllib.parse import urlparse
 
 import netifaces as ni
 
@@ -16,6 +17,7 @@ from amplipi.display.statusinterface import set_custom_display_status, STATUS_FI
 
 from amplipi import models
 from amplipi import auth
+from amplipi.status_shm import StatusReader, SharedStatus
 
 SysInfo = namedtuple('SysInfo', ['hostname', 'password', 'ip', 'status_code', "serial_number", "ext_count"])
 
@@ -23,6 +25,10 @@ SysInfo = namedtuple('SysInfo', ['hostname', 'password', 'ip', 'status_code', "s
 STARTUP_MSG = "Starting Up"
 STATUS = Enum('STATUS', ['PLAYING', 'STOPPED', 'PAUSED', 'MUTED', 'ERROR', 'IGNORE', 'OTHER'])
 
+LOCAL_HOSTS = ['localhost', '127.0.0.1', '::1']
+
+_status_reader = StatusReader()
+
 
 def request_params() -> Optional[Dict]:
   if not auth.no_user_passwords_set():
@@ -35,6 +41,25 @@ def request_params() -> Optional[Dict]:
   return None
 
 
+def read_shared_status(url: Optional[str]) -> Optional[SharedStatus]:
+  """Read the status the local AmpliPi shares in memory, None if @url isn't local or the status isn't available"""
+  if url is None or urlparse(url).hostname not in LOCAL_HOSTS:
+    return None
+  return _status_reader.read()
+
+
+def fetch_status(url: str) -> Optional[Union[models.Status, SharedStatus]]:
+  """Get the AmpliPi's status, from shared memory when possible otherwise from the REST API at @url
+  Returns None if the API responded with an error"""
+  shared = read_shared_status(url)
+  if shared is not None:
+    return shared
+  req = requests.get(url, timeout=0.2, params=request_params())
+  if req.status_code != 200:
+    return None
+  return models.Status(**req.json())
+
+
 class Display:
   """Abstract External Display
   Used to display system information like password and IP address"""
@@ -149,9 +174,8 @@ def load_status_from_file() -> Optional[Union[str, int]]:
 def get_num_expanders(url: str) -> int:
   """Returns the number of expanders connected to the AmpliPro"""
   try:
-    req = requests.get(url, timeout=0.2, params=request_params())
-    if req.status_code == 200:
-      status = models.Status(**req.json())
+    status = fetch_status(url)
+    if status is not None:
       info = status.info
       if info is not None:
         return len(info.expanders)
@@ -207,8 +231,13 @@ def total_status_counts(stati: List[STATUS]) -> Dict[STATUS, int]:
 
 
 def get_emoji_status(url: str, max_length: int = 16) -> Union[str, int]:
-  req = requests.get(url, timeout=0.2, params=request_params())
-  status = models.Status(**req.json())
+  status = fetch_status(url)
+  if status is None:
+    return DisplayError.API_CANNOT_FIND_STATUS
+  return emoji_status(status, max_length)
+
+
+def emoji_status(status: Union[models.Status, SharedStatus], max_length: int = 16) -> Union[str, int]:
   if status.info is None:
     return DisplayError.API_CANNOT_FIND_STATUS
 
@@ -255,9 +284,8 @@ def get_status(url: str, no_serial_ok: bool = False, emoji: bool = True, max_len
   if url is None:
     return DisplayError.API_CANNOT_CONNECT, None, 0
   try:
-    req = requests.get(url, timeout=0.2, params=request_params())
-    if req.status_code == 200:
-      status = models.Status(**req.json())
+    status = fetch_status(url)
+    if status is not None:
       zones = status.zones
       sources = status.sources
       result_status = "READY"
@@ -265,7 +293,7 @@ def get_status(url: str, no_serial_ok: bool = False, emoji: bool = True, max_len
         if status.info is not None and status.info.serial.isdigit():
           serial = int(status.info.serial)
         if emoji:
-          result_status = get_emoji_status(url, max_length)
+          result_status = emoji_status(status, max_length)
         else:
           if status.info is not None and status.info.is_streamer:
             for source in sources:
@@ -8,7 +8,7 @@ import socket
 import sys
 import pathlib
 import time
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Optional, Sequence, Tuple
 
 # pylint: disable=wrong-import-position
 import busio
@@ -23,8 +23,9 @@ from adafruit_rgb_display import ili9341
 from loguru import logger as log
 
 from amplipi import models
+from amplipi.status_shm import AnySource, AnyZone
 from amplipi.utils import get_identity
-from amplipi.display.common import Color, Display, DefaultPass, get_status, request_params
+from amplipi.display.common import Color, Display, DefaultPass, get_status, read_shared_status, request_params
 from amplipi.display.statusinterface import DisplayError, DisplayStatus, set_custom_display_status
 
 # If this is run on anything other than a Raspberry Pi,
@@ -196,8 +197,8 @@ class TFTDisplay(Display):
     connected_once = False
     max_connection_retries = 10
     connection_retries = 0
-    sources: List[models.Source] = []
-    zones: List[models.Zone] = []
+    sources: Sequence[AnySource] = []
+    zones: Sequence[AnyZone] = []
 
     self.disp_start_time = time.time()
     self.sleep_timer = time.time()
@@ -514,7 +515,7 @@ class TFTDisplay(Display):
       self.led.duty_cycle = 0
 
 
-def draw_volume_bars(draw, font, small_font, zones: List[models.Zone], x=0, y=0, width=320, height=240):
+def draw_volume_bars(draw, font, small_font, zones: Sequence[AnyZone], x=0, y=0, width=320, height=240):
   n = len(zones)
   if n == 0:  # No zone info from AmpliPi server
     pass
@@ -582,15 +583,18 @@ def gradient(num, min_val=0, max_val=100):
   return f'#{red:02X}{grn:02X}00'
 
 
-def get_amplipi_data(base_url: Optional[str]) -> Tuple[bool, List[models.Source], List[models.Zone]]:
-  """ Get the AmpliPi's status via the REST API
+def get_amplipi_data(base_url: Optional[str]) -> Tuple[bool, Sequence[AnySource], Sequence[AnyZone]]:
+  """ Get the AmpliPi's status, from shared memory if it is local or via the REST API
       Returns true/false on success/failure, as well as the sources and zones
   """
-  _zones: List[models.Zone] = []
-  _sources: List[models.Source] = []
+  _zones: Sequence[AnyZone] = []
+  _sources: Sequence[AnySource] = []
   success = False
   if base_url is None:
     return False, _sources, _zones
+  shared = read_shared_status(base_url)
+  if shared is not None:
+    return True, shared.sources, shared.zones
   try:
     """ TODO: If the AmpliPi server isn't available at this url, there is a
     5-second delay introduced by socket.getaddrinfo """
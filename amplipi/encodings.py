@@ -0,0 +1,113 @@
+# AmpliPi Home Audio
+# Copyright (C) 2022 MicroNova LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Alternate encodings of the API's responses
+
+Clients that parse the status often (touch panels, home automation bridges) can ask for a compact binary
+encoding using the Accept header, either MessagePack or CBOR. Both are optional, an encoding is only offered
+when its library is installed.
+"""
+
+import json
+from typing import Any, List, Optional, Tuple
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None  # type: ignore
+
+try:
+  import cbor2
+except ImportError:
+  cbor2 = None  # type: ignore
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+
+# media types clients use for the encodings, Val: the encoding's canonical media type
+_MEDIA_TYPES = {
+  JSON: JSON,
+  MSGPACK: MSGPACK,
+  'application/x-msgpack': MSGPACK,
+  'application/vnd.msgpack': MSGPACK,
+  CBOR: CBOR,
+}
+
+EXTENSIONS = {JSON: 'json', MSGPACK: 'msgpack', CBOR: 'cbor'}
+
+
+def available() -> List[str]:
+  """ Get the media types that responses can be encoded as """
+  types = [JSON]
+  if msgpack is not None:
+    types.append(MSGPACK)
+  if cbor2 is not None:
+    types.append(CBOR)
+  return types
+
+
+def _parse_accept(accept: str) -> List[Tuple[str, float]]:
+  """ Get the media types of an Accept header with their quality values """
+  accepted = []
+  for item in accept.split(','):
+    parts = [p.strip() for p in item.split(';')]
+    quality = 1.0
+    for param in parts[1:]:
+      if param.startswith('q='):
+        try:
+          quality = float(param[2:])
+        except ValueError:
+          quality = 0.0
+    accepted.append((parts[0].lower(), quality))
+  return accepted
+
+
+def negotiate(accept: Optional[str]) -> str:
+  """ Get the media type to encode a response as, given the request's Accept header
+
+  JSON is used unless the client prefers one of the available binary encodings.
+  """
+  if not accept:
+    return JSON
+  offered = available()
+  best, best_quality = JSON, 0.0
+  for media_type, quality in _parse_accept(accept):
+    encoding = _MEDIA_TYPES.get(media_type)
+    # JSON wins ties, it is what clients get when they accept anything
+    if encoding in offered and quality > 0 and (quality > best_quality or (quality == best_quality and encoding == JSON)):
+      best, best_quality = encoding, quality
+  return best
+
+
+def encode(data: Any, media_type: str) -> bytes:
+  """ Encode @data, made of JSON compatible types, as @media_type """
+  if media_type == MSGPACK and msgpack is not None:
+    return msgpack.packb(data, use_bin_type=True)
+  if media_type == CBOR and cbor2 is not None:
+    # the status repeats the same field names for every zone, source, stream...
+    # string referencing encodes each one once and refers back to it after that
+    return cbor2.dumps(data, string_referencing=True)
+  return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def decode(data: bytes, media_type: str) -> Any:
+  """ Decode @data encoded as @media_type """
+  if media_type == MSGPACK and msgpack is not None:
+    return msgpack.unpackb(data, raw=False)
+  if media_type == CBOR and cbor2 is not None:
+    return cbor2.loads(data)
+  return json.loads(data)
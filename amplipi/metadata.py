@@ -0,0 +1,287 @@
+# AmpliPi Home Audio
+# Copyright (C) 2022 MicroNova LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Background source metadata updates
+
+The streams write their metadata (currentSong, metadata.json, ...) to files in the config's srcs folder.
+Instead of reading those files on every request they are watched here, using inotify when available.
+Helpers that support it push their metadata over the metadata bus instead, skipping the files altogether.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+# inotify event flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+MAX_MESSAGE_SIZE = 64 * 1024  # largest metadata message accepted on the bus
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (followed by a null padded name)
+
+
+class Inotify:
+  """ Minimal recursive directory watcher using the Linux inotify API through ctypes """
+
+  def __init__(self):
+    self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    self._dirs: Dict[int, str] = {}  # Key: watch descriptor, Val: directory
+
+  def watch_tree(self, folder: str):
+    """ Watch @folder and all of its subfolders, including ones created later """
+    for dirpath, _, _ in os.walk(folder):
+      wd = self._libc.inotify_add_watch(self.fd, dirpath.encode(), _WATCH_MASK)
+      if wd < 0:
+        logger.warning(f'Unable to watch {dirpath}: {os.strerror(ctypes.get_errno())}')
+      else:
+        self._dirs[wd] = dirpath
+
+  def read(self) -> List[str]:
+    """ Read the pending events, returning the paths that changed """
+    try:
+      buf = os.read(self.fd, 64 * 1024)
+    except BlockingIOError:
+      return []
+    paths = []
+    offset = 0
+    while offset < len(buf):
+      wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+      offset += _EVENT.size
+      name = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+      offset += length
+      if mask & IN_Q_OVERFLOW:
+        paths.append('')  # events were lost, anything could have changed
+        continue
+      if mask & IN_IGNORED:
+        self._dirs.pop(wd, None)
+        continue
+      path = os.path.join(self._dirs.get(wd, ''), name)
+      if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+        self.watch_tree(path)
+      paths.append(path)
+    return paths
+
+  def close(self):
+    os.close(self.fd)
+
+
+class MetadataWatcher:
+  """ Calls @refresh(True) from a background thread whenever a file in @folder changes
+
+  @refresh(False) is also called every @interval seconds when nothing changed, to pick up state that isn't backed by a file.
+  Without inotify changes can't be detected, @refresh(True) is called every @poll_interval seconds instead.
+  Bursts of changes are coalesced, waiting @settle seconds after the first change before refreshing.
+  """
+
+  def __init__(self, folder: str, refresh: Callable[[bool], None], interval: float = 5.0,
+               poll_interval: float = 1.0, settle: float = 0.05):
+    self.folder = folder
+    self._refresh = refresh
+    self._interval = interval
+    self._poll_interval = poll_interval
+    self._settle = settle
+    self._inotify: Optional[Inotify] = None
+    self._wake_r, self._wake_w = os.pipe()
+    self._stop = False
+    try:
+      os.makedirs(folder, exist_ok=True)
+      self._inotify = Inotify()
+      self._inotify.watch_tree(folder)
+    except Exception as exc:
+      logger.warning(f'inotify unavailable, polling metadata every {poll_interval}s instead: {exc}')
+      self._inotify = None
+    self._thread = threading.Thread(target=self._run, name='metadata-watcher', daemon=True)
+    self._thread.start()
+
+  def trigger(self):
+    """ Refresh as soon as possible """
+    os.write(self._wake_w, b'\0')
+
+  def stop(self):
+    """ Stop watching, waits for any refresh in progress """
+    self._stop = True
+    self.trigger()
+    if threading.current_thread() is not self._thread:
+      self._thread.join()
+    os.close(self._wake_r)
+    os.close(self._wake_w)
+    if self._inotify:
+      self._inotify.close()
+
+  def _wait(self, timeout: float) -> bool:
+    """ Wait for a change, returns False on timeout """
+    fds = [self._wake_r] + ([self._inotify.fd] if self._inotify else [])
+    ready, _, _ = select.select(fds, [], [], timeout)
+    if self._wake_r in ready:
+      os.read(self._wake_r, 64)
+    if self._inotify and self._inotify.fd in ready:
+      self._inotify.read()  # drain the events, new folders get watched while reading
+    return bool(ready)
+
+  def _run(self):
+    while not self._stop:
+      changed = self._wait(self._interval if self._inotify else self._poll_interval)
+      if self._stop:
+        break
+      if changed:
+        # let any related writes finish (ie. a stream writing several files) before refreshing,
+        # a stream that keeps writing can only delay the refresh by a few settle periods
+        deadline = time.monotonic() + 10 * self._settle
+        while time.monotonic() < deadline and self._wait(self._settle) and not self._stop:
+          pass
+      try:
+        self._refresh(changed or self._inotify is None)
+      except Exception as exc:
+        logger.exception(f'Error refreshing metadata: {exc}')
+
+
+class MetadataBus:
+  """ Receives the metadata the streams' helper processes push over a unix datagram socket at @sock_path
+
+  Each datagram is a json object {"path": <metadata file path>, "data": <the file's json contents>}, published
+  in place of writing the file (see streams/metadata_bus.py). The latest data for each path is kept parsed in memory,
+  so reading it needs no file access. @on_publish is called after each update.
+  """
+
+  def __init__(self, sock_path: str, on_publish: Optional[Callable[[], None]] = None):
+    global _bus
+    self.sock_path = sock_path
+    self._on_publish = on_publish
+    self._lock = threading.Lock()
+    self._values: Dict[str, Any] = {}
+    try:
+      os.remove(sock_path)
+    except FileNotFoundError:
+      pass
+    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self._sock.bind(sock_path)
+    self._inode = os.stat(sock_path).st_ino
+    self._stop = False
+    self._thread = threading.Thread(target=self._run, name='metadata-bus', daemon=True)
+    self._thread.start()
+    _bus = self
+
+  def get(self, path: str) -> Any:
+    """ Get the data published for @path, raises a KeyError if nothing was """
+    with self._lock:
+      return self._values[path]
+
+  def set(self, path: str, data: Any):
+    """ Update the data for @path, as if it was published """
+    with self._lock:
+      self._values[path] = data
+
+  def discard(self, path: str):
+    """ Forget the data published for @path """
+    with self._lock:
+      self._values.pop(path, None)
+
+  def _run(self):
+    while not self._stop:
+      try:
+        raw = self._sock.recv(MAX_MESSAGE_SIZE)
+      except OSError:
+        break  # closed
+      if self._stop:
+        break
+      try:
+        msg = json.loads(raw)
+        self.set(str(msg['path']), msg['data'])
+      except Exception as exc:
+        logger.warning(f'Ignoring invalid metadata message: {exc}')
+        continue
+      if self._on_publish:
+        try:
+          self._on_publish()
+        except Exception as exc:
+          logger.exception(f'Error handling published metadata: {exc}')
+
+  def stop(self):
+    """ Stop receiving, the helpers fall back to writing their metadata files """
+    global _bus
+    if _bus is self:
+      _bus = None
+    self._stop = True
+    self._sock.shutdown(socket.SHUT_RDWR)  # wakes the receiver up
+    self._thread.join(timeout=1)
+    self._sock.close()
+    try:
+      # another bus may have taken over the socket path
+      if os.stat(self.sock_path).st_ino == self._inode:
+        os.remove(self.sock_path)
+    except OSError:
+      pass
+
+
+_bus: Optional[MetadataBus] = None
+
+
+def read_json(path: str) -> Any:
+  """ Read the metadata at @path, published on the bus or written to the file, raises an OSError if there is none """
+  bus = _bus
+  if bus is not None:
+    try:
+      return bus.get(path)
+    except KeyError:
+      pass
+  with open(path, 'r', encoding='utf-8') as file:
+    return json.load(file)
+
+
+def write_json(path: str, data: Any):
+  """ Write the metadata at @path, where read_json() will find it """
+  bus = _bus
+  if bus is not None:
+    bus.set(path, data)
+    return
+  with open(path, 'w', encoding='utf-8') as file:
+    json.dump(data, file)
+
+
+def discard(path: str):
+  """ Remove the metadata at @path """
+  bus = _bus
+  if bus is not None:
+    bus.discard(path)
+  try:
+    os.remove(path)
+  except FileNotFoundError:
+    pass
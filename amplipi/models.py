@@ -21,13 +21,13 @@ Encourages reuse of datastructures across AmpliPi
 
 # type handling, fastapi leverages type checking for performance and easy docs
 from functools import lru_cache
-from typing import List, Dict, Optional, Union, Set
+from typing import Any, List, Dict, Optional, Union, Set
 from types import SimpleNamespace
 from enum import Enum
 from pathlib import Path
 
 # pylint: disable=no-name-in-module
-from pydantic import BaseSettings, BaseModel, Field
+from pydantic import BaseSettings, BaseModel, Field, PrivateAttr
 
 # pylint: disable=too-few-public-methods
 # pylint: disable=missing-class-docstring
@@ -974,6 +974,61 @@ class Announcement(BaseModel):
     }
 
 
+class AnnouncementState(str, Enum):
+  QUEUED = 'queued'
+  PLAYING = 'playing'
+  DONE = 'done'
+  FAILED = 'failed'
+
+
+class AnnouncementJob(BaseModel):
+  """ An announcement played in the background, announcements are played one at a time in the order they were made """
+  id: int = Field(description='Unique identifier')
+  state: AnnouncementState = Field(description='Progress of the announcement')
+  announcement: Announcement
+  created: int = Field(description='Time the announcement was made (unix time)')
+  finished: Optional[int] = Field(default=None, description='Time the announcement finished (unix time)')
+  error: Optional[str] = Field(default=None, description='Reason the announcement failed')
+  # the controller's response to the announcement (an amplipi.ctrl.ApiResponse), kept to report its exact error
+  _response: Any = PrivateAttr(default=None)
+
+  @property
+  def response(self) -> Any:
+    """ The controller's response to the announcement, None until it has finished """
+    return self._response
+
+  class Config:
+    schema_extra = {
+      'examples': {
+        'Queued announcement': {
+          'value': {
+            'id': 3,
+            'state': 'queued',
+            'announcement': {
+              'media': 'https://www.nasa.gov/wp-content/uploads/2015/01/640150main_Go20at20Throttle20Up.mp3',
+              'vol_f': 0.5,
+              'source_id': 3,
+            },
+            'created': 1700000000,
+          }
+        },
+        'Finished announcement': {
+          'value': {
+            'id': 2,
+            'state': 'done',
+            'announcement': {
+              'media': 'https://www.nasa.gov/wp-content/uploads/2015/01/640150main_Go20at20Throttle20Up.mp3',
+              'vol_f': 0.5,
+              'source_id': 3,
+            },
+            'created': 1700000000,
+            'finished': 1700000004,
+          }
+        },
+      }
+    }
+
+
 class PlayMedia(BaseModel):
   """ Plays media on a specified source.
   Will return an error if there is no source specified.
@@ -1004,6 +1059,43 @@ class FirmwareInfo(BaseModel):
   git_dirty: bool = Field(default=False, description="True if local changes were made. Used for development.")
 
 
+class PreampBusStats(BaseModel):
+  """ I2C bus statistics for an AmpliPi controller or expansion unit's preamp board """
+  unit: int = Field(description='0 for the main unit, 1-5 for expansion units')
+  address: int = Field(description='I2C address of the preamp')
+  writes_issued: int = Field(default=0, description='register writes sent over the bus')
+  writes_skipped: int = Field(default=0, description='register writes skipped because the preamp already had the value')
+  writes_collapsed: int = Field(default=0, description='queued register writes replaced by a newer value before being sent')
+  retries: int = Field(default=0, description='writes that failed and were retried after reopening the bus')
+  failures: int = Field(default=0, description='writes that failed even after being retried')
+  verifications: int = Field(default=0, description="read-back verifications of the preamp's registers")
+  drift: int = Field(default=0, description='registers found out of sync and rewritten')
+  latency_buckets_ms: List[float] = Field(
+    default=[], description='upper bounds of the latency histogram buckets, the last bucket has no upper bound')
+  latency_counts: List[int] = Field(default=[], description='number of bus transactions in each latency bucket')
+
+  class Config:
+    schema_extra = {
+      'examples': {
+        'Main unit': {
+          'value': {
+            'unit': 0,
+            'address': 8,
+            'writes_issued': 1432,
+            'writes_skipped': 5120,
+            'writes_collapsed': 87,
+            'retries': 1,
+            'failures': 0,
+            'verifications': 240,
+            'drift': 0,
+            'latency_buckets_ms': [0.25, 0.5, 1, 2, 5, 10, 50],
+            'latency_counts': [0, 1210, 215, 6, 1, 0, 0, 0],
+          }
+        }
+      }
+    }
+
+
 class Info(BaseModel):
   """ AmpliPi System information """
   version: str = Field(description="software version")
@@ -1396,12 +1488,49 @@ class Status(BaseModel):
     }
 
 
+class StatusChanges(BaseModel):
+  """ What changed in the zones, sources, groups, streams and presets since a previous version of the status """
+  version: int = Field(description='Current version of the status, pass it as since to get the next changes')
+  resync: bool = Field(default=False, description='The changes are no longer available, get the full status instead')
+  changes: Dict[str, Any] = Field(default={}, description='For each kind of entity, the full entities that changed or were added (changed) '
+                                  'and the ids of the deleted entities (removed), or null if the whole kind was removed. Kinds of entities that did not change are left out.')
+
+  class Config:
+    schema_extra = {
+      'examples': {
+        'Zone renamed': {
+          'value': {
+            'version': 42,
+            'resync': False,
+            'changes': {
+              'zones': {
+                'changed': [{'id': 0, 'name': 'Kitchen', 'source_id': 0, 'mute': False, 'vol': -40, 'vol_f': 0.5,
+                             'vol_min': -80, 'vol_max': 0, 'disabled': False}],
+                'removed': []
+              }
+            }
+          }
+        },
+        'Resync needed': {
+          'value': {
+            'version': 1337,
+            'resync': True,
+            'changes': {}
+          }
+        }
+      }
+    }
+
+
 class AppSettings(BaseSettings):
   """ Controller settings """
   mock_ctrl: bool = True
   mock_streams: bool = True
   config_file: str = str(Path.home() / '.config' / 'amplipi' / 'house.json')
   delay_saves: bool = True
+  journal_saves: bool = False
+  worker_threads: int = 40  # threads available to run the synchronous API endpoints
+  art_sizes: List[int] = [80, 160, 240, 320]  # album art sizes scaled ahead of time when a track changes, empty to disable
 
 
 class DebugResponse(BaseModel):
@@ -2,15 +2,13 @@
 
 from dataclasses import dataclass
 from enum import Enum, auto
-import json
-import os
 import sys
 import logging
 from typing import List
 import subprocess
 from dasbus.connection import SessionMessageBus
 from dasbus.client.proxy import disconnect_proxy
-from amplipi import utils
+from amplipi import metadata, utils
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -54,10 +52,9 @@ class MPRIS:
     self._closing = False
 
     try:
-      with open(self.metadata_path, "w", encoding='utf-8') as f:
-        m = Metadata()
-        m.state = "Stopped"
-        json.dump(m.__dict__, f)
+      m = Metadata()
+      m.state = "Stopped"
+      metadata.write_json(self.metadata_path, m.__dict__)
     except Exception as e:
       logger.exception(f'Exception clearing metadata file: {e}')
 
@@ -93,14 +90,13 @@ class MPRIS:
 
   def _load_metadata(self) -> Metadata:
     try:
-      with open(self.metadata_path, 'r', encoding='utf-8') as f:
-        metadata_dict = json.load(f)
-        metadata_obj = Metadata()
+      metadata_dict = metadata.read_json(self.metadata_path)
+      metadata_obj = Metadata()
 
-        for k in metadata_dict.keys():
-          metadata_obj.__dict__[k] = metadata_dict[k]
+      for k in metadata_dict.keys():
+        metadata_obj.__dict__[k] = metadata_dict[k]
 
-        return metadata_obj
+      return metadata_obj
     except Exception as e:
       logger.exception(f"MPRIS loading metadata at {self.metadata_path} failed: {e}")
 
@@ -160,9 +156,7 @@ class MPRIS:
     logger.info("mpris closed")
 
     try:
-      os.remove(self.metadata_path)
-    except FileNotFoundError:
-      pass
+      metadata.discard(self.metadata_path)
     except Exception as e:
       logger.exception(f'Could not remove metadata file: {e}')
     logger.info(f'Closed MPRIS {self.service_suffix}')
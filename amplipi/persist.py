@@ -0,0 +1,262 @@
+# AmpliPi Home Audio
+# Copyright (C) 2022 MicroNova LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Configuration persistence
+
+Saves are debounced and written from a single thread, files are replaced atomically so a crash or power loss
+during a save always leaves a valid configuration behind.
+In journal mode each change is appended to a small log instead, which is compacted into the configuration file
+every so often.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from amplipi import utils
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+
+def _fsync_dir(path: str):
+  """ Make a rename in @path's folder durable """
+  try:
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+  except OSError:
+    return  # not supported on every platform/filesystem
+  try:
+    os.fsync(dir_fd)
+  finally:
+    os.close(dir_fd)
+
+
+def atomic_write(path: str, data: bytes, backup_path: Optional[str] = None):
+  """ Replace the file at @path with @data, without it ever being missing or partially written
+
+  If @backup_path is given the previous file is kept there.
+  """
+  tmp_path = f'{path}.tmp'
+  with open(tmp_path, 'wb') as tmp_file:
+    tmp_file.write(data)
+    tmp_file.flush()
+    os.fsync(tmp_file.fileno())
+  if backup_path and os.path.exists(path):
+    # link the current file as the backup instead of copying it, this avoids an extra write to the SD card
+    backup_tmp = f'{backup_path}.tmp'
+    if os.path.exists(backup_tmp):
+      os.remove(backup_tmp)
+    try:
+      os.link(path, backup_tmp)
+    except OSError:
+      shutil.copyfile(path, backup_tmp)  # the filesystem doesn't support hard links
+    os.replace(backup_tmp, backup_path)
+  os.replace(tmp_path, path)
+  _fsync_dir(path)
+
+
+class ConfigWriter:
+  """ Saves a configuration file from a long-lived background thread
+
+  schedule() saves @delay seconds after the last change, but a steady stream of changes can't postpone a save
+  more than @max_delay seconds past the first unsaved change. Nothing is written if the serialized configuration
+  is identical to the last one saved.
+  """
+
+  def __init__(self, path: str, serialize: Callable[[], bytes], delay: float = 5.0, max_delay: float = 30.0,
+               backup_current: bool = True, on_saved: Optional[Callable[[], None]] = None):
+    self.path = path
+    self.backup_path = f'{path}.bak'
+    # only a valid configuration is worth backing up, a corrupted one is overwritten without replacing the backup
+    self.backup_current = backup_current
+    self.writes = 0
+    self._serialize = serialize
+    self._on_saved = on_saved  # called once the serialized config is on disk, even if the write was skipped
+    self._delay = delay
+    self._max_delay = max_delay
+    self._last_saved: Optional[bytes] = None
+    if backup_current:
+      try:
+        with open(path, 'rb') as current:
+          self._last_saved = current.read()
+      except OSError:
+        pass
+    self._write_lock = threading.Lock()
+    self._cond = threading.Condition()
+    self._due: Optional[float] = None
+    self._first_change: Optional[float] = None
+    self._stop = False
+    self._thread = threading.Thread(target=self._run, name='config-writer', daemon=True)
+    self._thread.start()
+
+  @property
+  def pending(self) -> bool:
+    """ True if there are changes waiting to be saved """
+    with self._cond:
+      return self._due is not None
+
+  def schedule(self, delay: Optional[float] = None):
+    """ Save the configuration soon, after changes have settled
+
+    @delay overrides the writer's delay, a zero delay saves from the writer thread right away. Unlike save() this
+    never waits on the write, so it can be used while holding a lock the serializer needs.
+    """
+    with self._cond:
+      now = time.monotonic()
+      if self._first_change is None:
+        self._first_change = now
+      self._due = min(now + (self._delay if delay is None else delay), self._first_change + self._max_delay)
+      self._cond.notify()
+
+  def save(self) -> bool:
+    """ Save the configuration right away, returns True if the file was written """
+    with self._cond:
+      self._due = None
+      self._first_change = None
+    return self._write()
+
+  def stop(self):
+    """ Stop the writer thread, saving any pending changes """
+    with self._cond:
+      self._stop = True
+      self._cond.notify()
+    if threading.current_thread() is not self._thread:
+      self._thread.join()
+    if self.pending:
+      self.save()
+
+  def _write(self) -> bool:
+    with self._write_lock:
+      data = self._serialize()
+      written = data != self._last_saved
+      if written:
+        atomic_write(self.path, data, self.backup_path if self.backup_current else None)
+        self._last_saved = data
+        self.backup_current = True
+        self.writes += 1
+      if self._on_saved:
+        self._on_saved()
+      return written
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while not self._stop and (self._due is None or self._due > time.monotonic()):
+          self._cond.wait(None if self._due is None else self._due - time.monotonic())
+        if self._stop:
+          return
+        self._due = None
+        self._first_change = None
+      try:
+        self._write()
+      except Exception as exc:
+        logger.exception(f'Error saving config: {exc}')
+
+
+class StateJournal:
+  """ Append-only log of configuration changes, stored as one json entry per line next to the configuration
+
+  Each entry is a timestamped delta generated by utils.status_delta(). Compacting the journal into the config
+  happens in two steps so a crash in between never loses a change: rotate() moves the current entries aside
+  right when the config is serialized, then discard_rotated() deletes them once the config is safely on disk.
+  Replaying entries is idempotent, so replaying a rotated journal on top of an already compacted config is harmless.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self.rotated_path = f'{path}.old'
+    self._file = open(path, 'ab')  # pylint: disable=consider-using-with
+    self.size = self._truncate_partial()
+
+  def _truncate_partial(self) -> int:
+    """ Drop a partial entry left by a crash mid append, so it isn't merged with the next entry """
+    with open(self.path, 'rb') as journal:
+      data = journal.read()
+    size = data.rfind(b'\n') + 1
+    if size != len(data):
+      logger.warning(f'Dropping partial entry at the end of {self.path}')
+      self._file.truncate(size)
+    return size
+
+  def append(self, delta: Dict):
+    """ Durably record a change """
+    line = json.dumps({'time': time.time(), 'delta': delta}, separators=(',', ':')).encode('utf-8') + b'\n'
+    self._file.write(line)
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    self.size += len(line)
+
+  def entries(self) -> List[Tuple[float, Dict]]:
+    """ Get the (time, delta) entries of the rotated and current journals, oldest first """
+    entries = []
+    for path in [self.rotated_path, self.path]:
+      if not os.path.exists(path):
+        continue
+      with open(path, 'rb') as journal:
+        for num, line in enumerate(journal, start=1):
+          try:
+            entry = json.loads(line)
+            entries.append((entry['time'], entry['delta']))
+          except Exception:
+            # most likely a partial entry from a crash mid append, nothing after it could have been written
+            logger.warning(f'Ignoring invalid entry {num} of {path}')
+            break
+    return entries
+
+  def replay(self, state: Dict, until: Optional[float] = None) -> Tuple[Dict, int]:
+    """ Apply the journaled changes to @state, only the changes made up to the timestamp @until if given
+
+    Returns the new state and the number of changes applied
+    """
+    applied = 0
+    for timestamp, delta in self.entries():
+      if until is not None and timestamp > until:
+        break
+      utils.apply_status_delta(state, delta)
+      applied += 1
+    return state, applied
+
+  def rotate(self):
+    """ Move the current entries aside, they are all covered by the config being saved """
+    if self.size == 0:
+      return
+    self._file.close()
+    if os.path.exists(self.rotated_path):
+      # the last compaction never finished, keep its entries too
+      with open(self.path, 'rb') as current, open(self.rotated_path, 'ab') as rotated:
+        rotated.write(current.read())
+        rotated.flush()
+        os.fsync(rotated.fileno())
+      os.remove(self.path)
+    else:
+      os.replace(self.path, self.rotated_path)
+    self._file = open(self.path, 'ab')  # pylint: disable=consider-using-with
+    self.size = 0
+
+  def discard_rotated(self):
+    """ Delete the rotated entries, the config covering them has been saved """
+    if os.path.exists(self.rotated_path):
+      os.remove(self.rotated_path)
+
+  def close(self):
+    self._file.close()
@@ -19,14 +19,20 @@
 """
 
 import io
+import bisect
 import math
 import os
 import time
 import logging
 import sys
-from dataclasses import dataclass
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from enum import Enum
-from typing import Dict, List, Tuple, Union, Optional
+from typing import Any, Callable, Dict, List, Set, Tuple, Union, Optional
 
 from smbus2 import SMBus
 from serial import Serial
@@ -82,6 +88,21 @@ _DEV_ADDRS = [0x08, 0x10, 0x18, 0x20, 0x28, 0x30]
 
 MAX_ZONES = 6 * len(_DEV_ADDRS)
 
+# Priorities of queued register writes, lower values are sent first.
+# Zones are muted before volumes change and volumes before sources are rerouted, unmuting is done last.
+_PRIO_MUTE = 0
+_PRIO_VOL = 1
+_PRIO_SRC = 2
+_PRIO_UNMUTE = 3
+
+# Upper bounds (in ms) of the bus transaction latency histogram buckets, the last bucket counts everything slower
+LATENCY_BUCKETS_MS = [0.25, 0.5, 1, 2, 5, 10, 50]
+
+# Seconds between read-back verifications of the preamp registers
+_VERIFY_INTERVAL = 30.0
+# Seconds until a suspected register is checked again, registers are only repaired after failing twice in a row
+_VERIFY_RECHECK = 1.0
+
 
 class FanCtrl(Enum):
   MAX6644 = 0
@@ -102,6 +123,29 @@ class PowerStatus:
   v12: float  # Fan power supply voltage, nominally 12V
 
 
+@dataclass
+class WriteStats:
+  """ Register write counts for a single preamp, used to measure the shadow register savings """
+  issued: int = 0  # register writes actually sent over I2C
+  skipped: int = 0  # writes dropped because the preamp already had the requested value
+  collapsed: int = 0  # queued writes replaced by a newer value before being sent
+
+
+@dataclass
+class BusStats:
+  """ Bus health counters for a single preamp """
+  retries: int = 0  # writes that failed and were retried, the bus is reopened before every retry
+  failures: int = 0  # writes that still failed after the retry
+  verifications: int = 0  # read-back verifications of the preamp's registers
+  drift: int = 0  # registers found out of sync with the mirror and rewritten
+  latency: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))  # latency histogram
+
+  def record_latency(self, seconds: float):
+    """ Count a bus transaction in the latency histogram """
+    bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)
+    self.latency[bucket] += 1
+
+
 def is_amplipi():
   """ Check if the current hardware is an AmpliPi
 
@@ -139,14 +183,139 @@ def is_amplipi():
   return is_amplipi
 
 
+class _BusExecutor:
+  """ Single thread that owns the preamp bus, sending queued register writes in priority order
+
+  Only the newest value of a pending register write is kept, so bursts of updates to the same register
+  (e.g. dragging a volume slider) are absorbed while the bus is busy.
+  """
+
+  def __init__(self, send: Callable[[int, int, int], None]):
+    self._send = send
+    self._cond = threading.Condition()
+    self._heap: List[Tuple[int, int, Any]] = []  # (priority, sequence, (addr, reg) or (func, future))
+    self._pending: Dict[Tuple[int, int, int], int] = {}  # Key: (addr, reg, priority), Val: register value
+    self._seq = itertools.count()
+    self._busy = False
+    self._stop = False
+    self._thread = threading.Thread(target=self._run, name='preamp-bus', daemon=True)
+    self._thread.start()
+
+  def queue_write(self, addr: int, reg: int, value: int, prio: int) -> bool:
+    """ Queue a register write, returns True if it replaced a pending write to the same register """
+    with self._cond:
+      key = (addr, reg, prio)
+      replaced = key in self._pending
+      self._pending[key] = value
+      if not replaced:
+        heapq.heappush(self._heap, (prio, next(self._seq), (addr, reg)))
+        self._cond.notify_all()
+      return replaced
+
+  def drop_write(self, addr: int, reg: int, prio: int) -> bool:
+    """ Drop a pending register write, returns True if there was one """
+    with self._cond:
+      return self._pending.pop((addr, reg, prio), None) is not None
+
+  def pending(self, addr: int, reg: int, prio: int) -> Optional[int]:
+    """ Get the value of a pending register write """
+    with self._cond:
+      return self._pending.get((addr, reg, prio))
+
+  def has_pending(self, addr: int, reg: int) -> bool:
+    """ Check if there is a pending write to a register, at any priority """
+    with self._cond:
+      return any((addr, reg, prio) in self._pending for prio in (_PRIO_MUTE, _PRIO_VOL, _PRIO_SRC, _PRIO_UNMUTE))
+
+  def call(self, func: Callable[[], Any], prio: int = _PRIO_MUTE) -> Any:
+    """ Run @func on the bus thread and return its result, used to serialize reads with the queued writes """
+    if threading.current_thread() is self._thread:
+      return func()
+    future: Future = Future()
+    with self._cond:
+      heapq.heappush(self._heap, (prio, next(self._seq), (func, future)))
+      self._cond.notify_all()
+    return future.result()
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    """ Wait for all of the queued operations to be sent, returns False on timeout """
+    with self._cond:
+      return self._cond.wait_for(lambda: not self._heap and not self._busy, timeout)
+
+  def clear(self):
+    """ Drop all of the pending register writes """
+    with self._cond:
+      self._pending.clear()
+
+  def stop(self):
+    """ Stop the bus thread once the operations in progress are done """
+    with self._cond:
+      self._stop = True
+      self._cond.notify_all()
+    if threading.current_thread() is not self._thread:
+      self._thread.join()
+
+  def _next(self) -> Optional[Callable[[], None]]:
+    """ Pop the next operation off the queue, must be called with the lock held """
+    prio, _, item = heapq.heappop(self._heap)
+    if isinstance(item[1], Future):
+      func, future = item
+
+      def run():
+        if future.set_running_or_notify_cancel():
+          try:
+            future.set_result(func())
+          except Exception as exc:
+            future.set_exception(exc)
+      return run
+    addr, reg = item
+    if (addr, reg, prio) not in self._pending:
+      return None  # this write was dropped
+    value = self._pending.pop((addr, reg, prio))
+    return lambda: self._send(addr, reg, value)
+
+  def _run(self):
+    while True:
+      with self._cond:
+        self._cond.wait_for(lambda: self._heap or self._stop)
+        if self._stop:
+          return
+        job = self._next()
+        self._busy = job is not None
+      if job is not None:
+        try:
+          job()
+        except Exception as exc:
+          logger.exception(f'Error on the preamp bus: {exc}')
+      with self._cond:
+        self._busy = False
+        self._cond.notify_all()
+
+
 class _Preamps:
   """ Low level discovery and communication for the AmpliPi firmware
   """
 
   preamps: Dict[int, List[int]]  # Key: i2c address, Val: register values
+  synced: Dict[int, Set[int]]  # Key: i2c address, Val: registers known to match the preamp's actual value
+  stats: Dict[int, WriteStats]  # Key: i2c address, Val: write counts
+  bus_stats: Dict[int, BusStats]  # Key: i2c address, Val: bus health counters
 
   def __init__(self, reset: bool = True, set_addr: bool = True, bootloader: bool = False, debug=True):
     self.preamps = dict()
+    self.synced = dict()
+    self.stats = dict()
+    self.bus_stats = dict()
+    self._suspects: Dict[int, Dict[int, Tuple[int, int]]] = {}  # Key: i2c address, Val: {reg: (expected, read)}
+    self._verifier: Optional[threading.Thread] = None
+    self._verify_now = threading.Event()
+    self._closing = False
+    self._last_write = 0.0
+    self._batch_depth = 0
+    self._staged: Dict[int, Dict[int, int]] = {}  # Key: i2c address, Val: {register: value}
+    self._lock = threading.RLock()  # guards the register mirror, the write stats and batching
+    self._sent_mute: Dict[int, int] = {}  # Key: i2c address, Val: last MUTE value handed to the bus
+    self._executor: Optional[_BusExecutor] = None
     if not is_amplipi():
       self.bus = None  # TODO: Use i2c-stub
       logger.info('Not running on AmpliPi hardware, mocking preamp connection')
@@ -170,9 +339,59 @@ class _Preamps:
             logger.info('Error: no preamps found')
           break
 
+      # from now on the bus is only accessed from the executor's thread
+      self.start_executor()
+      self.start_verifier()
+
   def __del__(self):
+    self.close()
+
+  def close(self):
+    """ Send any queued register writes, then release the bus """
+    self._closing = True
+    if self._verifier:
+      self._verify_now.set()
+      self._verifier.join()
+      self._verifier = None
+    if self._executor:
+      self._executor.flush()
+      self._executor.stop()
+      self._executor = None
     if self.bus:
       self.bus.close()
+      self.bus = None
+
+  def start_executor(self):
+    """ Hand the bus over to a dedicated thread, register writes are queued instead of blocking the caller """
+    if self._executor is None:
+      self._executor = _BusExecutor(self._send)
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    """ Wait for the queued register writes to be sent, returns False on timeout """
+    if self._executor is None:
+      return True
+    return self._executor.flush(timeout)
+
+  def _on_bus(self, func: Callable[[], Any]) -> Any:
+    """ Run a bus transaction, serialized with the queued writes when the executor owns the bus """
+    if self._executor is None:
+      return func()
+    return self._executor.call(func)
+
+  def _read(self, preamp_addr: int, reg: int) -> int:
+    """ Read a register """
+    return self._on_bus(lambda: self._smbus().read_byte_data(preamp_addr, reg))
+
+  def _read_regs(self, preamp_addr: int, count: int) -> List[int]:
+    """ Read the first @count registers as one batch on the bus
+
+    The firmware only supports single byte reads, so the registers are read back to back.
+    """
+    return self._on_bus(lambda: [self._smbus().read_byte_data(preamp_addr, reg) for reg in range(count)])
+
+  def _write_unmirrored(self, preamp_addr: int, reg: int, data: int):
+    """ Write a register that isn't part of the register mirror (fans, LEDs) """
+    self._on_bus(lambda: self._smbus().write_byte_data(preamp_addr, reg, data))
 
   def reset_preamps(self, bootloader: bool = False):
     """ Resets the preamp board.
@@ -202,6 +421,15 @@ class _Preamps:
     # Done with GPIO, they will default back to inputs with pullups
     GPIO.cleanup()
 
+    # anything still queued was meant for the firmware state before the reset
+    if self._executor is not None:
+      self._executor.clear()
+      self._executor.flush()
+
+    # the firmware is back to its default state, the register mirror needs to follow
+    for addr in self.preamps:
+      self.new_preamp(addr)
+
   def set_i2c_addr(self):
     """ Sends the first preamp's I2C address via UART
         The master preamp will set any expansion unit addresses
@@ -227,7 +455,16 @@ class _Preamps:
     # TODO: release firmware and add support here
 
   def new_preamp(self, addr: int):
-    """ Populate initial register values """
+    """ Populate initial register values
+
+    These are the firmware's reset values, but since we haven't written them ourselves
+    they are not considered synced and the first write to each register always goes out.
+    """
+    self.synced[addr] = set()
+    self.stats.setdefault(addr, WriteStats())
+    self.bus_stats.setdefault(addr, BusStats())
+    self._suspects[addr] = {}
+    self._sent_mute[addr] = 0x3F
     self.preamps[addr] = [
       0x0F,
       0x00,
@@ -242,11 +479,201 @@ class _Preamps:
       0x4F,
     ]
 
+  def _space_writes(self):
+    """ Space out sequential bus transactions to avoid bus errors
+
+    Only sleeps for what remains of the 1 ms gap since the last write, so an idle bus isn't delayed.
+    """
+    remaining = self._last_write + 0.001 - time.monotonic()
+    if remaining > 0:
+      time.sleep(remaining)
+
+  def _smbus(self) -> SMBus:
+    """ The I2C bus, only opened on AmpliPi hardware """
+    assert self.bus is not None, 'no I2C bus without AmpliPi hardware'
+    return self.bus
+
+  def _bus_write(self, preamp_addr: int, reg: int, data: int):
+    """ Write a single register over I2C, reopening the bus and retrying once on failure """
+    stats = self.bus_stats[preamp_addr]
+    try:
+      self._space_writes()
+      start = time.monotonic()
+      self._smbus().write_byte_data(preamp_addr, reg, data)
+      stats.record_latency(time.monotonic() - start)
+    except Exception:
+      stats.retries += 1
+      time.sleep(0.001)
+      try:
+        self._smbus().close()
+      except Exception:
+        pass
+      self.bus = SMBus(1)
+      try:
+        self.bus.write_byte_data(preamp_addr, reg, data)
+      except Exception:
+        stats.failures += 1
+        raise
+      finally:
+        # the preamp may have missed other writes too
+        self.request_verify()
+    finally:
+      self._last_write = time.monotonic()
+
+  def _send(self, preamp_addr: int, reg: int, data: int):
+    """ Send a queued register write, called from the executor's thread """
+    if reg == _REG_ADDRS['MUTE']:
+      with self._lock:
+        self._sent_mute[preamp_addr] = data
+    try:
+      self._bus_write(preamp_addr, reg, data)
+    except Exception as exc:
+      logger.error(f'Failed to write preamp 0x{preamp_addr:02x} @ 0x{reg:02x}: {exc}')
+      with self._lock:
+        # the preamp's actual value is unknown, make sure the next write goes out
+        self.synced[preamp_addr].discard(reg)
+      return
+    with self._lock:
+      self.stats[preamp_addr].issued += 1
+
+  def _queue_mute(self, preamp_addr: int, mute: int):
+    """ Queue a write of the MUTE register
+
+    Newly muted zones are muted ahead of any other pending writes, zones are only unmuted after them.
+    The early mute has to keep every zone that is currently muted on the preamp muted.
+    """
+    assert self._executor is not None
+    reg = _REG_ADDRS['MUTE']
+    sent = self._sent_mute[preamp_addr]
+    early = mute | sent
+    pending = self._executor.pending(preamp_addr, reg, _PRIO_MUTE)
+    if pending is not None:
+      early |= pending
+    collapsed = 0
+    if early != sent or pending is not None:
+      collapsed += self._executor.queue_write(preamp_addr, reg, early, _PRIO_MUTE)
+    if mute != early:
+      collapsed += self._executor.queue_write(preamp_addr, reg, mute, _PRIO_UNMUTE)
+    else:
+      collapsed += self._executor.drop_write(preamp_addr, reg, _PRIO_UNMUTE)
+    self.stats[preamp_addr].collapsed += collapsed
+
+  def request_verify(self):
+    """ Ask the verifier to check the preamps' registers as soon as possible """
+    self._verify_now.set()
+
+  def start_verifier(self, interval: float = _VERIFY_INTERVAL):
+    """ Periodically read back the preamps' registers and repair any that drifted from the mirror """
+    if self._verifier is not None:
+      return
+
+    def run():
+      while not self._closing:
+        # recheck suspected registers quickly, they need to fail a second time before being repaired
+        recheck = any(self._suspects.values())
+        self._verify_now.wait(_VERIFY_RECHECK if recheck else interval)
+        self._verify_now.clear()
+        if self._closing:
+          break
+        try:
+          self.verify()
+        except Exception as exc:
+          logger.exception(f'Error verifying preamp registers: {exc}')
+
+    self._verifier = threading.Thread(target=run, name='preamp-verify', daemon=True)
+    self._verifier.start()
+
+  def verify(self) -> Dict[int, List[int]]:
+    """ Read back the mirrored registers of every preamp and repair any that drifted
+
+    A mismatch is only repaired if the same value is read back twice in a row, so volumes that are still
+    ramping in the firmware or writes racing the read-back aren't mistaken for drift.
+
+      Returns:
+        The registers that were rewritten, keyed by I2C address
+    """
+    repaired: Dict[int, List[int]] = {}
+    if self.bus is None:
+      return repaired
+    for preamp_addr in list(self.preamps):
+      num_regs = len(self.preamps[preamp_addr])
+      values = self._read_regs(preamp_addr, num_regs)
+      with self._lock:
+        mirror = self.preamps[preamp_addr]
+        synced = self.synced[preamp_addr]
+        suspects = self._suspects[preamp_addr]
+        self.bus_stats[preamp_addr].verifications += 1
+        drifted = []
+        for reg, actual in enumerate(values):
+          expected = mirror[reg]
+          queued = self._executor is not None and self._executor.has_pending(preamp_addr, reg)
+          if reg not in synced or queued or actual == expected:
+            suspects.pop(reg, None)
+          elif suspects.get(reg) == (expected, actual):
+            logger.warning(f'Preamp 0x{preamp_addr:02x} register 0x{reg:02x} is 0x{actual:02x}, expected 0x{expected:02x}')
+            suspects.pop(reg)
+            drifted.append(reg)
+          else:
+            suspects[reg] = (expected, actual)
+        if drifted:
+          self.bus_stats[preamp_addr].drift += len(drifted)
+          synced.difference_update(drifted)
+          self._write_regs(preamp_addr, [(reg, mirror[reg]) for reg in drifted])
+          repaired[preamp_addr] = drifted
+    return repaired
+
   def write_byte_data(self, preamp_addr, reg, data):
+    """ Write a register on a preamp, skipping the write if the preamp already has @data """
+    self.write_regs(preamp_addr, [(reg, data)])
+
+  def begin_batch(self):
+    """ Start staging register writes instead of sending them, batches can be nested """
+    with self._lock:
+      self._batch_depth += 1
+
+  def end_batch(self):
+    """ End a batch, committing the staged writes once the outermost batch is done """
+    with self._lock:
+      assert self._batch_depth > 0
+      self._batch_depth -= 1
+      if self._batch_depth == 0:
+        staged = self._staged
+        self._staged = {}
+        for preamp_addr, regs in staged.items():
+          self.write_regs(preamp_addr, self._commit_order(preamp_addr, regs))
+
+  def _commit_order(self, preamp_addr: int, regs: Dict[int, int]) -> List[Tuple[int, int]]:
+    """ Order a preamp's staged register writes so a batch never causes unwanted output
+
+    Any newly muted zones are muted first, then sources and volumes are changed,
+    and finally any zones that need to be unmuted are unmuted.
+    """
+    ordered = []
+    mute_reg = _REG_ADDRS['MUTE']
+    mute = regs.pop(mute_reg, None)
+    if mute is not None and preamp_addr in self.preamps:
+      ordered.append((mute_reg, mute | self.preamps[preamp_addr][mute_reg]))
+    ordered += sorted(regs.items())
+    if mute is not None:
+      ordered.append((mute_reg, mute))
+    return ordered
+
+  def write_regs(self, preamp_addr: int, regs: List[Tuple[int, int]]):
+    """ Write a burst of (register, value) pairs to a single preamp, in order
+
+    Registers whose mirrored value already matches are skipped, the rest are sent back-to-back.
+    Once the executor owns the bus the writes are queued by priority instead, see _BusExecutor.
+    While batching the writes are only staged, only the latest value of each register is kept.
+    """
+    with self._lock:
+      self._write_regs(preamp_addr, regs)
+
+  def _write_regs(self, preamp_addr: int, regs: List[Tuple[int, int]]):
     assert preamp_addr in _DEV_ADDRS
-    assert type(preamp_addr) == int
-    assert type(reg) == int
-    assert type(data) == int
+    assert isinstance(preamp_addr, int)
+    if self._batch_depth > 0:
+      self._staged.setdefault(preamp_addr, {}).update(regs)
+      return None
     # dynamically update preamps (to support mock)
     if preamp_addr not in self.preamps:
       if self.bus is None:
@@ -254,18 +681,45 @@ class _Preamps:
       else:
         return None  # Preamp is not connected, do nothing
 
-    if DEBUG_PREAMPS:
-      logger.info("writing to 0x{:02x} @ 0x{:02x} with 0x{:02x}".format(preamp_addr, reg, data))
-    self.preamps[preamp_addr][reg] = data
-    # TODO: need to handle volume modifying mute state in mock
-    if self.bus is not None:
-      try:
-        time.sleep(0.001)  # space out sequential calls to avoid bus errors
-        self.bus.write_byte_data(preamp_addr, reg, data)
-      except Exception:
-        time.sleep(0.001)
-        self.bus = SMBus(1)
-        self.bus.write_byte_data(preamp_addr, reg, data)
+    mirror = self.preamps[preamp_addr]
+    synced = self.synced[preamp_addr]
+    stats = self.stats[preamp_addr]
+
+    if self._executor is not None:
+      for reg, data in regs:
+        assert isinstance(reg, int)
+        assert isinstance(data, int)
+        if reg in synced and mirror[reg] == data:
+          stats.skipped += 1
+          continue
+        if DEBUG_PREAMPS:
+          logger.info("queueing 0x{:02x} @ 0x{:02x} with 0x{:02x}".format(preamp_addr, reg, data))
+        if reg == _REG_ADDRS['MUTE']:
+          self._queue_mute(preamp_addr, data)
+        else:
+          prio = _PRIO_VOL if _REG_ADDRS['VOL_ZONE1'] <= reg <= _REG_ADDRS['VOL_ZONE6'] else _PRIO_SRC
+          stats.collapsed += self._executor.queue_write(preamp_addr, reg, data, prio)
+        # queued writes are considered synced, the executor unsyncs them if they fail
+        mirror[reg] = data
+        synced.add(reg)
+      return None
+
+    for reg, data in regs:
+      assert isinstance(reg, int)
+      assert isinstance(data, int)
+      if reg in synced and mirror[reg] == data:
+        stats.skipped += 1
+        continue
+      if DEBUG_PREAMPS:
+        logger.info("writing to 0x{:02x} @ 0x{:02x} with 0x{:02x}".format(preamp_addr, reg, data))
+      # TODO: need to handle volume modifying mute state in mock
+      if self.bus is not None:
+        synced.discard(reg)  # in case the write fails
+        self._bus_write(preamp_addr, reg, data)
+      mirror[reg] = data
+      synced.add(reg)
+      stats.issued += 1
+    return None
 
   def probe_preamp(self, addr: int):
     # Scan for preamps, and set source registers to be completely digital
@@ -285,7 +739,7 @@ class _Preamps:
       for preamp in self.preamps:
         logger.info(f'Preamp {preamp // 8}:')
         for reg, addr in _REG_ADDRS.items():
-          val = self.bus.read_byte_data(preamp, addr)
+          val = self._read(preamp, addr)
           logger.info(f'  0x{addr:02X}:{reg:<15} = 0x{val:02X}')
 
   def read_version(self, preamp: int = 1):
@@ -299,12 +753,12 @@ class _Preamps:
     """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      major = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['VERSION_MAJOR'])
-      minor = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['VERSION_MINOR'])
-      git_hash = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['GIT_HASH_27_20']) << 20
-      git_hash |= (self.bus.read_byte_data(preamp * 8, _REG_ADDRS['GIT_HASH_19_12']) << 12)
-      git_hash |= (self.bus.read_byte_data(preamp * 8, _REG_ADDRS['GIT_HASH_11_04']) << 4)
-      git_hash4_stat = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['GIT_HASH_STATUS'])
+      major = self._read(preamp * 8, _REG_ADDRS['VERSION_MAJOR'])
+      minor = self._read(preamp * 8, _REG_ADDRS['VERSION_MINOR'])
+      git_hash = self._read(preamp * 8, _REG_ADDRS['GIT_HASH_27_20']) << 20
+      git_hash |= (self._read(preamp * 8, _REG_ADDRS['GIT_HASH_19_12']) << 12)
+      git_hash |= (self._read(preamp * 8, _REG_ADDRS['GIT_HASH_11_04']) << 4)
+      git_hash4_stat = self._read(preamp * 8, _REG_ADDRS['GIT_HASH_STATUS'])
       git_hash |= (git_hash4_stat >> 4)
       dirty = (git_hash4_stat & 0x01) != 0
       return major, minor, git_hash, dirty
@@ -317,14 +771,14 @@ class _Preamps:
     """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      pstat = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['POWER'])
+      pstat = self._read(preamp * 8, _REG_ADDRS['POWER'])
       pg_5va = (pstat & 0x20) != 0
       pg_5vd = (pstat & 0x10) != 0
       en_12v = (pstat & 0x08) != 0
       pg_12v = (pstat & 0x04) != 0
       en_9v = (pstat & 0x02) != 0
       pg_9v = (pstat & 0x01) != 0
-      fvstat = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['FAN_VOLTS'])
+      fvstat = self._read(preamp * 8, _REG_ADDRS['FAN_VOLTS'])
       v12 = fvstat / 2**4
       return PowerStatus(pg_5vd, pg_5va, pg_9v, en_9v, pg_12v, en_12v, v12)
     return None
@@ -343,7 +797,7 @@ class _Preamps:
     """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      fstat = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['FANS'])
+      fstat = self._read(preamp * 8, _REG_ADDRS['FANS'])
       ctrl = FanCtrl(fstat & 0x03)
       fans_on = (fstat & 0x04) != 0
       ovr_tmp = (fstat & 0x08) != 0
@@ -360,7 +814,7 @@ class _Preamps:
     """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      duty = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['FAN_DUTY'])
+      duty = self._read(preamp * 8, _REG_ADDRS['FAN_DUTY'])
       return duty / (1 << 7)
     return None
 
@@ -379,7 +833,7 @@ class _Preamps:
     """ Check if a second high voltage power supply is present """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      pstat = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['POWER'])
+      pstat = self._read(preamp * 8, _REG_ADDRS['POWER'])
       hv2_present = (pstat & 0x80) != 0
       return hv2_present
     return None
@@ -399,14 +853,14 @@ class _Preamps:
         amp2: Temperature of the heatsink over zones 4-6 in degrees C
     """
     if self.bus is not None:
-      temp_hv1_f = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['HV1_TEMP'])
-      temp_amp1_f = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['AMP_TEMP1'])
-      temp_amp2_f = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['AMP_TEMP2'])
+      temp_hv1_f = self._read(preamp * 8, _REG_ADDRS['HV1_TEMP'])
+      temp_amp1_f = self._read(preamp * 8, _REG_ADDRS['AMP_TEMP1'])
+      temp_amp2_f = self._read(preamp * 8, _REG_ADDRS['AMP_TEMP2'])
       temp_hv1 = self._fix2temp(temp_hv1_f)
       temp_amp1 = self._fix2temp(temp_amp1_f)
       temp_amp2 = self._fix2temp(temp_amp2_f)
       if self.hv2_present(preamp):
-        temp_hv2_f = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['HV2_TEMP'])
+        temp_hv2_f = self._read(preamp * 8, _REG_ADDRS['HV2_TEMP'])
         temp_hv2 = self._fix2temp(temp_hv2_f)
         return temp_hv1, temp_hv2, temp_amp1, temp_amp2
       else:
@@ -425,10 +879,10 @@ class _Preamps:
     """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      hv1_f = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['HV1_VOLTAGE'])
+      hv1_f = self._read(preamp * 8, _REG_ADDRS['HV1_VOLTAGE'])
       hv1 = hv1_f / 4  # Convert from UQ6.2 format
       if self.hv2_present(preamp):
-        hv2_f = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['HV2_VOLTAGE'])
+        hv2_f = self._read(preamp * 8, _REG_ADDRS['HV2_VOLTAGE'])
         hv2 = hv2_f / 4  # Convert from UQ6.2 format
         return hv1, hv2
       else:
@@ -438,8 +892,7 @@ class _Preamps:
   def force_fans(self, preamp: int = 1, force: bool = True):
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      self.bus.write_byte_data(preamp * 8, _REG_ADDRS['FANS'],
-                               3 if force is True else 0)
+      self._write_unmirrored(preamp * 8, _REG_ADDRS['FANS'], 3 if force is True else 0)
 
   def read_leds(self, preamp: int = 1):
     """ Read the state of the front-panel LEDs
@@ -455,7 +908,7 @@ class _Preamps:
     """
     assert 1 <= preamp <= 6
     if self.bus is not None:
-      leds = self.bus.read_byte_data(preamp * 8, _REG_ADDRS['LED_VAL'])
+      leds = self._read(preamp * 8, _REG_ADDRS['LED_VAL'])
       return leds
     return None
 
@@ -474,10 +927,10 @@ class _Preamps:
     assert leds is None or 0 <= leds <= 255
     if self.bus is not None:
       if leds is None:
-        self.bus.write_byte_data(preamp * 8, _REG_ADDRS['LED_CTRL'], 0)
+        self._write_unmirrored(preamp * 8, _REG_ADDRS['LED_CTRL'], 0)
       else:
-        self.bus.write_byte_data(preamp * 8, _REG_ADDRS['LED_CTRL'], 1)
-        self.bus.write_byte_data(preamp * 8, _REG_ADDRS['LED_VAL'], leds)
+        self._write_unmirrored(preamp * 8, _REG_ADDRS['LED_CTRL'], 1)
+        self._write_unmirrored(preamp * 8, _REG_ADDRS['LED_VAL'], leds)
 
   def __str__(self):
     preamp_str = ''
@@ -591,6 +1044,27 @@ class Mock:
   def exists(self, zone):
     return True
 
+  def write_stats(self) -> Dict[int, WriteStats]:
+    """ Get the register write counts for each preamp, keyed by I2C address """
+    return {}
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    """ Wait for the queued register writes to be sent """
+    return True
+
+  def bus_stats(self) -> Dict[int, BusStats]:
+    """ Get the bus health counters for each preamp, keyed by I2C address """
+    return {}
+
+  def verify(self) -> Dict[int, List[int]]:
+    """ Read back the preamps' registers and repair any drift """
+    return {}
+
+  @contextmanager
+  def batch(self):
+    """ Group several zone updates into a single hardware commit """
+    yield
+
 
 class Rpi:
   """ Actual Amplipi Runtime
@@ -602,6 +1076,8 @@ class Rpi:
     self._bus = _Preamps()
 
   def __del__(self):
+    # the bus executor's thread keeps the preamps alive, so they need to be closed explicitly
+    self._bus.close()
     del self._bus
 
   def reset(self):
@@ -667,8 +1143,10 @@ class Rpi:
         source_cfg123 = source_cfg123 | (src << (z * 2))
       else:
         source_cfg456 = source_cfg456 | (src << ((z - 3) * 2))
-    self._bus.write_byte_data(_DEV_ADDRS[preamp], _REG_ADDRS['ZONE123_SRC'], source_cfg123)
-    self._bus.write_byte_data(_DEV_ADDRS[preamp], _REG_ADDRS['ZONE456_SRC'], source_cfg456)
+    self._bus.write_regs(_DEV_ADDRS[preamp], [
+      (_REG_ADDRS['ZONE123_SRC'], source_cfg123),
+      (_REG_ADDRS['ZONE456_SRC'], source_cfg456),
+    ])
 
     # TODO: Add error checking on successful write
     return True
@@ -734,6 +1212,38 @@ class Rpi:
     else:
       return True
 
+  def write_stats(self) -> Dict[int, WriteStats]:
+    """ Get the register write counts for each preamp, keyed by I2C address """
+    with self._bus._lock:
+      return {addr: replace(stats) for addr, stats in self._bus.stats.items()}
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    """ Wait for the queued register writes to be sent, returns False on timeout """
+    return self._bus.flush(timeout)
+
+  def bus_stats(self) -> Dict[int, BusStats]:
+    """ Get the bus health counters for each preamp, keyed by I2C address """
+    with self._bus._lock:
+      return {addr: replace(stats, latency=list(stats.latency)) for addr, stats in self._bus.bus_stats.items()}
+
+  def verify(self) -> Dict[int, List[int]]:
+    """ Read back the preamps' registers and repair any drift, returns the repaired registers by I2C address """
+    return self._bus.verify()
+
+  @contextmanager
+  def batch(self):
+    """ Group several zone updates into a single hardware commit
+
+    The update_* calls made inside the batch are staged and, when the outermost batch exits,
+    committed once per affected preamp with at most one write per register
+    (the mute register may take two writes to keep audio from playing early).
+    """
+    self._bus.begin_batch()
+    try:
+      yield
+    finally:
+      self._bus.end_batch()
+
 
 def get_dev_addrs() -> List[int]:
   return _DEV_ADDRS
@@ -0,0 +1,358 @@
+# AmpliPi Home Audio
+# Copyright (C) 2022 MicroNova LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Shared memory status segment
+
+The controller publishes a compact binary copy of its zones, sources and system info to a memory mapped file
+whenever its state changes, so local services like the front panel displays can follow the state without going
+through the web server, JSON and pydantic.
+
+The segment is a fixed size file (on /dev/shm when available) with a header followed by the encoded status:
+  magic (4s), layout (H), reserved (H), sequence (Q), version (Q), heartbeat (d), length (I), crc32 (I)
+The sequence works as a seqlock: it is odd while the writer is changing the status, readers retry until they
+get the same even sequence before and after copying the status. The status' crc32 also protects readers from
+seeing a partial write on CPUs that reorder the writer's stores. The heartbeat (time.monotonic() of the writer)
+is updated every few seconds, readers ignore a segment whose writer stopped updating it.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+from amplipi import models
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+SEGMENT_PATH = os.environ.get('AMPLIPI_STATUS_SHM', os.path.join(_SHM_DIR, 'amplipi-status'))
+SEGMENT_SIZE = 64 * 1024
+MAGIC = b'APST'
+LAYOUT = 1  # bumped whenever the encoding changes
+STALE_AFTER = 10.0  # seconds without a heartbeat before a segment is ignored
+HEARTBEAT_INTERVAL = 2.0
+
+_HEADER = struct.Struct('<4sHHQQdII')
+_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = 8
+_HEARTBEAT = struct.Struct('<d')
+_HEARTBEAT_OFFSET = 24
+_NO_STR = 0xFFFF
+
+_COUNT = struct.Struct('<B')
+_STR_LEN = struct.Struct('<H')
+_INFO = struct.Struct('<?B')  # is_streamer, number of expanders
+_SOURCE = struct.Struct('<b?')  # id, has info
+_ZONE = struct.Struct('<Bb??f')  # id, source_id, mute, disabled, vol_f
+
+
+class SharedInfo(NamedTuple):
+  """ The system info, as published in the status segment """
+  version: str
+  serial: str
+  is_streamer: bool
+  expanders: List[str]
+
+
+class SharedSourceInfo(NamedTuple):
+  """ What a source is playing, as published in the status segment """
+  name: str
+  state: str
+  artist: Optional[str]
+  track: Optional[str]
+  album: Optional[str]
+  station: Optional[str]
+
+
+class SharedSource(NamedTuple):
+  """ A source, as published in the status segment """
+  id: int
+  name: str
+  input: str
+  info: Optional[SharedSourceInfo]
+
+
+class SharedZone(NamedTuple):
+  """ A zone, as published in the status segment """
+  id: int
+  name: str
+  source_id: int
+  mute: bool
+  disabled: bool
+  vol_f: float
+
+
+class SharedStatus(NamedTuple):
+  """ The subset of the system status published in the status segment """
+  version: int  # the controller's change version
+  info: Optional[SharedInfo]
+  sources: List[SharedSource]
+  zones: List[SharedZone]
+
+
+AnySource = Union[models.Source, SharedSource]
+AnyZone = Union[models.Zone, SharedZone]
+
+
+def _pack_str(out: List[bytes], value: Optional[str]):
+  if value is None:
+    out.append(_STR_LEN.pack(_NO_STR))
+    return
+  data = str(value).encode('utf-8')[:_NO_STR - 1]
+  out.append(_STR_LEN.pack(len(data)))
+  out.append(data)
+
+
+def _unpack_str(data: bytes, offset: int) -> Tuple[Optional[str], int]:
+  length, = _STR_LEN.unpack_from(data, offset)
+  offset += _STR_LEN.size
+  if length == _NO_STR:
+    return None, offset
+  return data[offset:offset + length].decode('utf-8', errors='replace'), offset + length
+
+
+def encode_status(status: models.Status) -> bytes:
+  """ Encode the parts of @status that are published in the status segment """
+  out: List[bytes] = []
+  info = status.info
+  out.append(_COUNT.pack(info is not None))
+  if info is not None:
+    out.append(_INFO.pack(info.is_streamer, len(info.expanders)))
+    _pack_str(out, info.version)
+    _pack_str(out, str(info.serial))
+    for expander in info.expanders:
+      _pack_str(out, expander)
+  out.append(_COUNT.pack(len(status.sources)))
+  for src in status.sources:
+    out.append(_SOURCE.pack(src.id if src.id is not None else -1, src.info is not None))
+    _pack_str(out, src.name)
+    _pack_str(out, src.input)
+    if src.info is not None:
+      for value in (src.info.name, src.info.state, src.info.artist, src.info.track, src.info.album, src.info.station):
+        _pack_str(out, value)
+  out.append(_COUNT.pack(len(status.zones)))
+  for zone in status.zones:
+    out.append(_ZONE.pack(zone.id or 0, zone.source_id, zone.mute, zone.disabled, zone.vol_f))
+    _pack_str(out, zone.name)
+  return b''.join(out)
+
+
+def decode_status(version: int, data: bytes) -> SharedStatus:
+  """ Decode a status encoded by encode_status """
+  offset = 0
+  info: Optional[SharedInfo] = None
+  has_info, = _COUNT.unpack_from(data, offset)
+  offset += _COUNT.size
+  if has_info:
+    is_streamer, num_expanders = _INFO.unpack_from(data, offset)
+    offset += _INFO.size
+    sw_version, offset = _unpack_str(data, offset)
+    serial, offset = _unpack_str(data, offset)
+    expanders = []
+    for _ in range(num_expanders):
+      expander, offset = _unpack_str(data, offset)
+      expanders.append(expander or '')
+    info = SharedInfo(sw_version or '', serial or '', is_streamer, expanders)
+  sources = []
+  num_sources, = _COUNT.unpack_from(data, offset)
+  offset += _COUNT.size
+  for _ in range(num_sources):
+    sid, has_src_info = _SOURCE.unpack_from(data, offset)
+    offset += _SOURCE.size
+    name, offset = _unpack_str(data, offset)
+    sinput, offset = _unpack_str(data, offset)
+    src_info = None
+    if has_src_info:
+      values = []
+      for _ in range(6):
+        value, offset = _unpack_str(data, offset)
+        values.append(value)
+      src_info = SharedSourceInfo(values[0] or '', values[1] or '', values[2], values[3], values[4], values[5])
+    sources.append(SharedSource(sid, name or '', sinput or '', src_info))
+  zones = []
+  num_zones, = _COUNT.unpack_from(data, offset)
+  offset += _COUNT.size
+  for _ in range(num_zones):
+    zid, source_id, mute, disabled, vol_f = _ZONE.unpack_from(data, offset)
+    offset += _ZONE.size
+    name, offset = _unpack_str(data, offset)
+    zones.append(SharedZone(zid, name or '', source_id, mute, disabled, vol_f))
+  return SharedStatus(version, info, sources, zones)
+
+
+class StatusSegment:
+  """ Writer side of the status segment at @path """
+
+  def __init__(self, path: str = SEGMENT_PATH, size: int = SEGMENT_SIZE):
+    self.path = path
+    self.size = size
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      os.ftruncate(fd, size)
+      self._mm = mmap.mmap(fd, size)
+    finally:
+      os.close(fd)
+    # continue the sequence of a previous writer, a reader may be waiting on it
+    seq, = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)
+    self._seq = seq + (seq & 1)
+    self._written: Optional[Tuple[int, bytes]] = None
+    self._lock = threading.Lock()
+
+  def write(self, version: int, status: models.Status) -> bool:
+    """ Publish @status at @version, returns False if it doesn't fit in the segment """
+    data = encode_status(status)
+    if _HEADER.size + len(data) > self.size:
+      logger.warning(f'status ({len(data)} bytes) does not fit in the status segment')
+      return False
+    with self._lock:
+      if self._written == (version, data):
+        self.heartbeat()  # readers keep their decoded copy
+        return True
+      self._written = (version, data)
+      self._seq += 1
+      _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+      self._mm[_HEADER.size:_HEADER.size + len(data)] = data
+      _HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT, 0, self._seq, version, time.monotonic(), len(data), zlib.crc32(data))
+      self._seq += 1
+      _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+    return True
+
+  def heartbeat(self):
+    """ Let the readers know the status is still current """
+    _HEARTBEAT.pack_into(self._mm, _HEARTBEAT_OFFSET, time.monotonic())
+
+  def close(self):
+    """ Stop writing, the segment is left for readers to notice the missing heartbeat """
+    self._mm.close()
+
+
+class StatusReader:
+  """ Reader side of the status segment at @path
+
+  Decoded statuses are reused until the controller's version changes.
+  """
+
+  def __init__(self, path: str = SEGMENT_PATH, stale_after: float = STALE_AFTER, retries: int = 100):
+    self.path = path
+    self.stale_after = stale_after
+    self.retries = retries
+    self._mm: Optional[mmap.mmap] = None
+    self._ino: Optional[int] = None
+    self._last: Optional[Tuple[int, int, SharedStatus]] = None  # (sequence, crc32, status)
+
+  def _map(self) -> Optional[mmap.mmap]:
+    try:
+      stat = os.stat(self.path)
+    except OSError:
+      self.close()
+      return None
+    if self._mm is None or stat.st_ino != self._ino:
+      self.close()
+      if stat.st_size < _HEADER.size:
+        return None
+      with open(self.path, 'rb') as seg:
+        self._mm = mmap.mmap(seg.fileno(), stat.st_size, access=mmap.ACCESS_READ)
+      self._ino = stat.st_ino
+    return self._mm
+
+  def read(self) -> Optional[SharedStatus]:
+    """ Get the published status, None if it isn't available or its writer stopped """
+    try:
+      mm = self._map()
+    except (OSError, ValueError) as exc:
+      logger.debug(f'unable to map the status segment: {exc}')
+      return None
+    if mm is None:
+      return None
+    for _ in range(self.retries):
+      seq, = _SEQ.unpack_from(mm, _SEQ_OFFSET)
+      if seq & 1:
+        time.sleep(0)  # let the writer finish
+        continue
+      magic, layout, _, _, version, heartbeat, length, crc = _HEADER.unpack_from(mm, 0)
+      if magic != MAGIC or layout != LAYOUT or _HEADER.size + length > len(mm):
+        return None
+      if time.monotonic() - heartbeat > self.stale_after:
+        return None
+      if self._last is not None and self._last[0] == seq and self._last[1] == crc:
+        return self._last[2]  # unchanged since the last read
+      data = mm[_HEADER.size:_HEADER.size + length]
+      if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] != seq or zlib.crc32(data) != crc:
+        continue
+      status = decode_status(version, data)
+      self._last = (seq, crc, status)
+      return status
+    return None
+
+  def close(self):
+    if self._mm is not None:
+      self._mm.close()
+    self._mm = None
+    self._ino = None
+    self._last = None
+
+
+class StatusPublisher:
+  """ Calls @publish from a background thread whenever @version changes
+
+  @publish is also called every @refresh seconds to pick up changes that don't change the version,
+  and the segment's heartbeat is kept up while the publisher runs.
+  """
+
+  def __init__(self, segment: StatusSegment, version: Callable[[], int], publish: Callable[[StatusSegment], None],
+               interval: float = 0.05, refresh: float = 1.0):
+    self.segment = segment
+    self._version = version
+    self._publish = publish
+    self._interval = interval
+    self._refresh = refresh
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='status-publisher', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    """ Stop publishing, waits for any publish in progress """
+    self._stop.set()
+    if threading.current_thread() is not self._thread:
+      self._thread.join()
+    self.segment.close()
+
+  def _run(self):
+    published: Optional[int] = None
+    next_refresh = 0.0
+    next_heartbeat = 0.0
+    while not self._stop.is_set():
+      now = time.monotonic()
+      if self._version() != published or now >= next_refresh:
+        published = self._version()
+        try:
+          self._publish(self.segment)
+        except Exception as exc:
+          logger.exception(f'Error publishing the status: {exc}')
+        next_refresh = now + self._refresh
+        next_heartbeat = now + HEARTBEAT_INTERVAL
+      elif now >= next_heartbeat:
+        self.segment.heartbeat()
+        next_heartbeat = now + HEARTBEAT_INTERVAL
+      self._stop.wait(self._interval)
@@ -5,6 +5,7 @@ from typing import Optional, List
 import logging
 from amplipi import models
 from amplipi import utils
+from .player_service import Process
 
 logger = logging.getLogger(__name__)
 logger.level = logging.DEBUG
@@ -52,7 +53,7 @@ class BaseStream:
   def __init__(self, stype: str, name: str, only_src=None, disabled: bool = False, mock: bool = False, validate: bool = True, **kwargs):
     self.name = name
     self.disabled = disabled
-    self.proc: Optional[subprocess.Popen] = None
+    self.proc: Optional[Process] = None
     self.mock = mock
     self.src: Optional[int] = None
     self.only_src: Optional[int] = only_src
@@ -118,6 +119,9 @@ class BaseStream:
   def reconfig(self, **kwargs):
     """ Reconfigure a potentially running stream """
 
+  def prefetch(self):
+    """ Prepare the stream to be connected quickly, it is likely to be played soon """
+
   def is_activated(self):
     """ Check if this stream has been activated """
     # activate/deactivate is not supported by the base stream type
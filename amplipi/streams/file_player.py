@@ -1,7 +1,8 @@
 from typing import ClassVar, Optional
 from amplipi import models, utils
+from amplipi.chimes import get_cache
 from .base_streams import BaseStream, logger
-import subprocess
+from . import player_service
 import os
 import time
 import threading
@@ -62,12 +63,20 @@ class FilePlayer(BaseStream):
       song_info_path = f'{src_config_folder}/currentSong'
       log_file_path = f'{src_config_folder}/log'
       self.command_file_path = f'{src_config_folder}/cmd'
-      self.vlc_args = [
-        sys.executable, f"{utils.get_folder('streams')}/fileplayer.py", self.url, utils.real_output_device(src),
-        '--song-info', song_info_path, '--log', log_file_path, '--cmd', self.command_file_path
-      ]
-      logger.info(f'running: {self.vlc_args}')
-      self.proc = subprocess.Popen(args=self.vlc_args, preexec_fn=os.setpgrp)
+      output = utils.real_output_device(src)
+      # announcements can't be paused, so frequently played chimes can skip VLC and play the pre-decoded audio directly
+      is_announcement = 'pause' not in self.supported_cmds
+      cached_args = get_cache().play_args(self.url, output) if is_announcement else None
+      if cached_args:
+        self.vlc_args = cached_args
+      else:
+        self.vlc_args = [
+          sys.executable, f"{utils.get_folder('streams')}/fileplayer.py", self.url, output,
+          '--song-info', song_info_path, '--log', log_file_path, '--cmd', self.command_file_path
+        ]
+        if is_announcement:
+          get_cache().prefetch(self.url)
+      self.proc = player_service.launch(self.vlc_args)
 
     # make a thread that waits for the playback to be done and returns after info shows playback stopped
     # for the mock condition it just waits a couple seconds
@@ -85,6 +94,14 @@ class FilePlayer(BaseStream):
       time.sleep(0.3)  # handles mock case
     self.state = 'stopped'  # notify that the audio is done playing
 
+  def wait_done(self, timeout: Optional[float] = None) -> bool:
+    """ Wait for the playback to finish, returns False if it is still playing after @timeout seconds """
+    thread = self.bkg_thread
+    if thread is None:
+      return True
+    thread.join(timeout)
+    return not thread.is_alive()
+
   def send_cmd(self, cmd):
     if cmd in self.supported_cmds:
       if cmd == 'stop':
@@ -102,8 +119,7 @@ class FilePlayer(BaseStream):
 
         if cmd == 'play':
           if not self._is_running():
-            logger.info(f'running: {self.vlc_args}')
-            self.proc = subprocess.Popen(args=self.vlc_args, preexec_fn=os.setpgrp)
+            self.proc = player_service.launch(self.vlc_args)
           f = open(self.command_file_path, 'w')
           f.write('play')
           f.close()
@@ -1,13 +1,12 @@
 from .base_streams import BaseStream, InvalidStreamField, logger
+from . import player_service
+from .playlists import get_resolver, playlist_type
 from typing import ClassVar, Optional
 from urllib.parse import urlparse
-from amplipi import models, utils
-import subprocess
+from amplipi import metadata, models, utils
 import time
+import threading
 import os
-import re
-import requests
-import json
 import sys
 import validators
 
@@ -18,6 +17,10 @@ class InternetRadio(BaseStream):
   stream_type: ClassVar[str] = 'internetradio'
 
   def __init__(self, name: str, url: str, logo: Optional[str], disabled: bool = False, mock: bool = False, validate: bool = True):
+    self._proc_lock = threading.Lock()
+    self._connection = 0  # incremented by every connect/disconnect, so a stale playlist resolution doesn't start playback
+    self._resolving = False
+    self._picked: Optional[str] = None  # the stream url picked from the station's playlist
     super().__init__(self.stream_type, name, disabled=disabled, mock=mock, validate=validate, url=url, logo=logo)
     self.url = url
     self.logo = logo
@@ -33,7 +36,7 @@ class InternetRadio(BaseStream):
         self.__dict__[k] = v
         if k in ir_fields:
           reconnect_needed = True
-    if reconnect_needed and self._is_running():
+    if reconnect_needed and (self._is_running() or self._resolving):
       last_src = self.src
       self.disconnect()
       time.sleep(0.1)  # delay a bit, is this needed?
@@ -55,43 +58,62 @@ class InternetRadio(BaseStream):
     src_config_folder = f"{utils.get_folder('config')}/srcs/{src}"
     os.system(f'mkdir -p {src_config_folder}')
 
-    # HACK check if url is a playlist and if it is get the first url and play it
-    # this is the most general way to deal with playlists for this stream since the alternative is to actually
-    # parse each playlist type and get the urls from them
-    PLAYLIST_TYPES = ['pls', 'm3u', 'm3u8']
-    if self.url.split('.')[-1] in PLAYLIST_TYPES:
+    with self._proc_lock:
+      self._connection += 1
+      connection = self._connection
+    self.state = 'playing'
+    self.src = src
+
+    # a playlist is resolved in the background (usually already done by prefetch()),
+    # a slow station server shouldn't hold up the request that connected it
+    if playlist_type(self.url) is None:
+      self._launch(src, connection, self.url)
+    else:
       logger.info('Playlist detected, attempting to get playlist...')
-      try:
-        req = requests.get(self.url)
-        urls = re.compile(r'(http.*?)[\r\n]').findall(req.text)
-        if len(urls) > 0:
-          self.url = urls[0]
-          logger.info(f'using first url: {self.url}')
-        else:
-          raise Exception('No urls found in playlist')
-      except Exception as e:
-        logger.exception(f'Error getting playlist {e}')
-
-    # Start audio via runvlc.py
+      self._resolving = True
+      threading.Thread(target=self._resolve_and_launch, args=(src, connection, self.url),
+                       name='station-connect', daemon=True).start()
+
+  def _resolve_and_launch(self, src: int, connection: int, station_url: str):
+    try:
+      url = get_resolver().stream_url(station_url)
+      self._picked = url
+      logger.info(f'using playlist url: {url}')
+    except Exception as e:
+      logger.error(f'{e}, playing {self.name} from the playlist url')
+      url = station_url
+    finally:
+      self._resolving = False
+    self._launch(src, connection, url)
+
+  def _launch(self, src: int, connection: int, url: str):
+    """ Start audio via runvlc.py, unless the stream was disconnected or reconnected since @connection """
+    src_config_folder = f"{utils.get_folder('config')}/srcs/{src}"
     song_info_path = f'{src_config_folder}/currentSong'
     log_file_path = f'{src_config_folder}/log'
     inetradio_args = [
-      sys.executable, f"{utils.get_folder('streams')}/runvlc.py", self.url, utils.real_output_device(src),
+      sys.executable, f"{utils.get_folder('streams')}/runvlc.py", url, utils.real_output_device(src),
       '--song-info', song_info_path, '--log', log_file_path
     ]
-    logger.info(f'running: {inetradio_args}')
-    self.proc = subprocess.Popen(args=inetradio_args, preexec_fn=os.setpgrp)
+    with self._proc_lock:
+      if connection != self._connection:
+        return
+      self.proc = player_service.launch(inetradio_args)
+    logger.info(f'{self.name} (stream: {url}) connected to {src} via {utils.real_output_device(src)}')
 
-    logger.info(f'{self.name} (stream: {self.url}) connected to {src} via {utils.real_output_device(src)}')
-    self.state = 'playing'
-    self.src = src
+  def prefetch(self):
+    """ Resolve the station's playlist in the background so connecting to it doesn't have to """
+    if not self.mock and playlist_type(self.url) is not None:
+      get_resolver().prefetch(self.url)
 
   def disconnect(self):
+    with self._proc_lock:
+      self._connection += 1  # cancel any pending playlist resolution
+      proc, self.proc = self.proc, None
     # try to kill proc gracefully, then forcefully
-    if self.proc:
-      utils.careful_proc_shutdown(self.proc, "internet radio stream")
+    if proc:
+      utils.careful_proc_shutdown(proc, "internet radio stream")
     self._disconnect()
-    self.proc = None
 
   def info(self) -> models.SourceInfo:
     src_config_folder = f"{utils.get_folder('config')}/srcs/{self.src}"
@@ -104,13 +126,17 @@ class InternetRadio(BaseStream):
     if self.logo:
       source.img_url = self.logo
     try:
-      with open(loc, 'r', encoding='utf-8') as file:
-        data = json.loads(file.read())
-        source.artist = data['artist']
-        source.track = data['track']
-        source.station = data['station']
-        source.state = data['state']
-        return source
+      data = metadata.read_json(loc)
+      source.artist = data['artist']
+      source.track = data['track']
+      source.station = data['station']
+      source.state = data['state']
+      # VLC reports a stream it can't play as stopped with an error as the track
+      picked = self._picked
+      if picked and source.state == 'stopped' and source.track:
+        self._picked = None
+        get_resolver().stream_failed(self.url, picked)
+      return source
     except Exception:
       pass
     return source
@@ -122,13 +148,15 @@ class InternetRadio(BaseStream):
           if not self._is_running():
             self.connect(self.src)
         elif cmd == 'stop':
+          with self._proc_lock:
+            self._connection += 1  # cancel any pending playlist resolution
           if self._is_running():
             try:
               self.proc.kill()
               self.proc = None
               src_config_folder = f"{utils.get_folder('config')}/srcs/{self.src}"
               song_info_path = f'{src_config_folder}/currentSong'
-              os.system(f'rm {song_info_path}')
+              metadata.discard(song_info_path)
             except Exception:
               pass
           self.state = 'stopped'
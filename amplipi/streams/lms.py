@@ -1,9 +1,8 @@
 from .base_streams import PersistentStream, logger
 from typing import ClassVar, Optional
-from amplipi import models, utils
+from amplipi import metadata, models, utils
 import subprocess
 import os
-import json
 import hashlib
 import sys
 import signal
@@ -56,8 +55,7 @@ class LMS(PersistentStream):
       self.vsrc = vsrc
       src_config_folder = f'{utils.get_folder("config")}/srcs/v{vsrc}'
       os.system(f'mkdir -p {src_config_folder}')
-      with open(f"{src_config_folder}/lms_metadata.json", "w", encoding="UTF-8") as f:
-        json.dump(self.meta, f, indent=2)
+      metadata.write_json(f"{src_config_folder}/lms_metadata.json", self.meta)
 
       # mac address, needs to be unique but not tied to actual NIC MAC hash the name with src id, to avoid aliases on move
       md5 = hashlib.md5()
@@ -123,11 +121,10 @@ class LMS(PersistentStream):
     self.meta_proc = None
 
   def info(self) -> models.SourceInfo:
-    # Opens and reads the metadata.json file every time the info def is called
+    # Reads the metadata published by lms_metadata.py every time the info def is called
     try:
       src_config_folder = f"{utils.get_folder('config')}/srcs/v{self.vsrc}"
-      with open(f"{src_config_folder}/lms_metadata.json", "r", encoding="utf-8") as meta_read:
-        self.meta = json.loads(meta_read.read())
+      self.meta = metadata.read_json(f"{src_config_folder}/lms_metadata.json")
     except:
       self.meta = {
         'track': 'Trying again shortly...',
@@ -1,13 +1,12 @@
 from .base_streams import PersistentStream, Browsable, logger
-from amplipi import models, utils
+from . import player_service
+from amplipi import metadata, models, utils
 from typing import ClassVar, List, Optional
-import subprocess
 import os
 import time
 import datetime
 import threading
 import sys
-import json
 import pathlib
 
 MUSIC_EXTENSIONS = ('.mp3', '.wav', '.aac', '.m4a', '.m4b', '.flac', '.aiff', '.mp4', '.avi', '.wmv', '.mov', '.mpg', '.mpeg', '.wma')
@@ -68,8 +67,7 @@ class MediaDevice(PersistentStream, Browsable):
           sys.executable, f"{utils.get_folder('streams')}/fileplayer.py", self.url, utils.virtual_output_device(vsrc),
           '--song-info', song_info_path, '--log', log_file_path, '--cmd', self.command_file_path
         ]
-        logger.info(f'running: {self.vlc_args}')
-        self.proc = subprocess.Popen(args=self.vlc_args, preexec_fn=os.setpgrp)
+        self.proc = player_service.launch(self.vlc_args)
 
     # make a thread that waits for the playback to be done and returns after info shows playback stopped
     # for the mock condition it just waits a couple seconds
@@ -110,9 +108,8 @@ class MediaDevice(PersistentStream, Browsable):
     src_config_folder = f"{utils.get_folder('config')}/srcs/v{self.src}"
     loc = f'{src_config_folder}/currentSong'
     try:
-      with open(loc, 'r', encoding='utf-8') as file:
-        data = json.loads(file.read())
-        self.ended = data['state'] == 'ENDED'
+      data = metadata.read_json(loc)
+      self.ended = data['state'] == 'ENDED'
     except Exception:
       pass
 
@@ -151,8 +148,7 @@ class MediaDevice(PersistentStream, Browsable):
 
         if cmd == 'play':
           if not self._is_running():
-            logger.info(f'running: {self.vlc_args}')
-            self.proc = subprocess.Popen(args=self.vlc_args, preexec_fn=os.setpgrp)
+            self.proc = player_service.launch(self.vlc_args)
           f = open(self.command_file_path, 'w')
           f.write('play')
           f.close()
@@ -186,8 +182,8 @@ class MediaDevice(PersistentStream, Browsable):
       src_config_folder = f"{utils.get_folder('config')}/srcs/v{self.src}"
       loc = f'{src_config_folder}/currentSong'
       try:
-        with open(loc, 'r', encoding='utf-8'):
-          source.track = self.playing.split('/')[-1]
+        metadata.read_json(loc)
+        source.track = self.playing.split('/')[-1]
       except Exception:
         pass
     return source
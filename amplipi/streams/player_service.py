@@ -0,0 +1,177 @@
+""" Client for the resident VLC player service (streams/vlc_service.py)
+
+runvlc.py and fileplayer.py invocations are handed to a single long lived service process that keeps libvlc warm,
+falling back to running the scripts directly when the service isn't available.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from amplipi import utils
+
+logger = logging.getLogger(__name__)
+logger.level = logging.DEBUG
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+START_TIMEOUT = 5.0  # seconds to wait for the service to come up
+RETRY_DELAY = 60.0  # seconds before trying to start a service that failed to start again
+REQUEST_TIMEOUT = 5.0
+
+# the scripts the service can stand in for
+SCRIPT_MODES = {'runvlc.py': 'radio', 'fileplayer.py': 'file'}
+
+
+class ServiceError(Exception):
+  """ The player service couldn't be reached or refused a request """
+
+
+def _script_parser() -> argparse.ArgumentParser:
+  """ Parser for the arguments shared by runvlc.py and fileplayer.py """
+  parser = argparse.ArgumentParser(add_help=False)
+  parser.add_argument('url')
+  parser.add_argument('output', nargs='?', default=None)
+  parser.add_argument('--song-info', default=None)
+  parser.add_argument('--log', default=None)
+  parser.add_argument('--cmd', default=None)
+  return parser
+
+
+class Playback:
+  """ A stream played by the player service, a stand-in for the script's subprocess.Popen """
+
+  def __init__(self, service: 'PlayerService', sid: int, args: List[str]):
+    self.service = service
+    self.id = sid
+    self.args = args
+    self.returncode: Optional[int] = None
+
+  def poll(self) -> Optional[int]:
+    if self.returncode is None:
+      try:
+        if not self.service.request({'cmd': 'status', 'id': self.id})['running']:
+          self.returncode = 0
+      except ServiceError:
+        self.returncode = 1
+    return self.returncode
+
+  def wait(self, timeout: Optional[float] = None) -> int:
+    end = None if timeout is None else time.monotonic() + timeout
+    while self.poll() is None:
+      if end is not None and time.monotonic() > end:
+        raise subprocess.TimeoutExpired(self.args, timeout or 0)
+      time.sleep(0.2)
+    return self.returncode or 0
+
+  def terminate(self):
+    if self.returncode is None:
+      try:
+        self.service.request({'cmd': 'stop', 'id': self.id})
+      except ServiceError:
+        pass
+      self.returncode = -15
+
+  def kill(self):
+    self.terminate()
+
+
+class PlayerService:
+  """ Starts and talks to the player service listening on @sock_path """
+
+  def __init__(self, sock_path: str, service_args: List[str]):
+    self.sock_path = sock_path
+    self.service_args = service_args
+    self._proc: Optional[subprocess.Popen] = None
+    self._lock = threading.Lock()
+    self._unavailable_until = 0.0
+
+  def request(self, req: Dict[str, Any], timeout: float = REQUEST_TIMEOUT) -> Dict[str, Any]:
+    """ Send a request to the service, raising a ServiceError if it fails """
+    try:
+      with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(self.sock_path)
+        with conn.makefile('rwb') as stream:
+          stream.write(json.dumps(req).encode() + b'\n')
+          stream.flush()
+          resp = json.loads(stream.readline())
+    except (OSError, ValueError) as exc:
+      raise ServiceError(f'player service unavailable: {exc}') from exc
+    if not resp.get('ok'):
+      raise ServiceError(resp.get('error', 'request failed'))
+    return resp
+
+  def _ensure_running(self) -> bool:
+    """ Make sure the service is up, starting it if needed """
+    with self._lock:
+      try:
+        self.request({'cmd': 'ping'})
+        return True
+      except ServiceError:
+        pass
+      if time.monotonic() < self._unavailable_until:
+        return False
+      if self._proc is None or self._proc.poll() is not None:
+        logger.info(f'starting player service: {self.service_args}')
+        try:
+          self._proc = subprocess.Popen(args=self.service_args, preexec_fn=os.setpgrp)
+        except OSError as exc:
+          logger.error(f'failed to start the player service: {exc}')
+          self._unavailable_until = time.monotonic() + RETRY_DELAY
+          return False
+      end = time.monotonic() + START_TIMEOUT
+      while time.monotonic() < end and self._proc.poll() is None:
+        try:
+          self.request({'cmd': 'ping'})
+          return True
+        except ServiceError:
+          time.sleep(0.05)
+      logger.error('player service failed to start, running players separately')
+      self._unavailable_until = time.monotonic() + RETRY_DELAY
+      return False
+
+  def launch(self, args: List[str]) -> 'Process':
+    """ Run the runvlc.py/fileplayer.py command line @args in the service
+
+    Any other command, or any command when the service is unavailable, is run as its own process.
+    """
+    script = os.path.basename(args[1]) if len(args) > 1 else ''
+    mode = SCRIPT_MODES.get(script)
+    if mode is not None and self._ensure_running():
+      opts = _script_parser().parse_known_args(args[2:])[0]
+      try:
+        resp = self.request({'cmd': 'play', 'mode': mode, 'url': opts.url, 'output': opts.output,
+                             'song_info': opts.song_info, 'log': opts.log, 'cmd_file': opts.cmd})
+        logger.info(f'playing {opts.url} on {opts.output} in the player service')
+        return Playback(self, resp['id'], args)
+      except ServiceError as exc:
+        logger.error(f'player service failed to play {opts.url}: {exc}')
+    logger.info(f'running: {args}')
+    return subprocess.Popen(args=args, preexec_fn=os.setpgrp)
+
+
+Process = Union[subprocess.Popen, Playback]
+
+_service: Optional[PlayerService] = None
+
+
+def get_service() -> PlayerService:
+  """ The shared player service client """
+  global _service
+  if _service is None:
+    sock_path = os.path.join(utils.get_folder('config'), 'vlc.sock')
+    _service = PlayerService(sock_path, [sys.executable, f"{utils.get_folder('streams')}/vlc_service.py", sock_path])
+  return _service
+
+
+def launch(args: List[str]) -> Process:
+  """ Play a runvlc.py/fileplayer.py command line, see PlayerService.launch """
+  return get_service().launch(args)
@@ -0,0 +1,221 @@
+""" Internet radio playlist resolution
+
+Stations are often given as a playlist (.pls, .m3u, .m3u8) that lists one or more stream urls.
+Resolving a playlist means fetching it from the station's server, which can be slow or down, so playlists are
+fetched in the background with timeouts, the results (including failures) are cached, and the entries that don't
+respond are skipped in favor of the next one in the playlist.
+"""
+
+import logging
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+logger.level = logging.DEBUG
+sh = logging.StreamHandler(sys.stdout)
+logger.addHandler(sh)
+
+PLAYLIST_TYPES = ['pls', 'm3u', 'm3u8']
+FETCH_TIMEOUT = 5.0  # seconds to wait on a station's server
+RESOLVED_TTL = 30 * 60.0  # seconds a resolved playlist is reused for
+FAILED_TTL = 60.0  # seconds a playlist that failed to resolve, or a dead stream url, is remembered for
+
+
+class PlaylistError(Exception):
+  """ A playlist couldn't be fetched or had no usable entries """
+
+
+def playlist_type(url: str) -> Optional[str]:
+  """ Get the playlist type of @url, None if it points to an audio stream """
+  ext = urlparse(url).path.split('.')[-1].lower()
+  return ext if ext in PLAYLIST_TYPES else None
+
+
+def parse_pls(text: str) -> List[str]:
+  """ Get the stream urls of a pls playlist, in the order of their entry numbers """
+  entries: List[Tuple[int, str]] = []
+  for line in text.splitlines():
+    match = re.match(r'\s*File(\d+)\s*=\s*(\S.*?)\s*$', line, re.IGNORECASE)
+    if match:
+      entries.append((int(match.group(1)), match.group(2)))
+  return [url for _, url in sorted(entries, key=lambda e: e[0])]
+
+
+def parse_m3u(text: str) -> List[str]:
+  """ Get the stream urls of an m3u playlist """
+  return [line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith('#')]
+
+
+def parse_playlist(url: str, text: str) -> List[str]:
+  """ Get the stream urls listed by the playlist @url, with contents @text """
+  if text.lstrip().lower().startswith('[playlist]') or playlist_type(url) == 'pls':
+    urls = parse_pls(text)
+  elif '#EXT-X-' in text:
+    # an HLS playlist lists the segments of a single stream that VLC plays directly
+    return [url]
+  else:
+    urls = parse_m3u(text)
+  # entries can be relative to the playlist, only stream urls VLC can fetch are useful
+  urls = [urljoin(url, u) for u in urls]
+  return [u for u in urls if urlparse(u).scheme in ['http', 'https']]
+
+
+def _fetch(url: str, timeout: float) -> List[str]:
+  resp = requests.get(url, timeout=timeout)
+  resp.raise_for_status()
+  urls = parse_playlist(url, resp.text)
+  if len(urls) == 0:
+    raise PlaylistError('No urls found in playlist')
+  return urls
+
+
+def _is_live(url: str, timeout: float) -> bool:
+  """ Check that the stream at @url responds, without downloading it """
+  try:
+    with requests.get(url, stream=True, timeout=timeout) as resp:
+      return resp.status_code < 400
+  except requests.RequestException:
+    return False
+
+
+class PlaylistResolver:
+  """ Resolves playlists to stream urls in the background, caching the results """
+
+  def __init__(self, fetch: Callable[[str, float], List[str]] = _fetch, is_live: Callable[[str, float], bool] = _is_live,
+               timeout: float = FETCH_TIMEOUT, ttl: float = RESOLVED_TTL, failed_ttl: float = FAILED_TTL):
+    self._fetch = fetch
+    self._is_live = is_live
+    self.timeout = timeout
+    self.ttl = ttl
+    self.failed_ttl = failed_ttl
+    self._lock = threading.Lock()
+    # Key: playlist url, Val: (expiration, urls, error, the stream url picked to play)
+    self._resolved: Dict[str, Tuple[float, List[str], Optional[str], Optional[str]]] = {}
+    self._dead: Dict[str, float] = {}  # Key: stream url, Val: time to try it again
+    self._pending: Dict[str, Future] = {}
+    self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='playlist-resolver')
+
+  def cached(self, url: str) -> Optional[List[str]]:
+    """ Get the unexpired stream urls resolved for the playlist @url, raising a PlaylistError if it recently failed """
+    with self._lock:
+      entry = self._resolved.get(url)
+      if entry is None or entry[0] < time.monotonic():
+        return None
+      if entry[2] is not None:
+        raise PlaylistError(entry[2])
+      return entry[1]
+
+  def _resolve(self, url: str) -> List[str]:
+    try:
+      urls = self._fetch(url, self.timeout)
+      with self._lock:
+        self._resolved[url] = (time.monotonic() + self.ttl, urls, None, None)
+      logger.info(f'resolved playlist {url}: {urls}')
+      return urls
+    except Exception as exc:
+      with self._lock:
+        self._resolved[url] = (time.monotonic() + self.failed_ttl, [], f'Error getting playlist {url}: {exc}', None)
+      raise PlaylistError(f'Error getting playlist {url}: {exc}') from exc
+    finally:
+      with self._lock:
+        self._pending.pop(url, None)
+
+  def resolve_async(self, url: str, refresh: bool = False) -> Future:
+    """ Resolve the playlist @url in the background, sharing any resolution already in progress
+
+    Unless @refresh is set, a cached result is used.
+    """
+    if not refresh:
+      try:
+        urls = self.cached(url)
+      except PlaylistError as exc:
+        failed: Future = Future()
+        failed.set_exception(exc)
+        return failed
+      if urls is not None:
+        done: Future = Future()
+        done.set_result(urls)
+        return done
+    with self._lock:
+      if url not in self._pending:
+        self._pending[url] = self._executor.submit(self._resolve, url)
+      return self._pending[url]
+
+  def prefetch(self, url: str):
+    """ Resolve the playlist @url in the background if it isn't cached, or its cached result is getting old """
+    with self._lock:
+      entry = self._resolved.get(url)
+      if entry is not None:
+        remaining = entry[0] - time.monotonic()
+        if entry[2] is not None and remaining > 0:
+          return  # recently failed
+        if entry[2] is None and remaining > self.ttl / 2:
+          return
+    self.resolve_async(url, refresh=True)
+
+  def resolve(self, url: str) -> List[str]:
+    """ Get the stream urls of the playlist @url, raising a PlaylistError on failure """
+    return self.resolve_async(url).result(timeout=self.timeout * 2)
+
+  def pick(self, urls: List[str]) -> str:
+    """ Get the first stream url of @urls that responds, failing over to the next entry when one is dead """
+    if len(urls) == 1:
+      return urls[0]  # nothing to fail over to
+    now = time.monotonic()
+    with self._lock:
+      candidates = [u for u in urls if self._dead.get(u, 0) < now]
+    for candidate in candidates:
+      if self._is_live(candidate, self.timeout):
+        return candidate
+      logger.info(f'stream {candidate} is not responding, trying the next entry')
+      with self._lock:
+        self._dead[candidate] = time.monotonic() + self.failed_ttl
+    if not urls:
+      raise PlaylistError('No urls to play')
+    # nothing responded, leave the retrying to VLC
+    return urls[0]
+
+  def stream_url(self, url: str) -> str:
+    """ Get the url to play for the station @url, resolving it if it is a playlist
+
+    The stream url picked is reused as long as the playlist's resolution, unless it is reported as failed.
+    """
+    if playlist_type(url) is None:
+      return url
+    urls = self.resolve(url)
+    with self._lock:
+      entry = self._resolved.get(url)
+      if entry is not None and entry[1] is urls and entry[3] is not None:
+        return entry[3]
+    picked = self.pick(urls)
+    with self._lock:
+      entry = self._resolved.get(url)
+      if entry is not None and entry[1] is urls:  # not resolved again in the meantime
+        self._resolved[url] = (entry[0], entry[1], entry[2], picked)
+    return picked
+
+  def stream_failed(self, url: str, stream: str):
+    """ Report that VLC failed to play @stream, picked for the station @url, so the next connection probes again """
+    with self._lock:
+      self._dead[stream] = time.monotonic() + self.failed_ttl
+      entry = self._resolved.get(url)
+      if entry is not None and entry[3] == stream:
+        self._resolved[url] = (entry[0], entry[1], entry[2], None)
+
+
+_resolver: Optional[PlaylistResolver] = None
+
+
+def get_resolver() -> PlaylistResolver:
+  """ The shared playlist resolver """
+  global _resolver
+  if _resolver is None:
+    _resolver = PlaylistResolver()
+  return _resolver
@@ -19,12 +19,14 @@
 This module contains helper functions are used across the amplipi python library.
 """
 
+import contextlib
 import functools
 import io
 import json
 import logging
 import sys
 import time
+import threading
 import os
 import re
 import subprocess
@@ -250,6 +252,85 @@ def enabled_zones(status: models.Status, zones: Set[int]) -> Set[int]:
   return zones.difference(z_disabled)
 
 
+def status_delta(old: Dict, new: Dict) -> Dict:
+  """ Get the per-entity changes between two status dictionaries (as generated by models.Status.dict())
+
+  Lists of entities (zones, sources, ...) are compared by id, each one maps to {'changed': [...], 'removed': [...]}
+  where changed holds the full entities that were added or modified, and removed holds the ids of deleted entities.
+  Any other field (ie. info) that changed is included as is, a field that was removed maps to None.
+  An empty dictionary means nothing changed.
+  """
+  delta: Dict = {key: None for key in old if key not in new}
+  for key, new_val in new.items():
+    old_val = old.get(key)
+    if new_val == old_val:
+      continue
+    if isinstance(new_val, list) and isinstance(old_val, list) and all('id' in e for e in new_val + old_val):
+      old_entities = {e['id']: e for e in old_val}
+      new_ids = {e['id'] for e in new_val}
+      changed = [e for e in new_val if old_entities.get(e['id']) != e]
+      removed = [eid for eid in old_entities if eid not in new_ids]
+      delta[key] = {'changed': changed, 'removed': removed}
+    else:
+      delta[key] = new_val
+  return delta
+
+
+def apply_status_delta(state: Dict, delta: Dict) -> Dict:
+  """ Apply a delta generated by status_delta() to a status dictionary, modifying it in place
+
+  Applying the same delta more than once has no further effect.
+  """
+  for key, val in delta.items():
+    if val is None:
+      state.pop(key, None)
+      continue
+    old_val = state.get(key) or []
+    if isinstance(val, dict) and set(val) == {'changed', 'removed'} and isinstance(old_val, list):
+      removed = set(val['removed'])
+      entities = [e for e in old_val if e['id'] not in removed]
+      index = {e['id']: i for i, e in enumerate(entities)}
+      for entity in val['changed']:
+        if entity['id'] in index:
+          entities[index[entity['id']]] = entity
+        else:
+          index[entity['id']] = len(entities)
+          entities.append(entity)
+      state[key] = entities
+    else:
+      state[key] = val
+  return state
+
+
+def merge_status_deltas(deltas: List[Dict]) -> Dict:
+  """ Combine consecutive deltas generated by status_delta() into a single delta, oldest first
+
+  The latest version of each changed entity is kept, an entity removed by a later delta is only listed as removed.
+  """
+  merged: Dict = {}
+  entity_changes: Dict[str, Tuple[Dict, Set]] = {}  # Key: list name, Val: (changed entities by id, removed ids)
+  for delta in deltas:
+    for key, val in delta.items():
+      if isinstance(val, dict) and set(val) == {'changed', 'removed'}:
+        if key in merged:  # the whole list was replaced by an earlier delta, apply the changes to it
+          merged[key] = apply_status_delta({key: merged[key]}, {key: val})[key]
+          continue
+        changed, removed = entity_changes.setdefault(key, ({}, set()))
+        for eid in val['removed']:
+          changed.pop(eid, None)
+          removed.add(eid)
+        for entity in val['changed']:
+          removed.discard(entity['id'])
+          changed[entity['id']] = entity
+      else:
+        # replaced or removed (None), any earlier changes to it no longer matter
+        entity_changes.pop(key, None)
+        merged[key] = val
+  for key, (changed, removed) in entity_changes.items():
+    merged[key] = {'changed': list(changed.values()), 'removed': sorted(removed)}
+  return merged
+
+
 @functools.lru_cache(maxsize=8)
 def get_folder(relative_folder, mock=False):
   """ Get a directory
@@ -334,6 +415,81 @@ def is_amplipi():
   return amplipi
 
 
+class RWLock:
+  """ A reader/writer lock, any number of readers or a single writer can hold it at once
+
+  Waiting writers are preferred over new readers so a steady stream of reads can't starve changes.
+  Both sides are reentrant and a thread holding the write lock can also read, but a read lock can't be upgraded.
+  """
+
+  def __init__(self):
+    self._cond = threading.Condition(threading.Lock())
+    self._readers: Dict[int, int] = {}  # Key: thread id, Val: read depth
+    self._writer: Optional[int] = None
+    self._write_depth = 0
+    self._writers_waiting = 0
+
+  def acquire_read(self):
+    me = threading.get_ident()
+    with self._cond:
+      # a nested read can't wait for a writer, the writer would be waiting on us
+      if self._writer != me and me not in self._readers:
+        while self._writer is not None or self._writers_waiting:
+          self._cond.wait()
+      self._readers[me] = self._readers.get(me, 0) + 1
+
+  def release_read(self):
+    me = threading.get_ident()
+    with self._cond:
+      self._readers[me] -= 1
+      if self._readers[me] == 0:
+        del self._readers[me]
+        if not self._readers:
+          self._cond.notify_all()
+
+  def acquire_write(self):
+    me = threading.get_ident()
+    with self._cond:
+      if self._writer == me:
+        self._write_depth += 1
+        return
+      if me in self._readers:
+        raise RuntimeError('A read lock can not be upgraded to a write lock')
+      self._writers_waiting += 1
+      try:
+        while self._writer is not None or self._readers:
+          self._cond.wait()
+      finally:
+        self._writers_waiting -= 1
+      self._writer = me
+      self._write_depth = 1
+
+  def release_write(self):
+    with self._cond:
+      self._write_depth -= 1
+      if self._write_depth == 0:
+        self._writer = None
+        self._cond.notify_all()
+
+  @contextlib.contextmanager
+  def reading(self):
+    """ Hold the lock as a reader for the duration of a with block """
+    self.acquire_read()
+    try:
+      yield
+    finally:
+      self.release_read()
+
+  @contextlib.contextmanager
+  def writing(self):
+    """ Hold the lock as the writer for the duration of a with block """
+    self.acquire_write()
+    try:
+      yield
+    finally:
+      self.release_write()
+
+
 class TimeBasedCache:
   """ Cache the value of a timely but costly method, @updater, for @keep_for s """
 
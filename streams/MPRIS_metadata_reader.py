@@ -1,7 +1,6 @@
 """MPRIS metadata reader, waits for an update on MPRIS interface specified and outputs the
    content to a JSON file."""
 
-import json
 import signal
 import sys
 import time
@@ -11,6 +10,7 @@ from dasbus.client.proxy import disconnect_proxy, InterfaceProxy
 from dasbus.loop import EventLoop
 import logging
 import argparse
+import metadata_bus
 
 METADATA_MAPPINGS = [
   ('artist', 'xesam:artist'),
@@ -99,8 +99,7 @@ class MPRISMetadataReader:
 
           self.last_sent = metadata
 
-          with open(self.metadata_path, 'w', encoding='utf-8') as metadata_file:
-            json.dump(metadata, metadata_file)
+          metadata_bus.write(self.metadata_path, metadata)
 
         properties_changed.PropertiesChanged.connect(read_metadata)
 
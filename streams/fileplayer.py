@@ -3,8 +3,8 @@
 import os
 import sys
 import time
-import json
 import vlc
+import metadata_bus
 import argparse
 from typing import List, Optional, Any, IO
 
@@ -48,8 +48,7 @@ def log(info):
 
 def update_info(info) -> bool:
   try:
-    with open(args.song_info, "wt", encoding='utf-8') as info_file:
-      info_file.write(json.dumps(info))
+    metadata_bus.write(args.song_info, info)
     return True
   except Exception:
     log('Error: %s' % sys.exc_info()[1])
@@ -18,6 +18,7 @@ import socket
 import subprocess
 from dataclasses import dataclass
 import requests
+import metadata_bus
 from typing import Tuple
 
 
@@ -36,7 +37,7 @@ class MetadataHolder:
     self.logger.debug(f"\nAlbum: {self.album}\nArtist: {self.artist}\nTrack: {self.track}\nImage: {self.image_url}\n")
 
   def save_file(self, folder):
-    """Saves metadata to a file at the given folder"""
+    """Publishes metadata to the controller, or saves it to a file at the given folder if it isn't listening"""
     data = {
         'album': self.album,
         'artist': self.artist,
@@ -44,9 +45,7 @@ class MetadataHolder:
         'image_url': self.image_url
     }
 
-    with open(f"{folder}/lms_metadata_temp.json", 'wt', encoding='utf-8') as f:
-      json.dump(data, f, indent=2)
-    os.replace(f"{folder}/lms_metadata_temp.json", f"{folder}/lms_metadata.json")
+    metadata_bus.write(f"{folder}/lms_metadata.json", data)
 
 
 class LMSMetadataReader:
@@ -0,0 +1,46 @@
+""" Publish stream metadata to AmpliPi's metadata bus
+
+The controller listens on a unix datagram socket for the metadata the stream helpers would otherwise write
+to their metadata files, keeping it parsed in memory. When the controller isn't listening the file is written instead.
+"""
+
+import json
+import os
+import socket
+from typing import Any, Optional, Set
+
+BUS_PATH = os.environ.get('AMPLIPI_METADATA_BUS', os.path.join(os.path.expanduser('~'), '.config', 'amplipi', 'metadata.sock'))
+
+_sock: Optional[socket.socket] = None
+_published: Set[str] = set()  # paths whose stale files were removed
+
+
+def publish(path: str, data: Any) -> bool:
+  """ Push @data, the json contents of the metadata file @path, to the bus, returns False if nobody is listening """
+  global _sock
+  try:
+    if _sock is None:
+      _sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    _sock.sendto(json.dumps({'path': path, 'data': data}).encode(), BUS_PATH)
+  except OSError:
+    return False
+  if path not in _published:
+    # a file left from an earlier run would be read if the controller restarted before the next publish
+    _published.add(path)
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+  return True
+
+
+def write(path: str, data: Any):
+  """ Publish @data for @path, writing it to the file @path when the bus is unavailable """
+  if path is None:
+    raise TypeError('no metadata file given')
+  if not publish(path, data):
+    _published.discard(path)
+    # replace the file so the controller never reads a partially written one
+    with open(f'{path}.tmp', 'wt', encoding='utf-8') as info_file:
+      info_file.write(json.dumps(data))
+    os.replace(f'{path}.tmp', path)
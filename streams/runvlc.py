@@ -29,8 +29,8 @@
 import os
 import sys
 import time
-import json
 import vlc
+import metadata_bus
 import argparse
 import signal
 from typing import List, Optional, Any, IO
@@ -90,8 +90,7 @@ class RestartVlcException(Exception):
 
 def update_info(info) -> bool:
   try:
-    with open(args.song_info, "wt", encoding='utf-8') as info_file:
-      info_file.write(json.dumps(info))
+    metadata_bus.write(args.song_info, info)
     return True
   except Exception:
     log('Error: %s' % sys.exc_info()[1])
@@ -0,0 +1,329 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""" Resident VLC player service
+
+Hosts a libvlc media player per audio output in a single long lived process, controlled over a unix socket.
+Switching stations reuses the already initialized libvlc instance and player instead of starting a new
+runvlc.py/fileplayer.py process (a python interpreter, the vlc import and libvlc's startup) every time.
+
+Each request is a single line of json and gets a single line of json back:
+  {"cmd": "play", "mode": "radio" | "file", "url": ..., "output": ..., "song_info": ..., "log": ..., "cmd_file": ...}
+    -> {"ok": true, "id": <session id>}, replacing any session playing to the same output
+  {"cmd": "status", "id": <session id>} -> {"ok": true, "running": <bool>}
+  {"cmd": "stop", "id": <session id>} -> {"ok": true}
+  {"cmd": "ping"} -> {"ok": true}
+
+Sessions behave like the scripts they replace: radio sessions (runvlc.py) keep restarting a failed stream,
+file sessions (fileplayer.py) follow the play/pause commands written to their command file and end with the media.
+Both report the current song in their song info file, or on the metadata bus.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Any, Dict, IO, List, Optional
+
+import vlc
+
+import metadata_bus
+
+STREAM_OPENING_BACKOFF = 0.25  # 250ms
+MAX_STREAM_OPENING_TIME = 10  # seconds
+ENDED_INFO = {'track': '', 'artist': '', 'station': '', 'state': 'ENDED'}
+
+
+class Session:
+  """ Playback of a single url on an output, run by its own thread """
+
+  def __init__(self, sid: int, player: vlc.MediaPlayer, player_lock: threading.Lock, instance: vlc.Instance,
+               req: Dict[str, Any]):
+    self.id = sid
+    self.player = player
+    self.player_lock = player_lock  # held while handing the player over to a newer session
+    self.superseded = False  # a newer session took over the player
+    self.instance = instance
+    self.mode = req.get('mode', 'radio')
+    self.url = req['url']
+    self.output = req.get('output')
+    self.song_info = req.get('song_info')
+    self.cmd_file = req.get('cmd_file')
+    self.log_file: Optional[IO[Any]] = None
+    if req.get('log'):
+      try:
+        self.log_file = open(req['log'], 'w', encoding='utf-8')
+      except Exception:
+        pass
+    self.media: Optional[vlc.Media] = None
+    self.restarts: List[float] = []
+    self._stop = threading.Event()
+    self.thread = threading.Thread(target=self._run, name=f'vlc-session-{sid}', daemon=True)
+
+  def log(self, info):
+    if self.log_file:
+      try:
+        print(info, file=self.log_file)
+        self.log_file.flush()
+        return
+      except Exception:
+        pass
+    print(f'[{self.output}] {info}')
+
+  def update_info(self, info) -> bool:
+    if not self.song_info:
+      return True
+    try:
+      metadata_bus.write(self.song_info, info)
+      return True
+    except Exception:
+      self.log('Error: %s' % sys.exc_info()[1])
+      return False
+
+  @property
+  def running(self) -> bool:
+    return self.thread.is_alive()
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self, wait: bool = True):
+    """ Stop playback, the player is left stopped for the next session """
+    self._stop.set()
+    if wait and self.thread.is_alive() and self.thread is not threading.current_thread():
+      self.thread.join(timeout=5)
+
+  def _play(self):
+    self.media = self.instance.media_new(self.url)
+    self.player.set_media(self.media)
+    if self.output:
+      self.player.audio_output_device_set(None, self.output)
+    self.player.play()
+
+  def _restart(self):
+    """ Restart playback, waiting longer if it has been restarted a lot recently """
+    self.log('Waiting to restart vlc')
+    last_hour = time.time() - 3600
+    while len(self.restarts) > 0 and self.restarts[0] < last_hour:
+      self.restarts.pop(0)
+    if len(self.restarts) < 2:
+      delay = 5.0
+    else:
+      self.log('VLC restart is delayed, too many recent restarts')
+      delay = 60.0 * 10
+    self.player.stop()
+    if self._stop.wait(delay):
+      return
+    self.log('Attempting to restart VLC')
+    self._play()
+    self.restarts.append(time.time())
+
+  def _open(self) -> bool:
+    """ Wait for the stream to start playing, returns False if the session should end """
+    waited = 0.0
+    while not self._stop.is_set():
+      state = self.player.get_state()
+      if state == vlc.State.Playing:
+        self.log('Stream has opened.')
+        return True
+      if state in [vlc.State.Opening, vlc.State.Buffering, vlc.State.NothingSpecial] and waited < MAX_STREAM_OPENING_TIME:
+        self._stop.wait(STREAM_OPENING_BACKOFF)
+        waited += STREAM_OPENING_BACKOFF
+        continue
+      if self.mode == 'file':
+        self.log(f'Stream failed to open: {state}')
+        self.update_info(ENDED_INFO)
+        return False
+      self.log(f'Stream failed to open: {state}. Attempting to restart.')
+      self.update_info({'track': 'Error opening station; retrying...', 'artist': '', 'station': '', 'state': 'stopped'})
+      self._restart()
+      waited = 0.0
+    return False
+
+  def _read_cmd(self):
+    """ Follow the play/pause commands written to the command file """
+    if not self.cmd_file:
+      return
+    try:
+      with open(self.cmd_file, 'r', encoding='utf-8') as cmd_file:
+        cmd = cmd_file.readline()
+      if cmd == 'play':
+        self.player.set_pause(False)
+      elif cmd == 'pause':
+        self.player.set_pause(True)
+    except FileNotFoundError:
+      open(self.cmd_file, 'x').close()
+    except Exception:
+      pass
+
+  def _latest_info(self, state: str) -> Dict[str, Any]:
+    latest_info = {'track': '', 'artist': '', 'station': '', 'state': state}
+    media = self.media
+    if media is None:
+      return latest_info
+    # Pass along the station name if it exists in Title metadata
+    latest_info['station'] = media.get_meta(vlc.Meta.Title)
+    # 'nowplaying' metadata is used by some internet radio stations instead of separate artist and title
+    nowplaying = media.get_meta(vlc.Meta.NowPlaying)
+    if nowplaying:
+      # 'nowplaying' metadata is "almost" always: title - artist
+      if '-' in nowplaying:
+        parts = nowplaying.split(' - ', 1)
+        latest_info['artist'] = parts[0]
+        latest_info['track'] = parts[1]
+      else:
+        latest_info['artist'] = None
+        latest_info['track'] = nowplaying
+    else:
+      latest_info['artist'] = media.get_meta(vlc.Meta.Artist)
+      latest_info['track'] = media.get_meta(vlc.Meta.Title)
+    return latest_info
+
+  def _run(self):
+    cur_info: Dict[str, Any] = {'track': '', 'artist': '', 'station': '', 'state': 'stopped'}
+    try:
+      self._play()
+      self.update_info(cur_info)
+      if not self._open():
+        return
+      # Monitor track meta data and update the song info file if the track changed
+      throttle = 0.1 if self.mode == 'file' else 1.0
+      while not self._stop.is_set():
+        state = self.player.get_state()
+        if state in [vlc.State.Playing, vlc.State.Paused]:
+          if self.mode == 'file':
+            self._read_cmd()
+          latest_info = self._latest_info('playing')
+          if latest_info != cur_info:
+            cur_info = latest_info
+            self.log(f"Current track: {latest_info['track']} - {latest_info['artist']}")
+            self.update_info(cur_info)
+        elif state == vlc.State.Ended and self.mode == 'file':
+          self.update_info(ENDED_INFO)
+          return
+        else:
+          self.log(f'State: {state}')
+          self.update_info({'track': '', 'artist': '', 'station': '', 'state': 'stopped'})
+          self._restart()
+        self._stop.wait(throttle)
+    except Exception:
+      self.log('Error: %s' % sys.exc_info()[1])
+      self.update_info(ENDED_INFO)
+    finally:
+      with self.player_lock:
+        # a session that was slow to stop mustn't stop the newer session playing on the same player
+        if not self.superseded:
+          self.player.stop()
+      if self.log_file:
+        self.log_file.close()
+
+
+class PlayerService:
+  """ Keeps a warm libvlc instance and a media player per output """
+
+  def __init__(self):
+    self.instance = vlc.Instance(['--aout=alsa'])
+    self.players: Dict[str, vlc.MediaPlayer] = {}  # Key: output
+    self.player_locks: Dict[str, threading.Lock] = {}  # Key: output
+    self.sessions: Dict[int, Session] = {}
+    self.by_output: Dict[str, int] = {}  # Key: output, Val: session id
+    self.next_id = 0
+    self.lock = threading.Lock()
+
+  def play(self, req: Dict[str, Any]) -> Dict[str, Any]:
+    output = req.get('output') or 'default'
+    with self.lock:
+      prev = self.sessions.get(self.by_output.get(output, -1))
+      if output not in self.players:
+        self.players[output] = self.instance.media_player_new()
+        self.player_locks[output] = threading.Lock()
+      if prev is not None:
+        # hand the player over now, the previous session is waited on below without blocking other requests
+        with prev.player_lock:
+          prev.superseded = True
+        prev.stop(wait=False)
+      self.next_id += 1
+      session = Session(self.next_id, self.players[output], self.player_locks[output], self.instance, req)
+      self.sessions[session.id] = session
+      self.by_output[output] = session.id
+      # forget the sessions that ended a while ago
+      for sid in [sid for sid, s in self.sessions.items() if not s.running and sid not in self.by_output.values()]:
+        del self.sessions[sid]
+    if prev is not None:
+      prev.stop()
+    session.start()
+    return {'ok': True, 'id': session.id}
+
+  def status(self, req: Dict[str, Any]) -> Dict[str, Any]:
+    session = self.sessions.get(req.get('id', -1))
+    return {'ok': True, 'running': session is not None and session.running}
+
+  def stop(self, req: Dict[str, Any]) -> Dict[str, Any]:
+    session = self.sessions.get(req.get('id', -1))
+    if session is not None:
+      session.stop()
+    return {'ok': True}
+
+  def handle(self, conn: socket.socket):
+    with conn, conn.makefile('rwb') as stream:
+      try:
+        req = json.loads(stream.readline())
+        cmd = req.get('cmd')
+        if cmd == 'play':
+          resp = self.play(req)
+        elif cmd == 'status':
+          resp = self.status(req)
+        elif cmd == 'stop':
+          resp = self.stop(req)
+        elif cmd == 'ping':
+          resp = {'ok': True}
+        else:
+          resp = {'ok': False, 'error': f'unknown command {cmd}'}
+      except Exception as exc:
+        resp = {'ok': False, 'error': str(exc)}
+      stream.write(json.dumps(resp).encode() + b'\n')
+      stream.flush()
+
+  def shutdown(self):
+    for session in list(self.sessions.values()):
+      session.stop()
+
+
+def main():
+  parser = argparse.ArgumentParser(prog='vlc_service', description='play several vlc streams, controlled over a unix socket')
+  parser.add_argument('socket', type=str, help='unix socket to listen on')
+  args = parser.parse_args()
+
+  service = PlayerService()
+  try:
+    os.remove(args.socket)
+  except FileNotFoundError:
+    pass
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  server.bind(args.socket)
+  server.listen(8)
+
+  def signal_handler(sig, _):
+    print(f'Caught signal {sig}, exiting.')
+    service.shutdown()
+    server.close()
+    try:
+      os.remove(args.socket)
+    except OSError:
+      pass
+    sys.exit(0)
+
+  signal.signal(signal.SIGTERM, signal_handler)
+  signal.signal(signal.SIGINT, signal_handler)
+
+  while True:
+    conn, _ = server.accept()
+    threading.Thread(target=service.handle, args=(conn,), daemon=True).start()
+
+
+if __name__ == '__main__':
+  main()
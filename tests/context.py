@@ -17,3 +17,24 @@ import amplipi.streams
 import amplipi.utils
 import amplipi.zeroconf
 # autopep8: on
+
+
+class StandIn:
+  """ A stand-in for downloading or decoding media, recording the keys it is called with
+
+  Returns @results[key], raising @error for unknown keys. When @release is given each call waits for it first.
+  """
+
+  def __init__(self, results, error=RuntimeError, release=None):
+    self.results = results
+    self.error = error
+    self.release = release
+    self.calls = []
+
+  def __call__(self, key, *args):
+    self.calls.append(key)
+    if self.release:
+      self.release.wait(2)
+    if key not in self.results:
+      raise self.error(f'{key} not found')
+    return self.results[key]
@@ -0,0 +1,112 @@
+""" Test the album art cache """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import io
+import tempfile
+import threading
+import pytest
+from PIL import Image
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi import art
+from context import StandIn
+# autopep8: on
+
+
+def _image(color) -> bytes:
+  out = io.BytesIO()
+  Image.new('RGB', (400, 400), color).save(out, format='PNG')
+  return out.getvalue()
+
+
+def test_scaled_and_cached():
+  """ Art is scaled to the requested size and only downloaded once """
+  fetcher = StandIn({'http://a/cover.jpg': _image('red')})
+  cache = art.ArtCache(fetch=fetcher)
+  img = cache.get('http://a/cover.jpg', 100).result(2)
+  assert Image.open(io.BytesIO(img.data)).size == (100, 100)
+  assert cache.get('http://a/cover.jpg', 100).result(2) == img
+  assert fetcher.calls == ['http://a/cover.jpg']
+  assert cache.get('http://a/cover.jpg', 50).result(2).etag != img.etag
+
+
+def test_same_name_different_art():
+  """ Art from different urls shouldn't collide, even with the same file name """
+  fetcher = StandIn({'http://a/cover.jpg': _image('red'), 'http://b/cover.jpg': _image('blue')})
+  cache = art.ArtCache(fetch=fetcher)
+  a = cache.get('http://a/cover.jpg', 100).result(2)
+  b = cache.get('http://b/cover.jpg', 100).result(2)
+  assert a.etag != b.etag
+  assert len(cache) == 2
+
+
+def test_concurrent_requests_coalesced():
+  """ Requests for art that is already being loaded share the load """
+  release = threading.Event()
+  fetcher = StandIn({'http://a/cover.jpg': _image('red')}, release=release)
+  cache = art.ArtCache(fetch=fetcher)
+  futures = [cache.get('http://a/cover.jpg', 100) for _ in range(5)]
+  release.set()
+  assert len({f.result(2) for f in futures}) == 1
+  assert fetcher.calls == ['http://a/cover.jpg']
+
+
+def test_failures_not_cached():
+  """ A failed download is tried again on the next request """
+  fetcher = StandIn({})
+  cache = art.ArtCache(fetch=fetcher)
+  with pytest.raises(RuntimeError):
+    cache.get('http://a/missing.jpg', 100).result(2)
+  with pytest.raises(RuntimeError):
+    cache.get('http://a/missing.jpg', 100).result(2)
+  assert len(fetcher.calls) == 2
+  assert len(cache) == 0
+
+
+def test_lru_eviction():
+  """ The least recently used art is dropped once the cache is full """
+  fetcher = StandIn({u: _image(c) for u, c in [('a', 'red'), ('b', 'green'), ('c', 'blue')]})
+  cache = art.ArtCache(fetch=fetcher)
+  size = len(cache.get('a', 100).result(2).data)
+  cache.max_bytes = 2 * size
+  cache.get('b', 100).result(2)
+  cache.get('a', 100).result(2)  # a is now more recently used than b
+  cache.get('c', 100).result(2)
+  assert cache.keys() == [art.ArtCache._key('a', 100), art.ArtCache._key('c', 100)]
+  assert cache.size == 2 * size
+
+
+def test_prefetch_sizes():
+  """ Prefetching renders every size from a single download """
+  fetcher = StandIn({'a': _image('red')})
+  cache = art.ArtCache(fetch=fetcher)
+  cache.prefetch('a', [80, 160])
+  cache.prefetch('a', [160, 240])  # 160 is already on its way
+  for size in [80, 160, 240]:
+    assert Image.open(io.BytesIO(cache.get('a', size).result(2).data)).size == (size, size)
+  assert fetcher.calls == ['a', 'a']
+  assert len(cache) == 3
+
+
+def test_ctrl_prefetches_art(monkeypatch):
+  """ The controller should get the art of its sources ready, downloading art shared by sources once """
+  from amplipi import ctrl, models  # pylint: disable=import-outside-toplevel
+  fetched = []
+  cache = art.ArtCache(fetch=lambda uri: fetched.append(uri) or _image('red'))
+  monkeypatch.setattr(art, 'get_cache', lambda: cache)
+  settings = models.AppSettings()
+  settings.config_file = os.path.join(tempfile.mkdtemp(), 'house.json')
+  settings.art_sizes = [80, 160]
+  api = ctrl.Api(settings)
+  try:
+    uris = {art.source_art(src.info.img_url) for src in api.status.sources if src.info}
+    assert uris
+    for uri in uris:
+      for size in settings.art_sizes:
+        cache.get(uri, size).result(2)
+    assert sorted(fetched) == sorted(uris)
+    assert len(cache) == len(uris) * len(settings.art_sizes)
+  finally:
+    api._stop_workers()
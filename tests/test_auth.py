@@ -3,6 +3,7 @@
 # json utils
 import json
 from http import HTTPStatus
+import pytest
 
 # temporary directory for each test config
 import os
@@ -153,3 +154,68 @@ def test_config_creation(tmp_path, monkeypatch):
   assert client.get(f"/api/?api-key={key}").status_code == HTTPStatus.OK
   cookie_header = {"Cookie": f"amplipi-session={key}"}
   assert client.get("/api", headers=cookie_header).status_code == HTTPStatus.OK
+
+
+def test_users_cache(tmp_path, monkeypatch):
+  """ The users file should only be read again after it changes """
+  mockusersfile = str(os.path.join(tmp_path, "users.json"))
+  with open(mockusersfile, 'w', encoding='utf-8') as users_config:
+    users_config.write(json.dumps(TEST_ADMIN_USER_CONFIG))
+  monkeypatch.setattr(auth, "USER_CONFIG_DIR", str(tmp_path))
+  monkeypatch.setattr(auth, "USERS_FILE", mockusersfile)
+  monkeypatch.setattr(auth, "SESSION_TTL", 0)  # check every key against the file
+
+  key = TEST_ADMIN_USER_CONFIG["admin"]["access_key"]
+  assert auth._check_access_key(key) == "admin"
+  users, _ = auth._load_users()
+  assert auth._load_users()[0] is users  # unchanged file, no reload
+  # copies handed out for modification don't affect the cache
+  auth._get_users()["admin"]["access_key"] = "modified"
+  assert auth._check_access_key(key) == "admin"
+
+  # changing the file outside of auth is picked up
+  other_users = {"api": {"type": "api", "access_key": "abc123"}}
+  with open(mockusersfile + ".tmp", 'w', encoding='utf-8') as users_config:
+    users_config.write(json.dumps(other_users))
+  os.replace(mockusersfile + ".tmp", mockusersfile)
+  assert auth._check_access_key(key) == False
+  assert auth._check_access_key("abc123") == "api"
+
+  # and so are changes written through auth
+  new_key = auth.create_access_key("api")
+  assert auth._check_access_key("abc123") == False
+  assert auth._check_access_key(new_key) == "api"
+
+
+def test_session_cache(tmp_path, monkeypatch):
+  """ Validated access keys should be trusted until they expire or their user's credentials change """
+  mockusersfile = str(os.path.join(tmp_path, "users.json"))
+  with open(mockusersfile, 'w', encoding='utf-8') as users_config:
+    users_config.write(json.dumps(TEST_ADMIN_USER_CONFIG))
+  monkeypatch.setattr(auth, "USER_CONFIG_DIR", str(tmp_path))
+  monkeypatch.setattr(auth, "USERS_FILE", mockusersfile)
+  monkeypatch.setattr(auth, "_sessions", {})
+
+  key = TEST_ADMIN_USER_CONFIG["admin"]["access_key"]
+  assert auth._check_access_key(key) == "admin"
+  assert auth._key_digest(key) in auth._sessions
+  assert key not in str(auth._sessions)  # only the digest is kept
+  load_users = auth._load_users
+  monkeypatch.setattr(auth, "_load_users", lambda: pytest.fail("the session should have been cached"))
+  assert auth._check_access_key(key) == "admin"
+  monkeypatch.setattr(auth, "_load_users", load_users)
+
+  # changing the credentials revokes the cached session right away
+  new_key = auth.create_access_key("admin")
+  assert auth._check_access_key(key) == False
+  assert auth._check_access_key(new_key) == "admin"
+  auth.unset_password_hash("admin")
+  assert auth._key_digest(new_key) not in auth._sessions
+
+  # an expired session is checked against the users file again
+  assert auth._check_access_key(new_key) == "admin"
+  monkeypatch.setattr(auth, "_sessions", {d: (u, 0.0) for d, (u, _) in auth._sessions.items()})
+  with open(mockusersfile, 'w', encoding='utf-8') as users_config:
+    users_config.write(json.dumps({}))
+  assert auth._check_access_key(new_key) == False
+  assert auth._sessions == {}
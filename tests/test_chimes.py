@@ -0,0 +1,85 @@
+""" Test the announcement chime cache """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import subprocess
+import tempfile
+import time
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi import chimes
+from context import StandIn
+# autopep8: on
+
+
+def _cache(sizes, **kwargs):
+  """ A cache whose stand-in decoder writes @sizes[url] bytes of silence, and the stand-in """
+  decoder = StandIn(sizes)
+
+  def decode(url, dest, max_bytes):
+    with open(dest, 'wb') as file:
+      file.write(bytes(decoder(url)))
+  return chimes.ChimeCache(tempfile.mkdtemp(), decode=decode, **kwargs), decoder
+
+
+def test_prefetch_then_play():
+  """ A prefetched chime is played from its decoded audio with aplay, and decoded only once """
+  cache, decoder = _cache({'doorbell.mp3': 100})
+  assert cache.play_args('doorbell.mp3', 'ch0') is None
+  cache.prefetch('doorbell.mp3')
+  cache.wait('doorbell.mp3')
+  args = cache.play_args('doorbell.mp3', 'ch0')
+  assert args is not None and args[0] == 'aplay' and args[-1] == cache.get('doorbell.mp3')
+  assert os.path.getsize(args[-1]) == 100
+  cache.prefetch('doorbell.mp3')
+  assert decoder.calls == ['doorbell.mp3']
+
+
+def test_evicted_files_removed():
+  """ Evicting the least recently used chime removes its decoded audio """
+  cache, _ = _cache({'a': 60, 'b': 60}, max_bytes=100)
+  for url in ['a', 'b']:
+    cache.prefetch(url)
+    cache.wait(url)
+  assert cache.urls() == ['b']
+  assert os.listdir(cache.folder) == [os.path.basename(cache.get('b'))]
+
+
+def test_rejected_not_retried():
+  """ Media that can't be decoded or is too long for a chime isn't cached, or decoded again """
+  cache, decoder = _cache({'song.mp3': 200}, max_chime_bytes=100)
+  for url in ['song.mp3', 'missing.mp3']:
+    cache.prefetch(url)
+    cache.wait(url)
+    assert cache.get(url) is None
+    cache.prefetch(url)
+  assert decoder.calls == ['song.mp3', 'missing.mp3']
+  assert os.listdir(cache.folder) == []
+
+
+def test_rejected_expire(monkeypatch):
+  """ Rejected media is tried again once its rejection expires, and only the latest rejections are remembered """
+  monkeypatch.setattr(chimes, 'REJECTED_TTL', 0.05)
+  monkeypatch.setattr(chimes, 'MAX_REJECTED', 2)
+  cache, decoder = _cache({})
+  for url in ['a', 'b', 'c']:
+    cache.prefetch(url)
+    cache.wait(url)
+  assert list(cache._rejected) == ['b', 'c']
+  time.sleep(0.1)
+  cache.prefetch('c')
+  cache.wait('c')
+  assert decoder.calls == ['a', 'b', 'c', 'c']
+
+
+def test_decode_capped():
+  """ A decoder that writes too much is stopped instead of filling up the cache's folder """
+  dest = os.path.join(tempfile.mkdtemp(), 'out.wav')
+  start = time.monotonic()
+  with pytest.raises(ValueError):
+    chimes._run_capped(['sh', '-c', f'while true; do head -c 1024 /dev/zero >> {dest}; done'], dest, 4096)
+  assert time.monotonic() - start < 5
+  with pytest.raises(subprocess.CalledProcessError):
+    chimes._run_capped(['sh', '-c', 'exit 1'], dest, 4096)
@@ -0,0 +1,109 @@
+""" Test internet radio playlist resolution and prefetching """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi.streams import internet_radio, playlists
+from context import StandIn
+# autopep8: on
+
+PLAYLIST = b'[playlist]\nFile1=http://radio.example/stream1\nFile2=http://radio.example/stream2\nNumberOfEntries=2\n'
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+  """ Serves the playlist for every path, counting the requests """
+
+  def do_GET(self):
+    self.server.requests += 1  # type: ignore
+    self.send_response(200)
+    self.end_headers()
+    self.wfile.write(PLAYLIST)
+
+  def log_message(self, *args):
+    pass
+
+
+class PlaylistServer(HTTPServer):
+  """ A local playlist server, running in the background """
+
+  def __init__(self):
+    self.requests = 0
+    super().__init__(('127.0.0.1', 0), PlaylistHandler)
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+
+  def url(self, path):
+    return f'http://127.0.0.1:{self.server_port}/{path}'
+
+
+def test_parse_playlists():
+  """ Each playlist format is parsed into its stream urls """
+  assert playlists.parse_playlist('http://a.example/s.pls', PLAYLIST.decode()) == ['http://radio.example/stream1', 'http://radio.example/stream2']
+  pls = '[playlist]\nFile2=http://b.example/2\nTitle1=Station\nFile1=http://b.example/1\n'
+  assert playlists.parse_playlist('http://b.example/s.pls', pls) == ['http://b.example/1', 'http://b.example/2']
+  m3u = '#EXTM3U\n#EXTINF:-1,Station\nhttp://c.example/live\n\nbackup/live\n'
+  assert playlists.parse_playlist('http://c.example/s.m3u', m3u) == ['http://c.example/live', 'http://c.example/backup/live']
+  hls = '#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=128000\nchunks.m3u8\n'
+  assert playlists.parse_playlist('http://d.example/s.m3u8', hls) == ['http://d.example/s.m3u8']
+  assert playlists.playlist_type('http://d.example/s.M3U?token=1') == 'm3u'
+  assert playlists.playlist_type('http://d.example/stream.mp3') is None
+
+
+def test_resolved_and_failed_cached():
+  """ Resolutions and failures are both cached until they expire """
+  fetcher = StandIn({'http://a.example/s.pls': ['http://a.example/1']}, ConnectionError)
+  resolver = playlists.PlaylistResolver(fetch=fetcher, failed_ttl=0.2)
+  assert resolver.resolve('http://a.example/s.pls') == ['http://a.example/1']
+  assert resolver.resolve('http://a.example/s.pls') == ['http://a.example/1']
+  for _ in range(2):
+    try:
+      resolver.resolve('http://down.example/s.pls')
+      assert False, 'resolving a down station should fail'
+    except playlists.PlaylistError:
+      pass
+  assert fetcher.calls == ['http://a.example/s.pls', 'http://down.example/s.pls']
+  time.sleep(0.3)
+  resolver.prefetch('http://down.example/s.pls')  # the failure expired, try again
+  time.sleep(0.1)
+  assert fetcher.calls[-1] == 'http://down.example/s.pls' and len(fetcher.calls) == 3
+
+
+def test_failover():
+  """ A dead stream url is skipped in favor of the next one in the playlist, the url picked is reused until it fails """
+  probed = []
+
+  def is_live(url, timeout):
+    probed.append(url)
+    return url != 'http://a.example/1'
+
+  fetcher = StandIn({'http://a.example/s.pls': ['http://a.example/1', 'http://a.example/2', 'http://a.example/3']}, ConnectionError)
+  resolver = playlists.PlaylistResolver(fetch=fetcher, is_live=is_live)
+  assert resolver.stream_url('http://a.example/s.pls') == 'http://a.example/2'
+  assert resolver.stream_url('http://a.example/s.pls') == 'http://a.example/2'
+  assert probed == ['http://a.example/1', 'http://a.example/2']
+  resolver.stream_failed('http://a.example/s.pls', 'http://a.example/2')
+  assert resolver.stream_url('http://a.example/s.pls') == 'http://a.example/3'  # 1 is still remembered as dead
+  assert probed == ['http://a.example/1', 'http://a.example/2', 'http://a.example/3']
+  assert fetcher.calls == ['http://a.example/s.pls']
+  assert resolver.stream_url('http://a.example/stream.mp3') == 'http://a.example/stream.mp3'
+
+
+def test_prefetch():
+  """ Prefetching a station resolves its playlist ahead of time, without changing the station's url """
+  server = PlaylistServer()
+  url = server.url('prefetch.pls')
+  radio = internet_radio.InternetRadio('Prefetched', url, None, validate=False)
+  radio.prefetch()
+  start = time.monotonic()
+  while playlists.get_resolver().cached(url) is None and time.monotonic() - start < 5:
+    time.sleep(0.01)
+  assert playlists.get_resolver().cached(url) == ['http://radio.example/stream1', 'http://radio.example/stream2']
+  radio.prefetch()  # already resolved
+  assert radio.url == url
+  time.sleep(0.1)
+  assert server.requests == 1
+  server.shutdown()
@@ -0,0 +1,79 @@
+""" Test the background metadata watcher """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import threading
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi import metadata
+# autopep8: on
+
+
+def test_watcher_refreshes_on_change():
+  """ Writing a metadata file, even in a folder created later, should trigger a refresh """
+  folder = tempfile.mkdtemp()
+  refreshed = threading.Event()
+  watcher = metadata.MetadataWatcher(folder, lambda changed: changed and refreshed.set(), interval=60, poll_interval=60)
+  try:
+    os.makedirs(os.path.join(folder, 'v1'))
+    assert refreshed.wait(timeout=2)
+    refreshed.clear()
+    with open(os.path.join(folder, 'v1', 'currentSong'), 'w', encoding='utf-8') as song:
+      song.write('{}')
+    assert refreshed.wait(timeout=2)
+  finally:
+    watcher.stop()
+
+
+def test_watcher_trigger():
+  """ A refresh can be requested explicitly """
+  refreshed = threading.Event()
+  watcher = metadata.MetadataWatcher(tempfile.mkdtemp(), lambda changed: changed and refreshed.set(), interval=60)
+  try:
+    watcher.trigger()
+    assert refreshed.wait(timeout=2)
+  finally:
+    watcher.stop()
+
+
+def test_watcher_interval_not_forced():
+  """ The periodic refresh without any change shouldn't ask for the metadata to be read again """
+  calls = []
+  refreshed = threading.Event()
+  watcher = metadata.MetadataWatcher(tempfile.mkdtemp(), lambda changed: (calls.append(changed), refreshed.set()), interval=0.05)
+  try:
+    assert refreshed.wait(timeout=2)
+  finally:
+    watcher.stop()
+  assert calls and not any(calls)
+
+
+def test_bus_publish():
+  """ Published metadata is read from memory instead of its file, and falls back to the file without the bus """
+  folder = tempfile.mkdtemp()
+  path = os.path.join(folder, 'currentSong')
+  sock_path = os.path.join(folder, 'metadata.sock')
+  sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'streams')))
+  import metadata_bus  # the helpers' side of the bus
+  metadata_bus.BUS_PATH = sock_path
+  with open(path, 'w', encoding='utf-8') as song:
+    song.write('{"track": "stale"}')
+  published = threading.Event()
+  bus = metadata.MetadataBus(sock_path, published.set)
+  try:
+    metadata_bus.write(path, {'track': 'Song 2', 'state': 'playing'})
+    assert published.wait(timeout=2)
+    assert metadata.read_json(path) == {'track': 'Song 2', 'state': 'playing'}
+    assert not os.path.exists(path)  # the stale file is removed
+    metadata.discard(path)
+    try:
+      metadata.read_json(path)
+      assert False, 'discarded metadata should be gone'
+    except OSError:
+      pass
+  finally:
+    bus.stop()
+  metadata_bus.write(path, {'track': 'Song 3'})
+  assert metadata.read_json(path) == {'track': 'Song 3'}
@@ -0,0 +1,170 @@
+""" Test the configuration writer """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import tempfile
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi import persist
+# autopep8: on
+
+
+class Config:
+  """ A stand-in configuration that counts how often it gets serialized """
+
+  def __init__(self):
+    self.data = b'{"version": 1}'
+    self.serialized = 0
+
+  def serialize(self) -> bytes:
+    self.serialized += 1
+    return self.data
+
+
+def _read(path):
+  with open(path, 'rb') as file:
+    return file.read()
+
+
+def test_save_keeps_backup():
+  """ Saving replaces the config and moves the previous one to the backup """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json')
+  with open(path, 'wb') as file:
+    file.write(b'{"version": 0}')
+  cfg = Config()
+  writer = persist.ConfigWriter(path, cfg.serialize)
+  assert writer.save()
+  assert _read(path) == cfg.data
+  assert _read(f'{path}.bak') == b'{"version": 0}'
+  assert not os.path.exists(f'{path}.tmp')
+  writer.stop()
+
+
+def test_unchanged_not_written():
+  """ Saving an identical config shouldn't touch the file """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json')
+  cfg = Config()
+  writer = persist.ConfigWriter(path, cfg.serialize)
+  assert writer.save()
+  assert not writer.save()
+  assert writer.writes == 1
+  writer.stop()
+
+
+def test_invalid_config_not_backed_up():
+  """ A corrupted config shouldn't replace a good backup """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json')
+  with open(path, 'wb') as file:
+    file.write(b'{"vers')
+  with open(f'{path}.bak', 'wb') as file:
+    file.write(b'{"version": 0}')
+  writer = persist.ConfigWriter(path, Config().serialize, backup_current=False)
+  assert writer.save()
+  assert _read(f'{path}.bak') == b'{"version": 0}'
+  writer.stop()
+
+
+def test_scheduled_saves_coalesce():
+  """ A burst of changes results in a single write, which a steady stream of changes can't postpone forever """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json')
+  cfg = Config()
+  writer = persist.ConfigWriter(path, cfg.serialize, delay=0.2, max_delay=0.5)
+  start = time.monotonic()
+  while not os.path.exists(path) and time.monotonic() - start < 2:
+    writer.schedule()
+    time.sleep(0.02)
+  assert os.path.exists(path)
+  assert time.monotonic() - start < 1.0
+  assert cfg.serialized == 1
+  writer.stop()
+
+
+def test_stop_saves_pending():
+  """ Stopping the writer saves any pending changes """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json')
+  writer = persist.ConfigWriter(path, Config().serialize, delay=60)
+  writer.schedule()
+  writer.stop()
+  assert writer.writes == 1
+  assert os.path.exists(path)
+
+
+def test_journal_replay():
+  """ Journaled changes are replayed in order, optionally up to a point in time """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json.journal')
+  journal = persist.StateJournal(path)
+  journal.append({'zones': {'changed': [{'id': 0, 'vol': -40}], 'removed': []}})
+  checkpoint = time.time()
+  time.sleep(0.01)
+  journal.append({'zones': {'changed': [{'id': 1, 'vol': -20}], 'removed': [0]}})
+  journal.close()
+  with open(path, 'ab') as file:
+    file.write(b'{"time": 1')  # partial entry from a crash
+  journal = persist.StateJournal(path)
+  state, applied = journal.replay({'zones': [{'id': 0, 'vol': -79}]})
+  assert applied == 2
+  assert state == {'zones': [{'id': 1, 'vol': -20}]}
+  state, applied = journal.replay({'zones': [{'id': 0, 'vol': -79}]}, until=checkpoint)
+  assert applied == 1
+  assert state == {'zones': [{'id': 0, 'vol': -40}]}
+  journal.close()
+
+
+def test_journal_compaction():
+  """ Rotated entries are kept until the config is saved, and new entries go to the current journal """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json.journal')
+  journal = persist.StateJournal(path)
+  journal.append({'version': 1})
+  journal.rotate()
+  journal.append({'version': 2})
+  assert [delta for _, delta in journal.entries()] == [{'version': 1}, {'version': 2}]
+  journal.rotate()  # the first compaction never finished
+  assert [delta for _, delta in journal.entries()] == [{'version': 1}, {'version': 2}]
+  journal.discard_rotated()
+  assert journal.entries() == []
+  journal.close()
+
+
+def test_schedule_now():
+  """ A zero delay saves from the writer thread right away, without waiting on the write """
+  path = os.path.join(tempfile.mkdtemp(), 'house.json')
+  writer = persist.ConfigWriter(path, Config().serialize, delay=60)
+  writer.schedule(0)
+  start = time.monotonic()
+  while writer.writes == 0 and time.monotonic() - start < 2:
+    time.sleep(0.01)
+  assert writer.writes == 1
+  writer.stop()
+
+
+def test_journal_compaction_while_changing(monkeypatch):
+  """ Compacting a full journal shouldn't deadlock with a change that is holding the state lock """
+  import threading  # pylint: disable=import-outside-toplevel
+  from amplipi import ctrl, models  # pylint: disable=import-outside-toplevel
+  monkeypatch.setattr(ctrl, 'JOURNAL_MAX_SIZE', 0)
+  settings = models.AppSettings()
+  settings.config_file = os.path.join(tempfile.mkdtemp(), 'house.json')
+  settings.journal_saves = True
+  api = ctrl.Api(settings)
+  try:
+    done = threading.Event()
+
+    def change():
+      for vol in range(-60, -40):
+        api.set_zone(0, models.ZoneUpdate(vol=vol))
+      done.set()
+    changer = threading.Thread(target=change, daemon=True)
+    changer.start()
+    start = time.monotonic()
+    while not done.is_set() and time.monotonic() - start < 5:
+      api._config_writer.schedule(0)  # keep the writer thread compacting alongside the changes
+      time.sleep(0.001)
+    assert done.is_set()
+    start = time.monotonic()
+    while api._config_writer.pending and time.monotonic() - start < 2:
+      time.sleep(0.01)
+    assert not api._config_writer.pending
+  finally:
+    api._stop_workers()
@@ -0,0 +1,78 @@
+""" Test the resident player service client """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import json
+import socket
+import subprocess
+import tempfile
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi.streams import player_service
+# autopep8: on
+
+
+class FakeService:
+  """ A stand-in for streams/vlc_service.py that records the requests and plays nothing """
+
+  def __init__(self, sock_path):
+    self.requests = []
+    self.running = {}
+    self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.server.bind(sock_path)
+    self.server.listen(4)
+    threading.Thread(target=self._serve, daemon=True).start()
+
+  def _serve(self):
+    while True:
+      conn, _ = self.server.accept()
+      with conn, conn.makefile('rwb') as stream:
+        req = json.loads(stream.readline())
+        self.requests.append(req)
+        resp = {'ok': True}
+        if req['cmd'] == 'play':
+          resp['id'] = len(self.requests)
+          self.running[resp['id']] = True
+        elif req['cmd'] == 'status':
+          resp['running'] = self.running.get(req['id'], False)
+        elif req['cmd'] == 'stop':
+          self.running[req['id']] = False
+        stream.write(json.dumps(resp).encode() + b'\n')
+
+
+def play_id(fake):
+  """ The session id of the last play request """
+  return [i + 1 for i, req in enumerate(fake.requests) if req['cmd'] == 'play'][-1]
+
+
+def test_launch_in_service():
+  """ runvlc.py command lines are played by the service, and the playback acts like the script's process """
+  sock_path = os.path.join(tempfile.mkdtemp(), 'vlc.sock')
+  fake = FakeService(sock_path)
+  service = player_service.PlayerService(sock_path, ['false'])
+  proc = service.launch([sys.executable, '/streams/runvlc.py', 'http://radio.example/stream', 'ch1',
+                         '--song-info', '/tmp/currentSong', '--log', '/tmp/log'])
+  assert isinstance(proc, player_service.Playback)
+  play = fake.requests[-1]
+  assert play['mode'] == 'radio' and play['url'] == 'http://radio.example/stream' and play['output'] == 'ch1'
+  assert play['song_info'] == '/tmp/currentSong' and play['cmd_file'] is None
+  assert proc.poll() is None
+  proc.kill()
+  assert fake.requests[-1] == {'cmd': 'stop', 'id': play_id(fake)}
+  assert proc.poll() is not None
+  assert proc.wait(timeout=1) is not None
+
+
+def test_fallback_to_process():
+  """ Commands run as their own process when the service can't start """
+  sock_path = os.path.join(tempfile.mkdtemp(), 'vlc.sock')
+  service = player_service.PlayerService(sock_path, [sys.executable, '-c', 'import sys; sys.exit(1)'])
+  proc = service.launch([sys.executable, 'fileplayer.py', 'missing.mp3'])
+  assert isinstance(proc, subprocess.Popen)
+  proc.wait()
+  # the broken service isn't restarted for every stream
+  proc = service.launch([sys.executable, 'fileplayer.py', 'missing.mp3'])
+  assert isinstance(proc, subprocess.Popen)
+  proc.wait()
@@ -15,7 +15,7 @@ import os
 from copy import deepcopy  # copy test config
 
 # add some random delays to stream commands
-from time import sleep
+from time import monotonic, sleep
 import random
 
 import pytest
@@ -402,6 +402,128 @@ def test_get_info(client):
     if isinstance(val, str):
       assert val.lower() != 'unknown', f"Unpopulated info field {key}"
 
+
+def test_get_status_etag(client):
+  """ Polling the status with If-None-Match only returns the status when it changed """
+  rv = client.get('/api')
+  assert rv.status_code == HTTPStatus.OK
+  etag = rv.headers['etag']
+  rv = client.get('/api', headers={'If-None-Match': etag})
+  assert rv.status_code == HTTPStatus.NOT_MODIFIED
+  zid = client.get('/api').json()['zones'][0]['id']
+  rv = client.patch(f'/api/zones/{zid}', json={'name': 'etag test'})
+  assert rv.status_code == HTTPStatus.OK
+  rv = client.get('/api', headers={'If-None-Match': etag})
+  assert rv.status_code == HTTPStatus.OK
+  assert rv.headers['etag'] != etag
+  assert find(rv.json()['zones'], zid)['name'] == 'etag test'
+
+
+def test_get_changes(client):
+  """ Only the entities changed since the given version should be returned """
+  rv = client.get('/api')
+  assert rv.status_code == HTTPStatus.OK
+  version = int(rv.headers['x-status-version'])
+  zid = rv.json()['zones'][0]['id']
+  rv = client.patch(f'/api/zones/{zid}', json={'name': 'changes test'})
+  assert rv.status_code == HTTPStatus.OK
+  rv = client.get('/api/changes', params={'since': version})
+  assert rv.status_code == HTTPStatus.OK
+  jrv = rv.json()
+  assert not jrv['resync']
+  assert jrv['version'] > version
+  assert [z['name'] for z in jrv['changes']['zones']['changed']] == ['changes test']
+  assert 'presets' not in jrv['changes']
+  # nothing changed since then
+  rv = client.get('/api/changes', params={'since': jrv['version']})
+  assert rv.json()['changes'] == {}
+  # versions we never handed out require a resync
+  rv = client.get('/api/changes', params={'since': jrv['version'] + 1000})
+  assert rv.json()['resync']
+
+
+def test_stream_state_change_versioned(client):
+  """ A stream changing state on its own is a new version of the status, whichever request notices it first """
+  rv = client.post('/api/stream', json={'name': 'State Radio', 'type': 'internetradio', 'url': 'http://example.com/stream'})
+  assert rv.status_code == HTTPStatus.OK
+  assert client.patch('/api/sources/0', json={'input': f"stream={rv.json()['id']}"}).status_code == HTTPStatus.OK
+  version = int(client.get('/api').headers['x-status-version'])
+  ctrl = amplipi.app.get_ctrl()
+  src = ctrl.status.sources[0]
+  stream = ctrl.get_stream(src)
+  stream.state = 'stopped' if stream.state != 'stopped' else 'playing'
+  # a plain read of the sources notices the change first
+  rv = client.get('/api/sources')
+  assert rv.status_code == HTTPStatus.OK
+  assert find(rv.json()['sources'], src.id)['info']['state'] == stream.state
+  rv = client.get('/api')
+  assert int(rv.headers['x-status-version']) > version
+  jrv = client.get('/api/changes', params={'since': version}).json()
+  assert [s['id'] for s in jrv['changes']['sources']['changed']] == [src.id]
+
+
+def test_stream_state_change_versioned_once(client):
+  """ Readers noticing the same stream state change at the same time only count it once """
+  rv = client.post('/api/stream', json={'name': 'State Radio', 'type': 'internetradio', 'url': 'http://example.com/stream'})
+  assert rv.status_code == HTTPStatus.OK
+  assert client.patch('/api/sources/0', json={'input': f"stream={rv.json()['id']}"}).status_code == HTTPStatus.OK
+  ctrl = amplipi.app.get_ctrl()
+  version = ctrl.get_state_snapshot().version
+  stream = ctrl.get_stream(ctrl.status.sources[0])
+  stream.state = 'stopped' if stream.state != 'stopped' else 'playing'
+  with ThreadPoolExecutor(max_workers=8) as pool:
+    list(pool.map(lambda _: ctrl.get_state(), range(32)))
+  assert ctrl.version == version + 1
+
+
+def test_change_log_overflow():
+  """ Clients have to resync once the changes since their version were pushed out of the change log """
+  changes = amplipi.ctrl.ChangeLog(10, {'zones': [{'id': 0, 'vol': -80}]}, size=2)
+  for version in [11, 12, 13]:
+    changes.record(version, {'zones': [{'id': 0, 'vol': -90 + version}]})
+  assert changes.since(10) is None
+  assert changes.since(11) == {'zones': {'changed': [{'id': 0, 'vol': -77}], 'removed': []}}
+  assert changes.since(13) == {}
+
+
+def test_negotiate_encoding():
+  """ JSON is used unless the client prefers an available binary encoding """
+  encodings = amplipi.encodings
+  assert encodings.negotiate(None) == encodings.JSON
+  assert encodings.negotiate('*/*') == encodings.JSON
+  assert encodings.negotiate('text/html, application/json') == encodings.JSON
+  assert encodings.negotiate('application/json, application/cbor') == encodings.JSON
+  assert encodings.negotiate('application/json;q=0.5, application/cbor') in [encodings.CBOR, encodings.JSON]
+  assert encodings.negotiate('application/x-msgpack') in [encodings.MSGPACK, encodings.JSON]
+  assert encodings.negotiate('application/msgpack;q=0') == encodings.JSON
+
+
+@pytest.mark.parametrize('media_type', ['application/msgpack', 'application/cbor'])
+def test_get_status_binary(client, media_type):
+  """ The status and its collections can be requested in a binary encoding """
+  if media_type not in amplipi.encodings.available():
+    pytest.skip(f'{media_type} encoding not installed')
+  status = client.get('/api').json()
+  rv = client.get('/api', headers={'Accept': media_type})
+  assert rv.status_code == HTTPStatus.OK
+  assert rv.headers['content-type'] == media_type
+  assert amplipi.encodings.decode(rv.content, media_type) == status
+  etag = rv.headers['etag']
+  assert etag != client.get('/api').headers['etag']
+  rv = client.get('/api', headers={'Accept': media_type, 'If-None-Match': etag})
+  assert rv.status_code == HTTPStatus.NOT_MODIFIED
+  for section in ['sources', 'zones', 'groups', 'streams', 'presets']:
+    rv = client.get(f'/api/{section}', headers={'Accept': media_type})
+    assert rv.status_code == HTTPStatus.OK
+    assert amplipi.encodings.decode(rv.content, media_type) == client.get(f'/api/{section}').json()
+
+
+def test_get_bus_stats(client):
+  """ Check the preamp bus statistics, the mocked hardware has no bus """
+  rv = client.get('/api/info/bus')
+  assert rv.status_code == HTTPStatus.OK
+  assert rv.json() == []
+
 # Test Sources
 
 
@@ -478,6 +600,47 @@ def test_get_source_image(client, sid):
   assert rv.headers['content-type'] == 'image/jpg'
   assert int(rv.headers['content-length']) > 100
   assert rv.headers['content-disposition'] == f'attachment; filename="{expected_file}.jpg"'
+  # the cached image can be revalidated
+  etag = rv.headers['etag']
+  rv = client.get(f'/api/sources/{sid}/image/100', headers={'If-None-Match': etag})
+  assert rv.status_code == HTTPStatus.NOT_MODIFIED
+  rv = client.get(f'/api/sources/{sid}/image/50')
+  assert rv.status_code == HTTPStatus.OK
+  assert rv.headers['etag'] != etag
+
+
+@pytest.mark.parametrize('sid', base_source_ids())
+def test_get_source_inputs(client, sid):
+  """ The inputs of a source should follow its streams and its input """
+  def inputs():
+    rv = client.get(f'/api/sources/{sid}/inputs')
+    assert rv.status_code == HTTPStatus.OK
+    return rv.json()
+  assert inputs()[''] == ''
+  rv = client.post('/api/stream', json={'name': 'Inputs Radio', 'type': 'internetradio', 'url': 'http://example.com/stream'})
+  assert rv.status_code == HTTPStatus.OK
+  stream_input = f"stream={rv.json()['id']}"
+  assert inputs()[stream_input].startswith('Inputs Radio')
+  stream_url = f"/api/streams/{rv.json()['id']}"
+  rv = client.patch(stream_url, json={'name': 'Renamed Radio'})
+  assert rv.status_code == HTTPStatus.OK
+  assert inputs()[stream_input].startswith('Renamed Radio')
+  rv = client.patch(stream_url, json={'disabled': True})
+  assert rv.status_code == HTTPStatus.OK
+  assert stream_input not in inputs()  # disabled streams aren't offered
+  rv = client.patch(stream_url, json={'disabled': False})
+  assert rv.status_code == HTTPStatus.OK
+  rv = client.patch(f'/api/sources/{sid}', json={'input': stream_input})
+  assert rv.status_code == HTTPStatus.OK
+  rv = client.patch(stream_url, json={'disabled': True})
+  assert rv.status_code == HTTPStatus.OK
+  assert stream_input in inputs()  # unless they are already connected
+  rv = client.patch(f'/api/sources/{sid}', json={'input': ''})
+  assert rv.status_code == HTTPStatus.OK
+  assert stream_input not in inputs()
+  rv = client.delete(stream_url)
+  assert rv.status_code == HTTPStatus.OK
+  assert stream_input not in inputs()
 
 # Test Zones
 
@@ -1450,6 +1613,48 @@ def test_announcement(client):
     assert future.result(timeout=1.0) == True, "Zone check failed"
 
 
+def test_queue_announcement(client):
+  """ Queue an announcement without waiting for it, then follow its progress """
+  nasa_audio = 'https://www.nasa.gov/wp-content/uploads/2015/01/640150main_Go20at20Throttle20Up.mp3'
+  rv = client.post('/api/announcements', json={'media': nasa_audio})
+  assert rv.status_code == HTTPStatus.OK, print(rv.text)
+  job = rv.json()
+  assert job['state'] in ['queued', 'playing', 'done']
+  for _ in range(50):
+    rv = client.get(f'/api/announcements/{job["id"]}')
+    assert rv.status_code == HTTPStatus.OK, print(rv.text)
+    if rv.json()['state'] == 'done':
+      break
+    sleep(0.1)
+  assert rv.json()['state'] == 'done', 'Timed out waiting for the announcement to finish'
+  assert rv.json()['finished'] >= job['created']
+  rv = client.get('/api/announcements/100000')
+  assert rv.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_announcement_stuck(client, monkeypatch):
+  """ An announcement whose player doesn't stop is given up on, and the previous state is still restored """
+  nasa_audio = 'https://www.nasa.gov/wp-content/uploads/2015/01/640150main_Go20at20Throttle20Up.mp3'
+  monkeypatch.setattr(amplipi.ctrl, 'ANNOUNCEMENT_TIMEOUT', 0.1)
+  monkeypatch.setattr(amplipi.ctrl, 'ANNOUNCEMENT_STOP_TIMEOUT', 0.1)
+  monkeypatch.setattr(amplipi.streams.FilePlayer, 'wait_on_proc', lambda self: sleep(5))
+  before = client.get('/api/sources/0').json()
+  start = monotonic()
+  rv = client.post('/api/announce', json={'media': nasa_audio, 'source_id': 0})
+  assert rv.status_code == HTTPStatus.OK, print(rv.text)
+  assert monotonic() - start < 3, 'Waited for the stuck announcement to finish'
+  assert client.get('/api/sources/0').json()['input'] == before['input']
+
+
+def test_announcement_field_error(client, monkeypatch):
+  """ A failed announcement reports the same error the controller gave for it """
+  ctrl = amplipi.app.get_ctrl()
+  monkeypatch.setattr(ctrl, 'announce', lambda announcement: amplipi.ctrl.ApiResponse.fieldError('media', 'invalid field value'))
+  rv = client.post('/api/announce', json={'media': 'bad'})
+  assert rv.status_code == HTTPStatus.BAD_REQUEST
+  assert rv.json()['detail'] == {'field': 'media', 'msg': 'invalid field value'}
+
+
 def test_api_doc_has_examples(client):
   """Check if each api endpoint has example responses (and requests)"""
   rv = client.get('/openapi.json')  # use json since it is easier to check
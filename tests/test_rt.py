@@ -0,0 +1,177 @@
+""" Test the amplipi low level runtime (using the mocked preamp bus) """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi import rt
+# autopep8: on
+
+# pylint: disable=protected-access
+
+MAIN_UNIT = rt._DEV_ADDRS[0]
+MUTE = rt._REG_ADDRS['MUTE']
+ZONE123_SRC = rt._REG_ADDRS['ZONE123_SRC']
+ZONE456_SRC = rt._REG_ADDRS['ZONE456_SRC']
+
+
+def test_redundant_writes_skipped():
+  """ Writing the same value twice should only issue a single write """
+  preamps = rt._Preamps()
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x3F)
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x3F)
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x01)
+  assert preamps.preamps[MAIN_UNIT][MUTE] == 0x01
+  assert preamps.stats[MAIN_UNIT] == rt.WriteStats(issued=2, skipped=1)
+
+
+def test_first_write_always_issued():
+  """ The reset values are assumed, so the first write of a register can't be skipped """
+  preamps = rt._Preamps()
+  preamps.new_preamp(MAIN_UNIT)
+  default = preamps.preamps[MAIN_UNIT][MUTE]
+  preamps.write_byte_data(MAIN_UNIT, MUTE, default)
+  assert preamps.stats[MAIN_UNIT].issued == 1
+
+
+def test_zone_sources_burst():
+  """ Only the source register that changed should be written """
+  runtime = rt.Rpi()
+  sources = [0] * 6
+  runtime.update_zone_sources(0, sources)
+  sources[4] = 2
+  runtime.update_zone_sources(4, sources)
+  stats = runtime.write_stats()[MAIN_UNIT]
+  assert stats.issued == 3
+  assert stats.skipped == 1
+  assert runtime._bus.preamps[MAIN_UNIT][ZONE123_SRC] == 0x00
+  assert runtime._bus.preamps[MAIN_UNIT][ZONE456_SRC] == 0x08
+
+
+def test_batch_commit():
+  """ Muting every zone in a batch should result in a single mute write per preamp """
+  runtime = rt.Rpi()
+  for preamp in range(2):
+    runtime.update_zone_mutes(preamp * 6, [False] * 12)
+  before = {addr: stats.issued for addr, stats in runtime.write_stats().items()}
+  mutes = [False] * 12
+  with runtime.batch():
+    for zone in range(12):
+      mutes[zone] = True
+      runtime.update_zone_mutes(zone, mutes)
+      runtime.update_zone_vol(zone, -40)
+  for addr in rt._DEV_ADDRS[:2]:
+    # 1 mute + 6 volumes
+    assert runtime.write_stats()[addr].issued - before[addr] == 7
+    assert runtime._bus.preamps[addr][MUTE] == 0x3F
+
+
+def test_batch_unmutes_last():
+  """ Zones should only be unmuted after their volume has been changed """
+  preamps = rt._Preamps()
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x3F)
+  order = preamps._commit_order(MAIN_UNIT, {MUTE: 0x3E, rt._REG_ADDRS['VOL_ZONE1']: 20})
+  assert order == [(MUTE, 0x3F), (rt._REG_ADDRS['VOL_ZONE1'], 20), (MUTE, 0x3E)]
+
+
+class RecordingBus:
+  """ Records the register writes sent to the preamps """
+
+  def __init__(self):
+    self.writes = []
+
+  def write_byte_data(self, addr, reg, data):
+    self.writes.append((addr, reg, data))
+
+  def close(self):
+    pass
+
+
+class SlowBus(RecordingBus):
+  """ Holds the first write until released, so writes pile up in the executor's queue """
+
+  def __init__(self):
+    super().__init__()
+    self.started = threading.Event()
+    self.release = threading.Event()
+
+  def write_byte_data(self, addr, reg, data):
+    self.started.set()
+    self.release.wait(timeout=5)
+    super().write_byte_data(addr, reg, data)
+
+
+def _executor_preamps():
+  preamps = rt._Preamps()
+  preamps.new_preamp(MAIN_UNIT)
+  preamps.bus = SlowBus()
+  preamps.start_executor()
+  return preamps
+
+
+def test_executor_priority():
+  """ Queued writes are sent mutes first, then volumes, then sources, then unmutes """
+  preamps = _executor_preamps()
+  vol1 = rt._REG_ADDRS['VOL_ZONE1']
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x3E)  # in flight, unmutes zone 1
+  assert preamps.bus.started.wait(timeout=5)
+  preamps.write_byte_data(MAIN_UNIT, ZONE123_SRC, 0x01)
+  preamps.write_byte_data(MAIN_UNIT, vol1, 30)
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x3C)  # unmute zone 2
+  preamps.write_byte_data(MAIN_UNIT, MUTE, 0x3D)  # mute zone 1 again, keep zone 2 unmuted
+  preamps.bus.release.set()
+  assert preamps.flush(timeout=5)
+  writes = [(reg, data) for _, reg, data in preamps.bus.writes]
+  assert writes == [(MUTE, 0x3E), (MUTE, 0x3F), (vol1, 30), (ZONE123_SRC, 0x01), (MUTE, 0x3D)]
+  preamps.close()
+
+
+def test_executor_collapse():
+  """ Only the newest value of a pending register write is sent """
+  preamps = _executor_preamps()
+  vol1 = rt._REG_ADDRS['VOL_ZONE1']
+  preamps.write_byte_data(MAIN_UNIT, vol1, 20)
+  assert preamps.bus.started.wait(timeout=5)
+  for vol in range(21, 40):
+    preamps.write_byte_data(MAIN_UNIT, vol1, vol)
+  preamps.bus.release.set()
+  assert preamps.flush(timeout=5)
+  assert [data for _, _, data in preamps.bus.writes] == [20, 39]
+  stats = preamps.stats[MAIN_UNIT]
+  assert (stats.issued, stats.collapsed) == (2, 18)
+  assert preamps.preamps[MAIN_UNIT][vol1] == 39
+  preamps.close()
+
+
+class ReadBus(RecordingBus):
+  """ Fake preamp that remembers its registers, so they can be read back """
+
+  def __init__(self):
+    super().__init__()
+    self.regs = {}
+
+  def write_byte_data(self, addr, reg, data):
+    super().write_byte_data(addr, reg, data)
+    self.regs[(addr, reg)] = data
+
+  def read_byte_data(self, addr, reg):
+    return self.regs.get((addr, reg), 0)
+
+
+def test_verify_repairs_drift():
+  """ A register that reads back wrong twice in a row is rewritten """
+  preamps = rt._Preamps()
+  preamps.new_preamp(MAIN_UNIT)
+  preamps.bus = ReadBus()
+  vol1 = rt._REG_ADDRS['VOL_ZONE1']
+  preamps.write_byte_data(MAIN_UNIT, vol1, 30)
+  assert preamps.verify() == {}
+  preamps.bus.regs[(MAIN_UNIT, vol1)] = 79  # the preamp lost the write
+  assert preamps.verify() == {}  # could still be ramping
+  assert preamps.verify() == {MAIN_UNIT: [vol1]}
+  assert preamps.bus.regs[(MAIN_UNIT, vol1)] == 30
+  assert preamps.bus_stats[MAIN_UNIT].verifications == 3
+  assert preamps.bus_stats[MAIN_UNIT].drift == 1
+  assert sum(preamps.bus_stats[MAIN_UNIT].latency) == 2
@@ -0,0 +1,112 @@
+""" Test the shared memory status segment """
+
+# testing context
+# autopep8: off
+import sys
+import os
+import tempfile
+import time
+from copy import deepcopy
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from amplipi import models, defaults, status_shm
+from amplipi import ctrl
+# autopep8: on
+
+
+def default_status() -> models.Status:
+  """ The default configuration, with some info to publish """
+  status = models.Status(**deepcopy(defaults.DEFAULT_CONFIG))
+  status.info = models.Info(version='0.4.0', serial='212', expanders=['112'])
+  status.sources[0].info = models.SourceInfo(name='Radio - KEXP', state='playing', artist='Artist', track='Track')
+  status.zones[1].mute = False
+  status.zones[1].vol_f = 0.5
+  return status
+
+
+def test_encode_roundtrip():
+  """ The published subset of the status should decode to the same values """
+  status = default_status()
+  shared = status_shm.decode_status(7, status_shm.encode_status(status))
+  assert shared.version == 7
+  assert shared.info == status_shm.SharedInfo('0.4.0', '212', False, ['112'])
+  assert [(s.id, s.name, s.input) for s in shared.sources] == [(s.id, s.name, s.input) for s in status.sources]
+  assert shared.sources[0].info is not None
+  assert shared.sources[0].info.name == 'Radio - KEXP'
+  assert shared.sources[0].info.state == 'playing'
+  assert shared.sources[0].info.album is None
+  assert shared.sources[1].info is None
+  assert [(z.id, z.name, z.source_id, z.mute, z.disabled) for z in shared.zones] == \
+    [(z.id, z.name, z.source_id, z.mute, z.disabled) for z in status.zones]
+  assert abs(shared.zones[1].vol_f - 0.5) < 1e-6
+
+
+def test_reader_follows_writer():
+  """ Readers should see every published version, reusing the decoded status until it changes """
+  path = os.path.join(tempfile.mkdtemp(), 'status')
+  segment = status_shm.StatusSegment(path)
+  reader = status_shm.StatusReader(path)
+  try:
+    assert reader.read() is None  # nothing published yet
+    status = default_status()
+    segment.write(1, status)
+    first = reader.read()
+    assert first is not None and first.version == 1
+    assert reader.read() is first
+    segment.write(1, status)  # unchanged, only the heartbeat is updated
+    assert reader.read() is first
+    status.zones[0].name = 'Kitchen'
+    segment.write(2, status)
+    second = reader.read()
+    assert second is not None and second.version == 2
+    assert second.zones[0].name == 'Kitchen'
+  finally:
+    reader.close()
+    segment.close()
+
+
+def test_reader_skips_torn_and_stale_segments():
+  """ A status that is being written, or whose writer stopped, shouldn't be read """
+  path = os.path.join(tempfile.mkdtemp(), 'status')
+  segment = status_shm.StatusSegment(path)
+  segment.write(1, default_status())
+  try:
+    # pretend the writer is in the middle of an update
+    seq, = status_shm._SEQ.unpack_from(segment._mm, status_shm._SEQ_OFFSET)
+    status_shm._SEQ.pack_into(segment._mm, status_shm._SEQ_OFFSET, seq + 1)
+    assert status_shm.StatusReader(path, retries=3).read() is None
+    status_shm._SEQ.pack_into(segment._mm, status_shm._SEQ_OFFSET, seq)
+    assert status_shm.StatusReader(path).read() is not None
+    # a writer that stopped updating the heartbeat
+    status_shm._HEARTBEAT.pack_into(segment._mm, status_shm._HEARTBEAT_OFFSET, time.monotonic() - 60)
+    assert status_shm.StatusReader(path, stale_after=10).read() is None
+  finally:
+    segment.close()
+
+
+def test_ctrl_publishes_changes(monkeypatch):
+  """ The controller should publish its state, and any change to it, to the segment """
+  folder = tempfile.mkdtemp()
+  path = os.path.join(folder, 'status')
+  monkeypatch.setattr(status_shm, 'SEGMENT_PATH', path)
+  settings = models.AppSettings()
+  settings.config_file = os.path.join(folder, 'house.json')
+  settings.mock_ctrl = True
+  settings.mock_streams = True
+  api = ctrl.Api(settings)
+  reader = status_shm.StatusReader(path)
+  try:
+    def wait_for(check):
+      end = time.monotonic() + 2
+      while time.monotonic() < end:
+        shared = reader.read()
+        if shared is not None and check(shared):
+          return shared
+        time.sleep(0.01)
+      return None
+    assert wait_for(lambda s: len(s.zones) == len(api.status.zones) and len(s.sources) == len(api.status.sources))
+    api.set_zone(0, models.ZoneUpdate(name='Patio'))
+    shared = wait_for(lambda s: s.zones[0].name == 'Patio')
+    assert shared is not None and shared.version == api.version
+  finally:
+    reader.close()
+    api._stop_workers()
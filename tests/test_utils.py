@@ -1,3 +1,5 @@
+import threading
+import time
 import context
 
 def test_get_folder():
@@ -5,3 +7,97 @@ def test_get_folder():
   assert context.amplipi.utils.get_folder("streams", mock=True).endswith("/amplipi-dev/streams")
   assert context.amplipi.utils.get_folder("web", mock=True).endswith("/.config/amplipi/web")
   assert context.amplipi.utils.get_folder("config", mock=True).endswith("/.config/amplipi")
+
+
+def test_status_delta():
+  """ Only the changed entities should be part of a status delta """
+  old = context.amplipi.models.Status(zones=[context.amplipi.models.Zone(id=i, name=f'Zone {i}') for i in range(3)])
+  new = old.copy(deep=True)
+  new.zones[1].vol = -40
+  new.zones.pop(2)
+  utils = context.amplipi.utils
+  assert utils.status_delta(old.dict(), old.dict()) == {}
+  delta = utils.status_delta(old.dict(), new.dict())
+  assert list(delta.keys()) == ['zones']
+  assert delta['zones']['changed'] == [new.zones[1].dict()]
+  assert delta['zones']['removed'] == [2]
+
+
+def test_apply_status_delta():
+  """ Applying a status delta to the old status should give the new status """
+  old = context.amplipi.models.Status(zones=[context.amplipi.models.Zone(id=i, name=f'Zone {i}') for i in range(3)])
+  new = old.copy(deep=True)
+  new.zones[1].vol = -40
+  new.zones.pop(2)
+  new.zones.append(context.amplipi.models.Zone(id=5, name='Zone 5'))
+  utils = context.amplipi.utils
+  delta = utils.status_delta(old.dict(), new.dict())
+  assert utils.apply_status_delta(old.dict(), delta) == new.dict()
+  # applying a delta twice has no further effect
+  assert utils.apply_status_delta(utils.apply_status_delta(old.dict(), delta), delta) == new.dict()
+
+
+def test_merge_status_deltas():
+  """ A merged delta should take the old status to the status after the last delta """
+  Zone = context.amplipi.models.Zone
+  states = [context.amplipi.models.Status(zones=[Zone(id=i, name=f'Zone {i}') for i in range(3)])]
+  for change in range(3):
+    state = states[-1].copy(deep=True)
+    if change == 0:
+      state.zones[1].vol = -40
+      state.zones.pop(2)
+    elif change == 1:
+      state.zones.append(Zone(id=2, name='Zone 2 again'))
+      state.zones[1].vol = -30
+    else:
+      state.zones.pop(0)
+    states.append(state)
+  utils = context.amplipi.utils
+  deltas = [utils.status_delta(old.dict(), new.dict()) for old, new in zip(states, states[1:])]
+  merged = utils.merge_status_deltas(deltas)
+  assert merged['zones']['removed'] == [0]
+  assert [z['id'] for z in merged['zones']['changed']] == [1, 2]
+  assert utils.apply_status_delta(states[0].dict(), merged) == states[-1].dict()
+  assert utils.merge_status_deltas([]) == {}
+
+
+def test_rwlock():
+  """ Readers share the lock, a writer waits for them and blocks new readers """
+  lock = context.amplipi.utils.RWLock()
+  events = []
+  lock.acquire_read()
+  with lock.reading():  # reentrant reads
+    pass
+  writer = threading.Thread(target=lambda: (lock.acquire_write(), events.append('write'), lock.release_write()))
+  writer.start()
+  time.sleep(0.05)
+  assert events == []  # the writer waits for the reader
+  reader = threading.Thread(target=lambda: (lock.acquire_read(), events.append('read'), lock.release_read()))
+  reader.start()
+  time.sleep(0.05)
+  assert events == []  # new readers wait for the waiting writer
+  lock.release_read()
+  writer.join(timeout=1)
+  reader.join(timeout=1)
+  assert events == ['write', 'read']
+  with lock.writing():
+    with lock.writing(), lock.reading():  # a writer can nest writes and reads
+      pass
+
+
+def test_status_delta_removed_field():
+  """ A field missing from the new status should be removed by the delta """
+  utils = context.amplipi.utils
+  old = {'info': {'version': '0.4.0'}, 'zones': [{'id': 0, 'name': 'Zone 0'}]}
+  new = {'zones': [{'id': 0, 'name': 'Zone 0'}]}
+  delta = utils.status_delta(old, new)
+  assert delta == {'info': None}
+  assert utils.apply_status_delta(dict(old), delta) == new
+  # the field coming back replaces the removal, and later entity changes apply to it
+  readded = {'info': {'version': '0.4.1'}, 'zones': [{'id': 1, 'name': 'Zone 1'}]}
+  renamed = {'info': {'version': '0.4.1'}, 'zones': [{'id': 1, 'name': 'Kitchen'}]}
+  deltas = [delta, utils.status_delta(new, {'zones': []}), utils.status_delta({'zones': []}, {}),
+            utils.status_delta({}, readded), utils.status_delta(readded, renamed)]
+  merged = utils.merge_status_deltas(deltas)
+  assert utils.apply_status_delta(dict(old), merged) == renamed
+  assert utils.apply_status_delta(dict(old), utils.merge_status_deltas(deltas[:3])) == {}